@@ -0,0 +1,97 @@
+# app/api/analytics.py
+from datetime import datetime, timedelta, timezone
+from typing import Optional
+
+from fastapi import APIRouter, Depends, HTTPException, Query
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+
+from app.api.auth import get_current_user
+from app.core import metrics
+from app.db import SessionLocal
+from app.models.events import ActivityRollup, QueryRollup
+from app.services.events import percentile, LATENCY_BUCKETS_MS
+
+router = APIRouter(prefix="/api/analytics", tags=["analytics"])
+
+def get_db():
+    db = SessionLocal()
+    try:
+        yield db
+    finally:
+        db.close()
+
+def _target_user(me, user_id: Optional[int]) -> int:
+    """Users see their own numbers; admins may ask for anyone's."""
+    if user_id is None or user_id == me.id:
+        return me.id
+    if me.role != "admin":
+        raise HTTPException(status_code=403, detail="Admin only")
+    return user_id
+
+def _since(hours: int) -> datetime:
+    now = datetime.now(tz=timezone.utc).replace(minute=0, second=0, microsecond=0)
+    return now - timedelta(hours=hours - 1)
+
+# ==============
+# GET /usage
+# ==============
+@router.get("/usage")
+def usage(
+    hours: int = Query(24, ge=1, le=24 * 90),
+    action: Optional[str] = Query(None, description="search | ask | chat | upload | delete"),
+    user_id: Optional[int] = Query(None, description="Admin only: another user's stats"),
+    db: Session = Depends(get_db),
+    me = Depends(get_current_user),
+):
+    """Per-hour counts and latency percentiles, read from the rollup table only."""
+    uid = _target_user(me, user_id)
+    q = db.query(ActivityRollup).filter(ActivityRollup.user_id == uid, ActivityRollup.hour >= _since(hours))
+    if action:
+        q = q.filter(ActivityRollup.action == action)
+
+    out = []
+    for r in q.order_by(ActivityRollup.hour.asc(), ActivityRollup.action.asc()).all():
+        hist = r.latency_hist or [0] * len(LATENCY_BUCKETS_MS)
+        timed = sum(hist)
+        out.append({
+            "hour": r.hour,
+            "action": r.action,
+            "count": r.count,
+            "avg_ms": round(r.latency_sum_ms / timed, 1) if timed else None,
+            "p50_ms": percentile(hist, 50),
+            "p95_ms": percentile(hist, 95),
+            "p99_ms": percentile(hist, 99),
+        })
+    return {"user_id": uid, "hours": hours, "rows": out}
+
+# ==============
+# GET /top-queries
+# ==============
+@router.get("/top-queries")
+def top_queries(
+    hours: int = Query(24, ge=1, le=24 * 90),
+    limit: int = Query(10, ge=1, le=100),
+    user_id: Optional[int] = Query(None, description="Admin only: another user's stats"),
+    db: Session = Depends(get_db),
+    me = Depends(get_current_user),
+):
+    uid = _target_user(me, user_id)
+    total = func.sum(QueryRollup.count).label("count")
+    rows = (
+        db.query(QueryRollup.query, total)
+        .filter(QueryRollup.user_id == uid, QueryRollup.hour >= _since(hours))
+        .group_by(QueryRollup.query)
+        .order_by(total.desc())
+        .limit(limit)
+        .all()
+    )
+    return {"user_id": uid, "hours": hours, "queries": [{"query": q, "count": int(n)} for q, n in rows]}
+
+# ==============
+# GET /metrics
+# ==============
+@router.get("/metrics")
+def get_metrics(me = Depends(get_current_user)):
+    """In-process counters (event buffer, caches, ...) for this worker."""
+    return metrics.snapshot()
@@ -1,9 +1,20 @@
+from collections import OrderedDict
+import threading
+import time
+
 from fastapi import APIRouter, Depends, HTTPException, status, Header
+from fastapi.concurrency import run_in_threadpool
 from pydantic import BaseModel, EmailStr
+from sqlalchemy import event
 from sqlalchemy.orm import Session
+from app.core import metrics
+from app.core.config import settings
 from app.db import SessionLocal
 from app.models.user import User
-from app.core.security import hash_password, verify_password, create_access_token, decode_token
+from app.core.security import (
+    hash_password_async, verify_password_async, create_access_token, decode_token,
+    HashQueueFull, hash_queue_stats,
+)
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 router = APIRouter(prefix="/api/auth", tags=["auth"])
 security = HTTPBearer(auto_error=True)
@@ -16,16 +27,80 @@ def get_db():
     finally:
         db.close()
 
+# ---- authenticated-user cache ----
+# sub -> detached User snapshot. Entries expire after AUTH_USER_CACHE_TTL_SECONDS
+# and are dropped as soon as a User row is updated/deleted in this process.
+class _UserCache:
+    def __init__(self, ttl: int, max_items: int):
+        self.ttl, self.max_items = ttl, max_items
+        self._items: "OrderedDict[str, tuple[float, User]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = self.misses = 0
+
+    def get(self, sub: str) -> User | None:
+        if self.ttl <= 0:
+            return None
+        with self._lock:
+            item = self._items.get(sub)
+            if item is None or item[0] < time.monotonic():
+                self._items.pop(sub, None)
+                self.misses += 1
+                return None
+            self._items.move_to_end(sub)
+            self.hits += 1
+            return item[1]
+
+    def put(self, sub: str, user: User) -> None:
+        if self.ttl <= 0:
+            return
+        with self._lock:
+            self._items[sub] = (time.monotonic() + self.ttl, user)
+            self._items.move_to_end(sub)
+            while len(self._items) > self.max_items:
+                self._items.popitem(last=False)
+
+    def invalidate(self, user_id: int) -> None:
+        with self._lock:
+            self._items.pop(str(user_id), None)
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {"size": len(self._items), "hits": self.hits, "misses": self.misses,
+                "hit_rate": round(self.hits / total, 4) if total else None,
+                "password_hash": hash_queue_stats()}
+
+user_cache = _UserCache(settings.AUTH_USER_CACHE_TTL_SECONDS, settings.AUTH_USER_CACHE_SIZE)
+metrics.register("auth", user_cache.stats)
+
+@event.listens_for(User, "after_update")
+@event.listens_for(User, "after_delete")
+def _drop_cached_user(mapper, connection, target):
+    user_cache.invalidate(target.id)
+
+def _hash_busy() -> HTTPException:
+    return HTTPException(status_code=503, detail="Authentication busy, retry shortly",
+                         headers={"Retry-After": "1"})
+
 class RegisterIn(BaseModel):
     email: EmailStr
     password: str
 
 @router.post("/register", status_code=201)
-def register(data: RegisterIn, db: Session = Depends(get_db)):
-    if db.query(User).filter(User.email == data.email).first():
+async def register(data: RegisterIn, db: Session = Depends(get_db)):
+    def exists() -> bool:
+        return db.query(User).filter(User.email == data.email).first() is not None
+    if await run_in_threadpool(exists):
         raise HTTPException(status_code=409, detail="Email already registered")
-    user = User(email=data.email, password_hash=hash_password(data.password))
-    db.add(user); db.commit(); db.refresh(user)
+    try:
+        pw_hash = await hash_password_async(data.password)
+    except HashQueueFull:
+        raise _hash_busy()
+
+    def create() -> User:
+        user = User(email=data.email, password_hash=pw_hash)
+        db.add(user); db.commit(); db.refresh(user)
+        return user
+    user = await run_in_threadpool(create)
     return {"id": user.id, "email": user.email}
 
 class LoginIn(BaseModel):
@@ -33,22 +108,33 @@ class LoginIn(BaseModel):
     password: str
 
 @router.post("/login")
-def login(data: LoginIn, db: Session = Depends(get_db)):
-    user = db.query(User).filter(User.email == data.email).first()
-    if not user or not verify_password(data.password, user.password_hash):
+async def login(data: LoginIn, db: Session = Depends(get_db)):
+    user = await run_in_threadpool(lambda: db.query(User).filter(User.email == data.email).first())
+    try:
+        ok = bool(user) and await verify_password_async(data.password, user.password_hash)
+    except HashQueueFull:
+        raise _hash_busy()
+    if not ok:
         raise HTTPException(status_code=401, detail="Invalid credentials")
     token = create_access_token(user.id)
     return {"access_token": token, "token_type": "bearer"}
 
 def get_current_user(
     credentials: HTTPAuthorizationCredentials = Depends(security),
-    db: Session = Depends(get_db),
 ) -> User:
     token = credentials.credentials  # value after "Bearer "
     payload = decode_token(token)
-    user = db.query(User).get(int(payload["sub"]))
-    if not user:
-        raise HTTPException(status_code=401, detail="User not found")
+    sub = str(payload["sub"])
+    user = user_cache.get(sub)
+    if user is not None:
+        return user
+    # cache miss: one lookup, then keep a detached copy for the next requests
+    with SessionLocal() as db:
+        user = db.get(User, int(sub))
+        if not user:
+            raise HTTPException(status_code=401, detail="User not found")
+        db.expunge(user)
+    user_cache.put(sub, user)
     return user
 
 
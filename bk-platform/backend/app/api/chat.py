@@ -0,0 +1,293 @@
+# app/api/chat.py
+from __future__ import annotations
+from collections import OrderedDict
+from typing import List, Dict, Any, Optional
+import threading
+import time
+
+import numpy as np
+from fastapi import APIRouter, Depends, Body, HTTPException
+from pydantic import BaseModel, Field
+from sqlalchemy.orm import Session
+
+from app.api.auth import get_current_user
+from app.api.knowledge import (
+    SYSTEM_PROMPT, NOT_FOUND, _gate_rows, _has_phrase, _build_context, _final_answer, _citations, _llm_http_error,
+)
+from app.core.config import settings
+from app.db import SessionLocal
+from app.models.chat import ChatSession, ChatMessage, ChatSummary
+from app.models.document import Document
+from app.services.context import TokenCounter, mmr_select
+from app.services.embeddings import embed_query
+from app.services.events import record_event
+from app.services.llm import chat as llm_chat, answer_tokens, LLMError
+from app.services.rerank import rerank
+from app.services.terms import TERMS_META_KEY, keyword_mask
+from app.vector.chroma_client import get_collection
+
+router = APIRouter(prefix="/api/chat", tags=["chat"])
+
+def get_db():
+    db = SessionLocal()
+    try:
+        yield db
+    finally:
+        db.close()
+
+# ---------- request/response models ----------
+class SessionCreate(BaseModel):
+    title: str | None = Field(None, max_length=255)
+
+class TurnRequest(BaseModel):
+    message: str = Field(..., min_length=2)
+    k: int = Field(8, ge=1, le=20)
+    max_context_tokens: int = Field(800, ge=200, le=4000)
+    require_all_terms: bool = False
+    phrase: str | None = None
+    provider: str | None = None
+    model: str | None = None
+    rerank: bool | None = None
+    timeout_seconds: float | None = Field(None, gt=0, le=600)
+    max_answer_chars: int = Field(140, ge=30, le=600)
+
+class TurnResponse(BaseModel):
+    session_id: int
+    answer: str
+    citations: List[Dict[str, Any]]
+    reused_context: bool
+
+# ---------- per-session retrieval cache ----------
+# session_id -> retrieved pool (with chunk embeddings) for the current topic.
+# Process-local: another worker or a restart just retrieves again.
+class _TopicCache:
+    def __init__(self, max_items: int, ttl: int):
+        self.max_items, self.ttl = max_items, ttl
+        self._items: "OrderedDict[int, Dict[str, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, session_id: int) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            item = self._items.get(session_id)
+            if item is None:
+                return None
+            if time.monotonic() - item["at"] > self.ttl:
+                del self._items[session_id]
+                return None
+            self._items.move_to_end(session_id)
+            return item
+
+    def put(self, session_id: int, q_emb: np.ndarray, rows: List[Dict[str, Any]]) -> None:
+        with self._lock:
+            self._items[session_id] = {"q_emb": q_emb, "rows": rows, "at": time.monotonic()}
+            self._items.move_to_end(session_id)
+            while len(self._items) > self.max_items:
+                self._items.popitem(last=False)
+
+    def drop(self, session_id: int) -> None:
+        with self._lock:
+            self._items.pop(session_id, None)
+
+_topics = _TopicCache(settings.CHAT_CONTEXT_CACHE_SIZE, settings.CHAT_CONTEXT_TTL_SECONDS)
+
+def _live(db: Session, rows: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Drop rows of documents deleted since they were retrieved (or cached)."""
+    ids = {r["document_id"] for r in rows}
+    if not ids:
+        return rows
+    alive = {doc_id for (doc_id,) in db.query(Document.id).filter(Document.id.in_(ids))}
+    return [r for r in rows if r["document_id"] in alive]
+
+def _retrieve(db: Session, session_id: int, user_id: int, q: str, q_emb: np.ndarray, payload: TurnRequest):
+    """Gated rows for this turn and whether they came from the session's cached pool."""
+    cached = _topics.get(session_id)
+    if cached is not None and float(q_emb @ cached["q_emb"]) >= settings.CHAT_TOPIC_SIMILARITY:
+        pool = [r for r in cached["rows"] if r.get("embedding") is not None]
+        if pool:
+            # same topic: the new question goes through the same gates as /ask
+            # (stored term ids, phrase), then the pool is re-scored locally
+            keep = keyword_mask(q, [r["content"] for r in pool],
+                                [{TERMS_META_KEY: r.get("terms")} for r in pool], payload.require_all_terms)
+            pool = [r for ok, r in zip(keep, pool)
+                    if ok and not (payload.phrase and not _has_phrase(r["content"], payload.phrase))]
+            pool = _live(db, pool)
+        if pool:
+            E = np.asarray([r["embedding"] for r in pool], dtype=np.float32)
+            sims = E @ q_emb
+            rows = [{**r, "score": float(s)} for r, s in zip(pool, sims)]
+            for r in rows:
+                r.pop("rerank_score", None)
+            return rows, True
+
+    res = get_collection().query(
+        query_embeddings=[q_emb.tolist()],
+        n_results=max(payload.k * 4, 20),
+        where={"user_id": user_id},
+        include=["documents", "metadatas", "distances", "embeddings"],
+    )
+    rows = _live(db, _gate_rows(res, 0, q, payload.require_all_terms, payload.phrase))
+    if rows:
+        _topics.put(session_id, q_emb, [dict(r) for r in rows])
+    return rows, False
+
+# ---------- conversation memory ----------
+SUMMARY_PROMPT = (
+    "Summarize the conversation below for later reference. Keep names, numbers, "
+    "document names and open questions. At most 5 short sentences. No preamble."
+)
+
+def _summarize(previous: str, turns: List[ChatMessage], payload: TurnRequest, counter: TokenCounter) -> str:
+    transcript = "\n".join(f"{m.role}: {m.content}" for m in turns)
+    text = f"Earlier summary: {previous}\n\n{transcript}" if previous else transcript
+    try:
+        summary = llm_chat(
+            [{"role": "system", "content": SUMMARY_PROMPT}, {"role": "user", "content": text}],
+            provider=payload.provider or "hf", model=payload.model,
+            max_tokens=settings.CHAT_SUMMARY_MAX_TOKENS,
+        ).strip()
+    except Exception:
+        summary = ""
+    limit = settings.CHAT_SUMMARY_MAX_TOKENS
+    if summary:
+        return counter.truncate(summary, limit)
+    # LLM unavailable: keep the most recent lines that fit
+    kept: List[str] = []
+    for line in reversed(text.splitlines()):
+        if counter.count("\n".join([line] + kept)) > limit:
+            break
+        kept.insert(0, line)
+    return "\n".join(kept)
+
+def _own_session(db: Session, session_id: int, user_id: int) -> ChatSession:
+    s = (
+        db.query(ChatSession)
+        .filter(ChatSession.id == session_id, ChatSession.user_id == user_id)
+        .first()
+    )
+    if not s:
+        raise HTTPException(status_code=404, detail="Chat session not found")
+    return s
+
+# ---------- routes ----------
+@router.post("/sessions", status_code=201)
+def create_session(
+    data: SessionCreate = Body(default=SessionCreate()),
+    db: Session = Depends(get_db),
+    me = Depends(get_current_user),
+):
+    s = ChatSession(user_id=me.id, title=data.title)
+    db.add(s); db.commit(); db.refresh(s)
+    return {"id": s.id, "title": s.title, "created_at": s.created_at}
+
+@router.get("/sessions")
+def list_sessions(db: Session = Depends(get_db), me = Depends(get_current_user)):
+    rows = (
+        db.query(ChatSession)
+        .filter(ChatSession.user_id == me.id)
+        .order_by(ChatSession.id.desc())
+        .all()
+    )
+    return [{"id": s.id, "title": s.title, "created_at": s.created_at} for s in rows]
+
+@router.get("/sessions/{session_id}")
+def get_session(session_id: int, db: Session = Depends(get_db), me = Depends(get_current_user)):
+    s = _own_session(db, session_id, me.id)
+    msgs = (
+        db.query(ChatMessage)
+        .filter(ChatMessage.session_id == s.id)
+        .order_by(ChatMessage.id.asc())
+        .all()
+    )
+    summary = db.get(ChatSummary, s.id)
+    return {
+        "id": s.id,
+        "title": s.title,
+        "created_at": s.created_at,
+        "summary": summary.content if summary else None,
+        "messages": [
+            {"id": m.id, "role": m.role, "content": m.content, "timestamp": m.timestamp}
+            for m in msgs
+        ],
+    }
+
+@router.delete("/sessions/{session_id}", status_code=204)
+def delete_session(session_id: int, db: Session = Depends(get_db), me = Depends(get_current_user)):
+    s = _own_session(db, session_id, me.id)
+    db.query(ChatMessage).filter(ChatMessage.session_id == s.id).delete()
+    db.query(ChatSummary).filter(ChatSummary.session_id == s.id).delete()
+    db.delete(s)
+    db.commit()
+    _topics.drop(session_id)
+    return
+
+@router.post("/sessions/{session_id}/messages", response_model=TurnResponse)
+def send_message(
+    session_id: int,
+    payload: TurnRequest = Body(...),
+    db: Session = Depends(get_db),
+    me = Depends(get_current_user),
+):
+    s = _own_session(db, session_id, me.id)
+    q = payload.message.strip()
+    t0 = time.perf_counter()
+    provider = payload.provider or "hf"
+    counter = TokenCounter(provider, payload.model)
+
+    # 1) Memory: rolling summary + turns it doesn't cover yet
+    summary = db.get(ChatSummary, s.id)
+    recent = (
+        db.query(ChatMessage)
+        .filter(ChatMessage.session_id == s.id, ChatMessage.id > (summary.until_message_id if summary else 0))
+        .order_by(ChatMessage.id.asc())
+        .all()
+    )
+
+    # 2) Retrieval, reusing the session's pool while the topic holds
+    q_emb = np.asarray(embed_query(q), dtype=np.float32)
+    rows, reused = _retrieve(db, s.id, me.id, q, q_emb, payload)
+
+    if rows:
+        rows.sort(key=lambda r: r["score"], reverse=True)
+        if payload.rerank if payload.rerank is not None else settings.RERANK_ENABLED:
+            rows = rerank(q, rows)
+        top = mmr_select(rows, payload.k, lambda_mult=settings.CONTEXT_MMR_LAMBDA)
+        context = _build_context(top, payload.max_context_tokens, counter)
+
+        messages = [{"role": "system", "content": SYSTEM_PROMPT}]
+        if summary and summary.content:
+            messages.append({"role": "system", "content": f"Conversation so far: {summary.content}"})
+        messages += [{"role": m.role, "content": m.content} for m in recent]
+        messages.append({"role": "user", "content": f"Question: {q}\n\nContext:\n{context}"})
+        try:
+            raw = llm_chat(messages, provider=provider, model=payload.model, deadline=payload.timeout_seconds,
+                           max_tokens=answer_tokens(payload.max_answer_chars),
+                           prompt_tokens=counter.count_messages(messages))
+        except LLMError as e:
+            raise _llm_http_error(e)
+        answer = _final_answer(raw.strip(), payload.max_answer_chars)
+        citations = _citations(top, db)
+    else:
+        top, answer, citations = [], NOT_FOUND, []
+
+    # 3) Fold turns beyond the recent window into the summary once a full
+    #    window has piled up (one summarization per N turns, not per turn)
+    keep = 2 * settings.CHAT_RECENT_TURNS
+    if len(recent) >= 2 * keep:
+        fold = recent[: len(recent) - keep]
+        if summary is None:
+            summary = ChatSummary(session_id=s.id, content="", until_message_id=0)
+            db.add(summary)
+        summary.content = _summarize(summary.content, fold, payload, counter)
+        summary.until_message_id = fold[-1].id
+
+    # 4) One commit for the whole turn
+    db.add_all([
+        ChatMessage(session_id=s.id, role="user", content=q),
+        ChatMessage(session_id=s.id, role="assistant", content=answer),
+    ])
+    if not s.title:
+        s.title = q[:80]
+    db.commit()
+
+    record_event(me.id, "chat", query=q, resource_id=s.id, latency_ms=(time.perf_counter() - t0) * 1000)
+    return TurnResponse(session_id=s.id, answer=answer, citations=citations, reused_context=reused)
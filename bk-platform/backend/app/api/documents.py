@@ -1,19 +1,33 @@
 # app/api/documents.py
 
 from typing import Optional, List
+import logging
+import time
 
-from fastapi import APIRouter, Depends, UploadFile, File, HTTPException, Query
+from fastapi import APIRouter, Depends, UploadFile, File, HTTPException, Query, Request
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import Response, StreamingResponse
 from sqlalchemy.orm import Session
 
+from app.core.config import settings
 from app.db import SessionLocal
 from app.api.auth import get_current_user
 from app.models.document import Document
 from app.models.chunk import DocumentChunk
-from app.services.files import save_upload_file
-from app.services.text_extract import extract_text_from_bytes
-from app.services.ingest import ingest_text_for_document
+from app.models.outbox import VectorOutbox
+from app.services.extract_pool import ExtractionError, ExtractionTimeout
+from app.services.files import save_upload_file, save_upload_stream, open_blob, queue_blob_delete, sweep_blobs
+from app.services.text_cache import get_cached_text_gz, get_or_extract
+from app.services.text_extract import EXTRACTOR_VERSION
+from app.services.ingest import ingest_chunks_for_document, ingest_text_for_document
+from app.services.outbox import drain_document
+from app.services.streaming import is_csv, is_streamable, iter_decoded, iter_document_chunks
+from app.services.doc_vectors import delete_document_vectors
+from app.services.dedup import release_document
+from app.services.events import record_event
 
 router = APIRouter(prefix="/api/documents", tags=["documents"])
+log = logging.getLogger(__name__)
 
 # ---- DB session dependency (local helper)
 def get_db():
@@ -24,21 +38,53 @@ def get_db():
         db.close()
 
 
+def _ingest_stream(db: Session, d: Document) -> int:
+    """Decode, chunk and insert a streamable (.txt/.csv/.json/.log) document straight from its blob."""
+    row_groups = bool((d.metadata_json or {}).get("csv_row_groups"))
+    with open_blob(d.path) as f:
+        return ingest_chunks_for_document(
+            db,
+            chunks=iter_document_chunks(f, d.filename, d.mime_type, row_groups),
+            document_id=d.id,
+            user_id=d.user_id,
+            filename=d.filename,
+        )
+
+
+def _drain_promoted(document_ids: List[int]) -> None:
+    # chunks promoted to canonical (see dedup.release_document) need vectors of their own now
+    if settings.OUTBOX_INLINE_DRAIN:
+        for doc_id in document_ids:
+            drain_document(doc_id)
+
+
 # ==============
 # POST /upload
 # ==============
 @router.post("/upload")
 async def upload_document(
     file: UploadFile = File(...),
+    csv_row_groups: Optional[bool] = Query(None, description="CSV only: chunk by row groups with the header repeated"),
     db: Session = Depends(get_db),
     me = Depends(get_current_user),
 ):
     """
-    Accept a single file (PDF/DOCX/TXT/MD), save to /uploads, extract text,
-    chunk+embed into Chroma, and persist chunks in DB.
+    Accept a single file (PDF/DOCX/TXT/MD/CSV/JSON), save to the blob store, extract text,
+    chunk+embed into Chroma, and persist chunks in DB. Plain-text formats are
+    streamed end to end (spool, decode, chunk, insert) in constant memory.
     """
-    # Save to disk with size guard and MIME
-    path, size, mime, data = save_upload_file(file)
+    t0 = time.perf_counter()
+    # Everything below blocks (disk, DB, extraction, embedding): the event loop only awaits
+    # Save to the blob store with size guard and MIME
+    streaming = is_streamable(file.filename, file.content_type)
+    if streaming:
+        path, size, mime = await run_in_threadpool(save_upload_stream, file)
+        data = None
+    else:
+        path, size, mime, data = await run_in_threadpool(save_upload_file, file)
+    metadata = {"original_name": file.filename}
+    if streaming and is_csv(file.filename, mime):
+        metadata["csv_row_groups"] = settings.CSV_ROW_GROUPS if csv_row_groups is None else csv_row_groups
 
     # Create document row
     doc = Document(
@@ -47,32 +93,63 @@ async def upload_document(
         path=path,
         size=size,
         mime_type=mime,
-        metadata_json={"original_name": file.filename},
+        metadata_json=metadata,
     )
-    db.add(doc)
-    db.commit()
-    db.refresh(doc)
 
-    # Extract text
-    text = extract_text_from_bytes(data, file.filename, mime)
+    def create():
+        db.add(doc)
+        db.commit()
+        db.refresh(doc)
+    await run_in_threadpool(create)
+
+    # Extract text in the isolated worker pool (cached per blob hash, so re-uploads
+    # of the same bytes skip OCR). A file that times out or blows the memory cap
+    # keeps its document row and can be retried via /reindex.
+    extraction = "ok"
+    try:
+        if streaming:
+            text = ""  # chunked straight from the blob below
+        else:
+            text, _ = await run_in_threadpool(get_or_extract, path, file.filename, mime, data)
+    except ExtractionTimeout:
+        log.warning("text extraction timed out for document %s", doc.id)
+        text, extraction = "", "timeout"
+    except ExtractionError as e:
+        log.warning("text extraction failed for document %s: %s", doc.id, e)
+        text, extraction = "", "failed"
 
     ingested_chunks = 0
-    if text and text.strip():
+    if streaming:
+        ingested_chunks = await run_in_threadpool(_ingest_stream, db, doc)
+    elif text and text.strip():
         # Persist chunks in DB and upsert to vectorstore
-        ingested_chunks = ingest_text_for_document(
-            db,
-            text=text,
-            document_id=doc.id,
-            user_id=me.id,
-            filename=file.filename,
+        ingested_chunks = await run_in_threadpool(
+            lambda: ingest_text_for_document(
+                db,
+                text=text,
+                document_id=doc.id,
+                user_id=me.id,
+                filename=file.filename,
+            )
         )
 
+    # "indexed" once the outbox entry is drained; "pending" means the worker will retry
+    vector_status = await run_in_threadpool(
+        lambda: db.query(VectorOutbox.status)
+        .filter(VectorOutbox.document_id == doc.id)
+        .order_by(VectorOutbox.id.desc())
+        .scalar()
+    ) if ingested_chunks else None
+
+    record_event(me.id, "upload", resource_id=doc.id, latency_ms=(time.perf_counter() - t0) * 1000)
     return {
         "id": doc.id,
         "filename": doc.filename,
         "size": size,
         "mime_type": mime,
         "ingested_chunks": ingested_chunks,
+        "extraction": extraction,
+        "vector_status": {"done": "indexed"}.get(vector_status, vector_status),
     }
 
 
@@ -152,6 +229,110 @@ def get_document(
     }
 
 
+def _owned_document(db: Session, doc_id: int, user_id: int) -> Document:
+    d = (
+        db.query(Document)
+        .filter(Document.id == doc_id, Document.user_id == user_id)
+        .first()
+    )
+    if not d:
+        raise HTTPException(status_code=404, detail="Document not found")
+    return d
+
+
+# ==============
+# GET /{id}/text
+# ==============
+@router.get("/{doc_id}/text")
+def get_document_text(
+    doc_id: int,
+    request: Request,
+    db: Session = Depends(get_db),
+    me = Depends(get_current_user),
+):
+    """
+    Full extracted text of a document (text/plain). Served from the text cache;
+    clients that accept gzip get the stored artifact as-is.
+    """
+    d = _owned_document(db, doc_id, me.id)
+    headers = {"X-Extractor-Version": EXTRACTOR_VERSION}
+    if is_streamable(d.filename, d.mime_type):
+        # the blob *is* the text: decode it on the fly instead of caching a copy
+        try:
+            f = open_blob(d.path)
+        except FileNotFoundError:
+            raise HTTPException(status_code=410, detail="Original file is no longer available")
+
+        def body():
+            with f:
+                yield from iter_decoded(f)
+        return StreamingResponse(body(), media_type="text/plain; charset=utf-8", headers=headers)
+    gz = get_cached_text_gz(d.path)
+    if gz is not None and "gzip" in request.headers.get("accept-encoding", ""):
+        headers["Content-Encoding"] = "gzip"
+        return Response(gz, media_type="text/plain; charset=utf-8", headers=headers)
+    try:
+        text, _ = get_or_extract(d.path, d.filename, d.mime_type)
+    except FileNotFoundError:
+        raise HTTPException(status_code=410, detail="Original file is no longer available")
+    except ExtractionError as e:
+        raise HTTPException(status_code=422, detail=f"Text extraction failed: {e}")
+    return Response(text, media_type="text/plain; charset=utf-8", headers=headers)
+
+
+# ==============
+# POST /{id}/reindex
+# ==============
+@router.post("/{doc_id}/reindex")
+def reindex_document(
+    doc_id: int,
+    db: Session = Depends(get_db),
+    me = Depends(get_current_user),
+):
+    """Re-chunk and re-embed a document from its cached text (extracting only on a cache miss)."""
+    d = _owned_document(db, doc_id, me.id)
+    streaming = is_streamable(d.filename, d.mime_type)
+    try:
+        if streaming:
+            open_blob(d.path).close()  # fail before dropping the old chunks
+            text, cached = "", False
+        else:
+            text, cached = get_or_extract(d.path, d.filename, d.mime_type)
+    except FileNotFoundError:
+        raise HTTPException(status_code=410, detail="Original file is no longer available")
+    except ExtractionError as e:
+        raise HTTPException(status_code=422, detail=f"Text extraction failed: {e}")
+
+    db.query(VectorOutbox).filter(VectorOutbox.document_id == d.id).delete()
+    promoted = release_document(db, d.id)  # copies elsewhere that pointed at these chunks
+    db.query(DocumentChunk).filter(DocumentChunk.document_id == d.id).delete()
+    db.commit()
+    _drain_promoted(promoted)
+    # chunk count may shrink: drop the old vectors rather than leave stale ids behind
+    # (the document vector is rewritten by the drain if there are chunks again)
+    delete_document_vectors(d.id)
+
+    ingested_chunks = 0
+    if streaming:
+        ingested_chunks = _ingest_stream(db, d)
+    elif text and text.strip():
+        ingested_chunks = ingest_text_for_document(
+            db, text=text, document_id=d.id, user_id=me.id, filename=d.filename,
+        )
+    vector_status = (
+        db.query(VectorOutbox.status)
+        .filter(VectorOutbox.document_id == d.id)
+        .order_by(VectorOutbox.id.desc())
+        .scalar()
+    ) if ingested_chunks else None
+    return {
+        "id": d.id,
+        "ingested_chunks": ingested_chunks,
+        "text_cached": cached,
+        "vector_status": {"done": "indexed"}.get(vector_status, vector_status),
+    }
+
+
 # ==============
 # DELETE /{id}
 # ==============
@@ -162,8 +343,7 @@ def delete_document(
     me = Depends(get_current_user),
 ):
     """
-    Delete document and its chunks from DB.
-    (Note: This MVP doesn’t remove from the vector DB; we can add that later.)
+    Delete document and its chunks from DB, and its chunk and document vectors.
     """
     d = (
         db.query(Document)
@@ -173,7 +353,23 @@ def delete_document(
     if not d:
         raise HTTPException(status_code=404, detail="Document not found")
 
+    db.query(VectorOutbox).filter(VectorOutbox.document_id == d.id).delete()
+    promoted = release_document(db, d.id)
     db.query(DocumentChunk).filter(DocumentChunk.document_id == d.id).delete()
+    # blobs are content-addressed and may be shared: queue the bytes for a sweep
+    # that re-checks references later instead of unlinking them here (see files.py)
+    shared = (
+        db.query(Document.id)
+        .filter(Document.path == d.path, Document.id != d.id)
+        .first()
+    )
+    if not shared:
+        queue_blob_delete(db, d.path)
     db.delete(d)
     db.commit()
+    sweep_blobs()
+    _drain_promoted(promoted)
+    # after the commit: a drain still in flight re-checks the document and cleans up after itself
+    delete_document_vectors(doc_id)
+    record_event(me.id, "delete", resource_id=doc_id)
     return
@@ -1,17 +1,26 @@
 # app/api/knowledge.py
 from __future__ import annotations
 from typing import List, Dict, Any
-from fastapi import APIRouter, Depends, Body
+from concurrent.futures import ThreadPoolExecutor
+from fastapi import APIRouter, Depends, Body, HTTPException
 from pydantic import BaseModel, Field
 from sqlalchemy.orm import Session
 import re
+import time
 
 from app.api.auth import get_current_user
 from app.db import SessionLocal
-from app.services.embeddings import embed_texts
+from app.services.doc_vectors import query_chunks, use_two_stage, widen_chunks
+from app.services.embeddings import embed_queries, embed_query
 from app.vector.chroma_client import get_collection
 from app.models.document import Document
-from app.services.llm import chat
+from app.services.llm import chat, answer_tokens, DeadlineExceeded, LLMError, ProviderUnavailable
+from app.services.context import TokenCounter, mmr_select, pack_context
+from app.services.extractive import extract_answer
+from app.services.rerank import rerank
+from app.services.terms import TERMS_META_KEY, keyword_mask
+from app.services.events import record_event
+from app.core.config import settings
 
 router = APIRouter(prefix="/api/knowledge", tags=["knowledge"])
 
@@ -22,34 +31,16 @@ def get_db():
     finally:
         db.close()
 
-# ---------- tokenization & matching gates ----------
-_word = re.compile(r"[A-Za-z0-9]{2,}")
-
-def _tokens(s: str) -> List[str]:
-    return [w.lower() for w in _word.findall(s or "")]
-
-def _has_query_word(text: str, q: str) -> bool:
-    qset = set(_tokens(q))
-    if not qset:
-        return False
-    tset = set(_tokens(text))
-    return bool(qset & tset)
-
-def _has_all_terms(text: str, q: str) -> bool:
-    qset = set(_tokens(q))
-    if not qset:
-        return False
-    tset = set(_tokens(text))
-    return qset <= tset
-
+# ---------- matching gates ----------
+# keyword gate: shared tokenizer + term ids precomputed at ingest (app/services/terms.py)
 def _has_phrase(text: str, phrase: str) -> bool:
     if not phrase:
         return True
     return phrase.lower() in (text or "").lower()
 
 # ---------- request/response models ----------
-class AskRequest(BaseModel):
-    question: str = Field(..., min_length=2)
+class AskOptions(BaseModel):
+    """Retrieval/answer options shared by /ask and /ask_batch."""
     k: int = Field(8, ge=1, le=20, description="Top chunks to pass to the model after filtering")
     max_context_tokens: int = Field(800, ge=200, le=4000)
     # strict gating (set to True for very precise queries)
@@ -58,12 +49,28 @@ class AskRequest(BaseModel):
     # runtime overrides (optional)
     provider: str | None = Field(None, description="Force 'openai' or 'ollama' (default auto)")
     model: str | None = Field(None, description="Override model name (e.g., 'phi3:3.8b')")
+    rerank: bool | None = Field(None, description="Cross-encoder rerank the retrieved pool (default: RERANK_ENABLED)")
+    two_stage: bool | None = Field(None, description="Search chunks only in the closest documents by document vector "
+                                                     "(default: RETRIEVAL_TWO_STAGE)")
+    timeout_seconds: float | None = Field(None, gt=0, le=600, description="LLM deadline incl. queueing (default LLM_DEADLINE_SECONDS)")
     # output shaping
     max_answer_chars: int = Field(140, ge=30, le=600, description="Trim output to this many characters")
+    # answer path
+    mode: str = Field("llm", pattern="^(llm|extractive|auto)$",
+                      description="'llm', 'extractive' (best sentence/field from the chunks, no LLM) or "
+                                  "'auto' (extractive unless its confidence is below min_confidence)")
+    min_confidence: float | None = Field(None, ge=0, le=1, description="auto mode threshold (default EXTRACTIVE_MIN_CONFIDENCE)")
+
+class AskRequest(AskOptions):
+    question: str = Field(..., min_length=2)
 
 class AskResponse(BaseModel):
     answer: str
     citations: List[Dict[str, Any]]
+    answered_by: str = "llm"   # "llm" | "extractive" | "none" (nothing retrieved)
+    confidence: float | None = None
+
+NOT_FOUND = "Not found in the provided documents."
 
 # ---------- very strict system prompt ----------
 SYSTEM_PROMPT = (
@@ -77,17 +84,58 @@ SYSTEM_PROMPT = (
     
 )
 
-def _build_context(chunks: List[Dict[str, Any]], token_limit: int) -> str:
-    # naive budget: ~4 chars per token
-    budget = token_limit * 4
-    out, used = [], 0
-    for c in chunks:
-        block = f"[{c['filename']} #{c['chunk_index']}]\n{c['content']}\n---\n"
-        if used + len(block) > budget:
-            break
-        out.append(block)
-        used += len(block)
-    return "".join(out).strip()
+def _build_context(
+    chunks: List[Dict[str, Any]],
+    token_limit: int,
+    counter: TokenCounter,
+) -> str:
+    # budget is counted with the target model's tokenizer (falls back to ~4 chars/token);
+    # adjacent overlapping chunks are merged and repeated lines dropped
+    return pack_context(chunks, token_limit, counter)
+
+def _gate_rows(
+    res: Dict[str, Any],
+    qi: int,
+    q: str,
+    require_all_terms: bool,
+    phrase: str | None,
+) -> List[Dict[str, Any]]:
+    """Rows for query `qi` of a Chroma result that pass the keyword/phrase gates."""
+    docs = (res.get("documents") or [[]])[qi] or []
+    metas = (res.get("metadatas") or [[]])[qi] or []
+    dists = (res.get("distances") or [[]])[qi] or []
+    embs = (res.get("embeddings") or [[]])[qi]
+    if embs is None or len(embs) != len(docs):
+        embs = [None] * len(docs)
+
+    keep = keyword_mask(q, docs, metas, require_all_terms)
+    rows = []
+    for ok, text, meta, dist, emb in zip(keep, docs, metas, dists, embs):
+        if not ok or not meta:
+            continue
+        t = text or ""
+        if phrase and not _has_phrase(t, phrase):
+            continue
+        score = 1.0 - float(dist)  # rank only
+        rows.append({
+            "score": score,
+            "content": t,
+            "document_id": int(meta["document_id"]),
+            "filename": meta.get("filename"),
+            "chunk_index": meta.get("chunk_index"),
+            "embedding": emb,
+            "terms": meta.get(TERMS_META_KEY),  # lets chat re-gate a cached pool
+        })
+    return rows
+
+def _llm_http_error(e: LLMError) -> HTTPException:
+    """Router failures: 503 while a provider's circuit is open, 504 when the deadline ran out."""
+    if isinstance(e, ProviderUnavailable):
+        return HTTPException(status_code=503, detail=str(e),
+                             headers={"Retry-After": str(int(settings.LLM_BREAKER_COOLDOWN_SECONDS))})
+    if isinstance(e, DeadlineExceeded):
+        return HTTPException(status_code=504, detail=str(e))
+    return HTTPException(status_code=502, detail=str(e))
 
 def _post_process(answer: str, max_chars: int) -> str:
     """Strip echoes and compress to a single, short line."""
@@ -101,6 +149,84 @@ def _post_process(answer: str, max_chars: int) -> str:
         answer = answer[: max_chars - 1].rstrip() + "…"
     return answer
 
+def _final_answer(raw: str, max_chars: int) -> str:
+    answer = _post_process(raw, max_chars)
+    # If the model ignored instructions and didn't answer, force the fallback
+    if not answer or answer.lower().startswith("question:") or answer.lower().startswith("context:"):
+        answer = NOT_FOUND
+    return answer
+
+def _extractive(q: str, top: List[Dict[str, Any]], payload: AskOptions):
+    """
+    (answer, confidence, source rows) for mode extractive/auto; answer is None
+    when the LLM should answer instead (mode llm, or auto below the threshold).
+    """
+    if payload.mode == "llm":
+        return None, None, []
+    best = extract_answer(q, top)
+    confidence = round(best["confidence"], 4) if best else 0.0
+    if payload.mode == "auto":
+        threshold = settings.EXTRACTIVE_MIN_CONFIDENCE if payload.min_confidence is None else payload.min_confidence
+        if confidence < threshold:
+            return None, confidence, []
+    if not best:
+        return NOT_FOUND, confidence, []
+    return _post_process(best["answer"], payload.max_answer_chars), confidence, [best["row"]]
+
+_POOL_INCLUDE = ["documents", "metadatas", "distances", "embeddings"]
+
+def _pool_size(k: int) -> int:
+    return max(k * 4, 20)   # over-fetch for better recall
+
+def _query_pool(col, q_embs: List[List[float]], k: int, user_id: int, two_stage: bool = False) -> Dict[str, Any]:
+    """One Chroma query for one or many question vectors (results are per-vector lists)."""
+    if two_stage:
+        # candidate documents first, then chunks within them (app/services/doc_vectors.py)
+        return query_chunks(col, q_embs, _pool_size(k), user_id, _POOL_INCLUDE)
+    return col.query(
+        query_embeddings=q_embs,
+        n_results=_pool_size(k),
+        where={"user_id": user_id},
+        include=_POOL_INCLUDE,
+    )
+
+def _pool_rows(
+    col,
+    res: Dict[str, Any],
+    qi: int,
+    q: str,
+    q_emb: List[float],
+    payload: AskOptions,
+    user_id: int,
+    two_stage: bool,
+) -> List[Dict[str, Any]]:
+    """Gated rows for query `qi`; a two-stage miss widens the candidate documents before giving up."""
+    rows = _gate_rows(res, qi, q, payload.require_all_terms, payload.phrase)
+    if rows or not two_stage:
+        return rows
+    return widen_chunks(col, q_emb, _pool_size(payload.k), user_id, _POOL_INCLUDE,
+                        lambda r: _gate_rows(r, 0, q, payload.require_all_terms, payload.phrase))
+
+def _prepare(q: str, rows: List[Dict[str, Any]], payload: AskOptions, provider: str):
+    """
+    Gated rows -> (top chunks, LLM messages, their token count): optional rerank,
+    MMR selection, context packing. The count sizes the prompt window (Ollama num_ctx).
+    """
+    # Optional rerank, then take k by MMR: relevant but not redundant with each other
+    rows.sort(key=lambda r: r["score"], reverse=True)
+    if payload.rerank if payload.rerank is not None else settings.RERANK_ENABLED:
+        rows = rerank(q, rows)
+    top = mmr_select(rows, payload.k, lambda_mult=settings.CONTEXT_MMR_LAMBDA)
+
+    # Build compact context
+    counter = TokenCounter(provider, payload.model)
+    context = _build_context(top, payload.max_context_tokens, counter)
+    messages = [
+        {"role": "system", "content": SYSTEM_PROMPT},
+        {"role": "user",  "content": f"Question: {q}\n\nContext:\n{context}"},
+    ]
+    return top, messages, counter.count_messages(messages)
+
 @router.post("/ask", response_model=AskResponse)
 def ask_knowledge(
     payload: AskRequest = Body(...),
@@ -108,77 +234,141 @@ def ask_knowledge(
     me = Depends(get_current_user),
 ):
     q = payload.question.strip()
+    t0 = time.perf_counter()
 
     # 1) Retrieve a pool from vector DB
-    col = get_collection()
-    q_emb = embed_texts([q])[0]
-    res = col.query(
-        query_embeddings=[q_emb],
-        n_results=max(payload.k * 4, 20),   # over-fetch for better recall
-        where={"user_id": me.id},
-        include=["documents", "metadatas", "distances"],
-    )
-
-    docs = (res.get("documents") or [[]])[0] or []
-    metas = (res.get("metadatas") or [[]])[0] or []
-    dists = (res.get("distances") or [[]])[0] or []
+    col, q_emb, two_stage = get_collection(), embed_query(q), use_two_stage(payload.two_stage)
+    res = _query_pool(col, [q_emb], payload.k, me.id, two_stage)
 
     # 2) Strict keyword/phrase gates; keep for ranking
-    rows = []
-    for text, meta, dist in zip(docs, metas, dists):
-        if not meta:
-            continue
-        t = text or ""
-        if payload.require_all_terms:
-            ok = _has_all_terms(t, q)
-        else:
-            ok = _has_query_word(t, q)
-        if not ok:
-            continue
-        if payload.phrase and not _has_phrase(t, payload.phrase):
-            continue
-        score = 1.0 - float(dist)  # rank only
-        rows.append({
-            "score": score,
-            "content": t,
-            "document_id": int(meta["document_id"]),
-            "filename": meta.get("filename"),
-            "chunk_index": meta.get("chunk_index"),
-        })
+    rows = _pool_rows(col, res, 0, q, q_emb, payload, me.id, two_stage)
 
     # 3) If no chunks pass the gate: hard fail (no LLM call)
     if not rows:
-        return AskResponse(answer="Not found in the provided documents.", citations=[])
+        record_event(me.id, "ask", query=q, latency_ms=(time.perf_counter() - t0) * 1000)
+        return AskResponse(answer=NOT_FOUND, citations=[], answered_by="none")
 
-    # 4) Take top-k by score
-    rows.sort(key=lambda r: r["score"], reverse=True)
-    top = rows[: payload.k]
+    # 4-5) Rerank/MMR + compact context
+    provider = payload.provider or "hf"
+    top, messages, prompt_tokens = _prepare(q, rows, payload, provider)
 
-    # 5) Build compact context
-    context = _build_context(top, payload.max_context_tokens)
+    # 5b) Lookups ("invoice number") are usually one sentence of the top chunk:
+    #     answer from it directly when asked to (or when confident, in auto mode)
+    answer, confidence, used = _extractive(q, top, payload)
+    if answer is not None:
+        record_event(me.id, "ask", query=q, latency_ms=(time.perf_counter() - t0) * 1000)
+        return AskResponse(answer=answer, citations=_citations(used, db),
+                           answered_by="extractive", confidence=confidence)
 
     # 6) Ask the LLM (defaults to Ollama + your .env model, e.g., phi3:3.8b)
-    messages = [
-        {"role": "system", "content": SYSTEM_PROMPT},
-        {"role": "user",  "content": f"Question: {q}\n\nContext:\n{context}"},
-    ]
-    raw = chat(messages, provider=payload.provider or "hf", model=payload.model).strip()
-    answer = _post_process(raw, payload.max_answer_chars)
-
-    # If the model ignored instructions and didn't answer, force the fallback
-    if not answer or answer.lower().startswith("question:") or answer.lower().startswith("context:"):
-        answer = "Not found in the provided documents."
+    try:
+        raw = chat(messages, provider=provider, model=payload.model, deadline=payload.timeout_seconds,
+                   max_tokens=answer_tokens(payload.max_answer_chars), prompt_tokens=prompt_tokens).strip()
+    except LLMError as e:
+        raise _llm_http_error(e)
+    answer = _final_answer(raw, payload.max_answer_chars)
 
     # 7) Citations for the exact chunks used
+    citations = _citations(top, db)
+    record_event(me.id, "ask", query=q, latency_ms=(time.perf_counter() - t0) * 1000)
+    return AskResponse(answer=answer, citations=citations, answered_by="llm", confidence=confidence)
+
+# ---------- batch ----------
+class AskBatchRequest(AskOptions):
+    questions: List[str] = Field(..., min_length=1, description="Questions answered with the shared options below")
+
+class AskBatchItem(BaseModel):
+    index: int
+    question: str
+    answer: str | None = None
+    citations: List[Dict[str, Any]] = []
+    answered_by: str | None = None
+    confidence: float | None = None
+    error: str | None = None
+
+class AskBatchResponse(BaseModel):
+    results: List[AskBatchItem]
+    errors: int
+
+@router.post("/ask_batch", response_model=AskBatchResponse)
+def ask_knowledge_batch(
+    payload: AskBatchRequest = Body(...),
+    db: Session = Depends(get_db),
+    me = Depends(get_current_user),
+):
+    """
+    Many questions, one round trip: one encode for all questions, one multi-vector
+    Chroma query, then the LLM calls run concurrently (bounded per provider by
+    LLM_CONCURRENCY_*). Results come back in input order; a failing question
+    reports `error` without failing the batch.
+    """
+    if len(payload.questions) > settings.ASK_BATCH_MAX_QUESTIONS:
+        raise HTTPException(status_code=422, detail=f"At most {settings.ASK_BATCH_MAX_QUESTIONS} questions per batch")
+    t0 = time.perf_counter()
+    questions = [q.strip() for q in payload.questions]
+    items = [AskBatchItem(index=i, question=q) for i, q in enumerate(questions)]
+    provider = payload.provider or "hf"
+
+    valid = [i for i, q in enumerate(questions) if len(q) >= 2]
+    for i in set(range(len(questions))) - set(valid):
+        items[i].error = "question must be at least 2 characters"
+    col, two_stage = get_collection(), use_two_stage(payload.two_stage)
+    q_embs = embed_queries([questions[i] for i in valid]) if valid else []
+    res = _query_pool(col, q_embs, payload.k, me.id, two_stage) if valid else {}
+
+    # retrieval + packing is cheap and sequential; only the LLM calls fan out
+    jobs: Dict[int, tuple] = {}
+    for qi, i in enumerate(valid):
+        try:
+            rows = _pool_rows(col, res, qi, questions[i], q_embs[qi], payload, me.id, two_stage)
+            if not rows:
+                items[i].answer, items[i].answered_by = NOT_FOUND, "none"
+                continue
+            top, messages, prompt_tokens = _prepare(questions[i], rows, payload, provider)
+            answer, items[i].confidence, used = _extractive(questions[i], top, payload)
+            if answer is not None:
+                items[i].answer, items[i].answered_by = answer, "extractive"
+                items[i].citations = _citations(used, db)
+                continue
+            jobs[i] = (top, messages, prompt_tokens)
+        except Exception as e:
+            items[i].error = f"{type(e).__name__}: {e}"
+
+    def run(i: int) -> str:
+        return chat(jobs[i][1], provider=provider, model=payload.model, deadline=payload.timeout_seconds,
+                    max_tokens=answer_tokens(payload.max_answer_chars), prompt_tokens=jobs[i][2]).strip()
+
+    if jobs:
+        # threads only wait on HTTP; the per-provider semaphore in chat() is the real limit
+        workers = min(len(jobs), max(settings.LLM_CONCURRENCY_OPENAI, settings.LLM_CONCURRENCY_HF,
+                                     settings.LLM_CONCURRENCY_OLLAMA))
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="ask-batch") as pool:
+            futures = {i: pool.submit(run, i) for i in jobs}
+            for i, fut in futures.items():
+                try:
+                    items[i].answer = _final_answer(fut.result(), payload.max_answer_chars)
+                    items[i].citations = _citations(jobs[i][0], db)
+                    items[i].answered_by = "llm"
+                except Exception as e:
+                    items[i].error = f"{type(e).__name__}: {e}"
+
+    for i in valid:
+        record_event(me.id, "ask", query=questions[i])
+    record_event(me.id, "ask_batch", latency_ms=(time.perf_counter() - t0) * 1000)
+    return AskBatchResponse(results=items, errors=sum(1 for it in items if it.error))
+
+def _citations(top: List[Dict[str, Any]], db: Session) -> List[Dict[str, Any]]:
     citations: List[Dict[str, Any]] = []
     for r in top:
         doc = db.query(Document).get(r["document_id"])
-        citations.append({
+        citation = {
             "document_id": r["document_id"],
             "filename": r["filename"] or (doc.filename if doc else None),
             "chunk_index": r["chunk_index"],
             "score": round(r["score"], 4),
             "snippet": r["content"][:240] + ("…" if len(r["content"]) > 240 else ""),
-        })
-
-    return AskResponse(answer=answer, citations=citations)
+        }
+        if "rerank_score" in r:
+            citation["rerank_score"] = round(r["rerank_score"], 4)
+        citations.append(citation)
+    return citations
@@ -1,18 +1,31 @@
 # app/api/search.py
 
-from fastapi import APIRouter, Depends, Query
+from fastapi import APIRouter, Depends, HTTPException, Query
 from sqlalchemy.orm import Session
-from typing import List, Dict, Any, Tuple
-import re
-
+from typing import List, Dict, Any, Optional, Tuple
+import base64
+import hashlib
+import json
+import time
+
+from app.core import metrics
+from app.core.config import settings
 from app.db import SessionLocal
 from app.api.auth import get_current_user
 from app.vector.chroma_client import get_collection
-from app.services.embeddings import embed_texts
+from app.services.dedup import duplicates_of
+from app.services.doc_vectors import candidate_documents, chunk_filter, use_two_stage
+from app.services.embeddings import embed_query
 from app.models.document import Document
+from app.services.rerank import rerank as rerank_rows
+from app.services.terms import keyword_mask
+from app.services.events import record_event
 
 router = APIRouter(prefix="/api", tags=["search"])
 
+_stats = {"queries": 0, "chroma_queries": 0, "pool_chunks": 0, "pages": 0}
+metrics.register("search", lambda: dict(_stats))
+
 def get_db():
     db = SessionLocal()
     try:
@@ -20,84 +33,186 @@ def get_db():
     finally:
         db.close()
 
-_word = re.compile(r"[A-Za-z0-9]{3,}")
+# ---- cursor ----
+# Opaque to clients: base64url JSON with the score frontier (best score + id of the
+# last document served), the pool size the previous page needed, and a fingerprint
+# of the ranking inputs so a cursor can't be replayed against a different query.
+Row = Tuple[float, str, Dict[str, Any]]
 
-def _tokenize(s: str) -> List[str]:
-    return [w.lower() for w in _word.findall(s or "")]
+def _fingerprint(q: str, require_all_terms: bool, two_stage: bool = False) -> str:
+    return hashlib.blake2b(f"{q}\x00{int(require_all_terms)}\x00{int(two_stage)}".encode(), digest_size=8).hexdigest()
 
-def _matches_keyword(text: str, q: str, require_all_terms: bool) -> bool:
-    q_words = set(_tokenize(q))
-    if not q_words:
-        return False
-    t_words = set(_tokenize(text))
-    return (q_words <= t_words) if require_all_terms else bool(q_words & t_words)
+def _encode_cursor(score: float, doc_id: int, pool: int, fp: str, doc_pool: int = 0) -> str:
+    raw = json.dumps({"s": score, "d": doc_id, "n": pool, "k": doc_pool, "f": fp}, separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
 
-@router.get("/search")
-def semantic_search_grouped(
-    q: str = Query(..., min_length=2, description="Keyword(s) to find"),
-    doc_limit: int = Query(50, ge=1, le=200, description="Max number of documents to return"),
-    chunks_per_doc: int = Query(3, ge=1, le=20, description="Top chunks to show per document"),
-    require_all_terms: bool = Query(False, description="All query words must appear in a chunk"),
-    db: Session = Depends(get_db),
-    me = Depends(get_current_user),
-):
+def _decode_cursor(cursor: str, fp: str) -> Dict[str, Any]:
+    try:
+        data = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+        out = {"s": float(data["s"]), "d": int(data["d"]), "n": int(data["n"]), "k": int(data.get("k", 0)),
+               "f": data["f"]}
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    if out["f"] != fp:
+        raise HTTPException(status_code=400, detail="Cursor does not match this query")
+    return out
+
+# ---- candidate pool ----
+def _gated_pool(col, q: str, q_emb, user_id: int, n: int, require_all_terms: bool,
+                doc_ids: Optional[List[int]] = None) -> Tuple[List[Row], int]:
     """
-    Keyword-first, no similarity cutoff:
-      • Return ALL documents that contain the keyword(s) in at least one chunk.
-      • Rank documents by best semantic score (cosine similarity) among their chunks.
-      • Within each document, return the top `chunks_per_doc` chunks by score.
+    Top-n chunks by vector score that pass the keyword gate (only within `doc_ids`
+    when given); also returns how many Chroma gave back.
     """
-    col = get_collection()
-    q_emb = embed_texts([q])[0]
-
-    # Over-fetch a big pool; we'll do strict keyword filtering ourselves.
-    overfetch = 500  # adjust if you expect more data
     res = col.query(
         query_embeddings=[q_emb],
-        n_results=overfetch,
-        where={"user_id": me.id},
+        n_results=n,
+        where=chunk_filter(user_id, doc_ids),
         include=["documents", "metadatas", "distances"],  # no "ids"
     )
+    _stats["chroma_queries"] += 1
+    _stats["pool_chunks"] += n
 
     docs:  List[str]           = (res.get("documents") or [[]])[0] or []
     metas: List[Dict[str,Any]] = (res.get("metadatas") or [[]])[0] or []
     dists: List[float]         = (res.get("distances") or [[]])[0] or []
 
-    # Score (1 - distance) just for ranking; filter ONLY by keyword presence.
-    rows: List[Tuple[float, str, Dict[str, Any]]] = []
-    for text, meta, dist in zip(docs, metas, dists):
-        if not meta:
-            continue
-        if not _matches_keyword(text or "", q, require_all_terms):
+    # Score (1 - distance) just for ranking; filter ONLY by keyword presence
+    # (checked against term ids stored at ingest, see app/services/terms.py).
+    keep = keyword_mask(q, docs, metas, require_all_terms)
+    rows: List[Row] = []
+    for ok, text, meta, dist in zip(keep, docs, metas, dists):
+        if not ok or not meta:
             continue
         score = 1.0 - float(dist)  # cosine similarity in [0..1]
         rows.append((score, text or "", meta))
+    return rows, len(dists)
 
-    if not rows:
-        return {"query": q, "documents": []}
-
-    # Bucket by document and rank within
-    buckets: Dict[int, List[Tuple[float, str, Dict[str, Any]]]] = {}
+def _bucket(rows: List[Row]) -> Dict[int, List[Row]]:
+    buckets: Dict[int, List[Row]] = {}
     for score, text, meta in rows:
-        doc_id = int(meta["document_id"])
-        buckets.setdefault(doc_id, []).append((score, text, meta))
+        buckets.setdefault(int(meta["document_id"]), []).append((score, text, meta))
+    return buckets
 
-    grouped = []
-    for doc_id, items in buckets.items():
-        items.sort(key=lambda x: x[0], reverse=True)
-        best_score = items[0][0]
-        total_matches = len(items)
+@router.get("/search")
+def semantic_search_grouped(
+    q: str = Query(..., min_length=2, description="Keyword(s) to find"),
+    doc_limit: int = Query(50, ge=1, le=200, description="Max number of documents to return"),
+    chunks_per_doc: int = Query(3, ge=1, le=20, description="Top chunks to show per document"),
+    require_all_terms: bool = Query(False, description="All query words must appear in a chunk"),
+    rerank: bool = Query(False, description="Re-score matching chunks with the cross-encoder"),
+    cursor: Optional[str] = Query(None, description="next_cursor from the previous page"),
+    two_stage: Optional[bool] = Query(None, description="Pick candidate documents by document vector first "
+                                                        "(default RETRIEVAL_TWO_STAGE)"),
+    db: Session = Depends(get_db),
+    me = Depends(get_current_user),
+):
+    """
+    Keyword-first, no similarity cutoff:
+      • Return documents that contain the keyword(s) in at least one chunk, a page at a time.
+      • Rank documents by best semantic score (cosine similarity) among their chunks.
+      • Within each document, return the top `chunks_per_doc` chunks by score.
+
+    The candidate pool starts small and grows until `doc_limit` documents pass the
+    keyword gate. Chunks arrive in descending score, so a document's best score is
+    final once it shows up and the ranking down to the pool's lowest score is
+    stable; `next_cursor` records where this page stopped in that ranking.
+
+    A snippet that copies or nearly copies one shown higher on the page is left
+    out; it is counted in that snippet's `duplicates` instead.
 
-        row = db.query(Document).get(doc_id)
+    Two-stage: chunks are only searched inside the closest candidate documents
+    (by document vector); the candidate set widens when it runs dry before a
+    page fills.
+    """
+    t0 = time.perf_counter()
+    _stats["queries"] += 1
+    two_stage = use_two_stage(two_stage)
+    fp = _fingerprint(q, require_all_terms, two_stage)
+    after = _decode_cursor(cursor, fp) if cursor else None
+
+    col = get_collection()
+    q_emb = embed_query(q)
+    doc_n, doc_ids = 0, None
+    if two_stage:
+        doc_n = max(settings.RETRIEVAL_DOC_CANDIDATES, doc_limit + 1, after["k"] if after else 0)
+        doc_ids = candidate_documents([q_emb], me.id, doc_n)[0] or None  # none indexed yet: flat search
+
+    # a cursor resumes at the pool size the previous page reached (no regrowing from scratch)
+    ceiling = min(settings.SEARCH_POOL_MAX, col.count())
+    n = min(max(settings.SEARCH_POOL_MIN, doc_limit * chunks_per_doc, after["n"] if after else 0), ceiling)
+    buckets: Dict[int, List[Row]] = {}
+    ranked: List[Tuple[float, int]] = []
+    while n > 0:
+        rows, returned = _gated_pool(col, q, q_emb, me.id, n, require_all_terms, doc_ids)
+        buckets = _bucket(rows)
+        ranked = sorted(((max(r[0] for r in items), doc_id) for doc_id, items in buckets.items()),
+                        key=lambda x: (-x[0], x[1]))
+        if after:
+            ranked = [(s, d) for s, d in ranked if (-s, d) > (-after["s"], after["d"])]
+        # one document past the page tells us whether there is a next page
+        if len(ranked) > doc_limit:
+            break
+        if returned < n and doc_ids and len(doc_ids) >= doc_n and doc_n < settings.RETRIEVAL_DOC_CANDIDATES_MAX:
+            # candidate documents ran dry: widen them rather than give up
+            doc_n = min(doc_n * max(2, settings.SEARCH_POOL_GROWTH), settings.RETRIEVAL_DOC_CANDIDATES_MAX)
+            doc_ids = candidate_documents([q_emb], me.id, doc_n)[0]
+            continue
+        if returned < n or n >= ceiling:
+            break
+        n = min(n * max(2, settings.SEARCH_POOL_GROWTH), ceiling)
+
+    page = ranked[:doc_limit]
+    next_cursor = _encode_cursor(page[-1][0], page[-1][1], n, fp, doc_n) if len(ranked) > doc_limit else None
+    if not page:
+        record_event(me.id, "search", query=q, latency_ms=(time.perf_counter() - t0) * 1000)
+        return {"query": q, "reranked": False, "documents": [], "next_cursor": None}
+    _stats["pages"] += 1
+
+    page_buckets = {doc_id: sorted(buckets[doc_id], key=lambda x: x[0], reverse=True) for _, doc_id in page}
+
+    # Optional cross-encoder pass over this page's chunks; it reorders documents
+    # within the page only, so the cursor frontier stays in vector-score space.
+    reranked = False
+    if rerank:
+        flat = sorted((r for items in page_buckets.values() for r in items), key=lambda x: x[0], reverse=True)
+        scored = rerank_rows(q, [{"score": sc, "content": t, "meta": m} for sc, t, m in flat])
+        if any("rerank_score" in r for r in scored):
+            # keep rerank()'s order: scored rows best first, then the rows the budget
+            # didn't reach in vector order (those keep their vector score). Buckets
+            # and documents follow first appearance in that order.
+            page_buckets = _bucket([(r.get("rerank_score", r["score"]), r["content"], r["meta"]) for r in scored])
+            page = [(items[0][0], doc_id) for doc_id, items in page_buckets.items()]
+            reranked = True
+
+    rows_by_id = {
+        d.id: d for d in db.query(Document).filter(Document.id.in_([doc_id for _, doc_id in page]))
+    }
+    # copies linked at ingest and near-duplicates (see dedup): report where the
+    # other copies are, and show a text only once per page, at its best rank
+    dups = duplicates_of(db, me.id, [(doc_id, meta.get("chunk_index"))
+                                     for _, doc_id in page for _, _, meta in page_buckets[doc_id][:chunks_per_doc]])
+    shown = set()
+    grouped = []
+    for best_score, doc_id in page:
+        items = page_buckets[doc_id]
+        row = rows_by_id.get(doc_id)
         filename = items[0][2].get("filename") or getattr(row, "filename", None)
         created_at = getattr(row, "created_at", None)
 
-        snippets = []
+        snippets, dup_docs = [], set()
         for score, text, meta in items[:chunks_per_doc]:
+            key = (doc_id, meta.get("chunk_index"))
+            if key in shown:
+                continue  # near-duplicate of a snippet shown above (listed under its duplicates)
+            copies = dups.get(key, [])
+            shown.update(copies)
+            dup_docs.update(c for c, _ in copies if c != doc_id)
             snippets.append({
                 "chunk_index": meta.get("chunk_index"),
                 "score": round(score, 4),
-                "snippet": text[:300] + ("…" if len(text) > 300 else "")
+                "snippet": text[:300] + ("…" if len(text) > 300 else ""),
+                "duplicates": len(copies),
             })
 
         grouped.append({
@@ -105,10 +220,10 @@ def semantic_search_grouped(
             "filename": filename,
             "document_created_at": created_at,
             "best_score": round(best_score, 4),   # for ranking only
-            "total_matches": total_matches,
+            "total_matches": len(items),           # within the candidate pool
             "snippets": snippets,
+            "duplicate_documents": sorted(dup_docs),
         })
 
-    # Rank documents by best_score; cap to doc_limit
-    grouped.sort(key=lambda d: d["best_score"], reverse=True)
-    return {"query": q, "documents": grouped[:doc_limit]}
+    record_event(me.id, "search", query=q, latency_ms=(time.perf_counter() - t0) * 1000)
+    return {"query": q, "reranked": reranked, "documents": grouped, "next_cursor": next_cursor}
@@ -0,0 +1,40 @@
+# app/api/snapshots.py
+from fastapi import APIRouter, Depends, HTTPException, Query
+
+from app.api.auth import get_current_user
+from app.services.snapshot import SnapshotError, create_snapshot, list_snapshots
+
+router = APIRouter(prefix="/api/admin/snapshots", tags=["admin"])
+
+def _require_admin(me):
+    if me.role != "admin":
+        raise HTTPException(status_code=403, detail="Admin only")
+    return me
+
+# ==============
+# POST /
+# ==============
+@router.post("", status_code=201)
+def take_snapshot(
+    full: bool = Query(False, description="Full snapshot instead of incremental against the latest one"),
+    blobs: bool | None = Query(None, description="Copy blobs into the snapshot (default SNAPSHOT_INCLUDE_BLOBS)"),
+    me = Depends(get_current_user),
+):
+    """
+    Consistent snapshot of the database, vector index and blob manifest.
+    Restoring is CLI-only (`python -m app.services.snapshot restore <id>`) since it replaces the live DB.
+    """
+    _require_admin(me)
+    try:
+        manifest = create_snapshot(full=full, include_blobs=blobs)
+    except SnapshotError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    return {k: manifest[k] for k in ("id", "created_at", "kind", "parent", "stats")}
+
+# ==============
+# GET /
+# ==============
+@router.get("")
+def get_snapshots(me = Depends(get_current_user)):
+    _require_admin(me)
+    return list_snapshots()
@@ -0,0 +1,266 @@
+# app/core/admission.py
+# Admission control for the expensive endpoints (search, ask, upload).
+#
+# Two gates, in order:
+#   1. per-user token bucket (ADMISSION_RATE tokens/s, up to ADMISSION_BURST),
+#      charged a per-endpoint cost -> 429 when a user is over their share;
+#   2. bounded per-class queues in front of ADMISSION_MAX_INFLIGHT shared slots,
+#      each class also capped at its own slot count. A freed slot goes to the
+#      highest-priority waiter (search, then ask, then upload) -> 503 when the
+#      queue is full or a request has waited past its class deadline.
+# Both rejections carry Retry-After. State is per process: with serve.py each
+# API worker admits independently.
+from __future__ import annotations
+from collections import OrderedDict, deque
+from dataclasses import dataclass, field
+from typing import Any, Deque, Dict, List, Optional, Pattern, Tuple
+import asyncio
+import json
+import math
+import re
+import threading
+import time
+
+from app.core import metrics
+from app.core.config import settings
+from app.core.security import decode_token
+
+
+@dataclass
+class _Class:
+    name: str
+    priority: int  # lower runs first
+    slots: int
+    queue_max: int
+    wait_seconds: float
+    inflight: int = 0
+    waiters: Deque[asyncio.Future] = field(default_factory=deque)
+    service_s: float = 0.0  # EWMA of time holding a slot
+    counters: Dict[str, float] = field(default_factory=lambda: {
+        "admitted": 0, "queued": 0, "rate_limited": 0, "shed_queue_full": 0, "shed_deadline": 0,
+        "wait_ms_total": 0.0, "wait_ms_max": 0.0,
+    })
+
+
+# (method, path) -> (class, cost setting); first match wins
+ROUTES: List[Tuple[str, Pattern[str], str, str]] = [
+    ("GET", re.compile(r"^/api/search$"), "search", "ADMISSION_COST_SEARCH"),
+    ("POST", re.compile(r"^/api/knowledge/ask$"), "ask", "ADMISSION_COST_ASK"),
+    ("POST", re.compile(r"^/api/knowledge/ask_batch$"), "ask", "ADMISSION_COST_ASK_BATCH"),
+    ("POST", re.compile(r"^/api/chat/sessions/\d+/messages$"), "ask", "ADMISSION_COST_ASK"),
+    ("POST", re.compile(r"^/api/documents/upload$"), "upload", "ADMISSION_COST_UPLOAD"),
+    ("POST", re.compile(r"^/api/documents/\d+/reindex$"), "upload", "ADMISSION_COST_UPLOAD"),
+]
+
+
+def classify(method: str, path: str) -> Optional[Tuple[str, float]]:
+    for m, pattern, cls, cost in ROUTES:
+        if m == method and pattern.match(path):
+            return cls, float(getattr(settings, cost))
+    return None
+
+
+class Rejected(Exception):
+    def __init__(self, status: int, detail: str, retry_after: float):
+        super().__init__(detail)
+        self.status, self.detail = status, detail
+        self.retry_after = max(1, math.ceil(retry_after))
+
+
+class AdmissionController:
+    def __init__(self):
+        self.classes: Dict[str, _Class] = {
+            "search": _Class("search", 0, settings.ADMISSION_SEARCH_SLOTS, settings.ADMISSION_SEARCH_QUEUE,
+                             settings.ADMISSION_SEARCH_WAIT_SECONDS),
+            "ask": _Class("ask", 1, settings.ADMISSION_ASK_SLOTS, settings.ADMISSION_ASK_QUEUE,
+                          settings.ADMISSION_ASK_WAIT_SECONDS),
+            "upload": _Class("upload", 2, settings.ADMISSION_UPLOAD_SLOTS, settings.ADMISSION_UPLOAD_QUEUE,
+                             settings.ADMISSION_UPLOAD_WAIT_SECONDS),
+        }
+        self._by_priority = sorted(self.classes.values(), key=lambda c: c.priority)
+        self.inflight = 0
+        # key -> [tokens, last refill]; LRU-bounded (an evicted bucket comes back full)
+        self._buckets: "OrderedDict[str, List[float]]" = OrderedDict()
+        # a lock, not just the event loop: every worker has one loop, but test
+        # clients and embedded servers may drive several
+        self._lock = threading.Lock()
+
+    # ---- gate 1: per-user token bucket ----
+    def take(self, key: str, cost: float, cls: str) -> None:
+        rate, burst = settings.ADMISSION_RATE, settings.ADMISSION_BURST
+        cost = min(cost, burst)  # an endpoint dearer than the burst must still be reachable
+        now = time.monotonic()
+        with self._lock:
+            bucket = self._buckets.pop(key, None) or [burst, now]
+            bucket[0] = min(burst, bucket[0] + (now - bucket[1]) * rate)
+            bucket[1] = now
+            self._buckets[key] = bucket
+            while len(self._buckets) > settings.ADMISSION_MAX_KEYS:
+                self._buckets.popitem(last=False)
+            if bucket[0] >= cost:
+                bucket[0] -= cost
+                return
+            self.classes[cls].counters["rate_limited"] += 1
+            deficit = cost - bucket[0]
+        raise Rejected(429, "Rate limit exceeded", deficit / rate if rate > 0 else 60)
+
+    def refund(self, key: str, cost: float) -> None:
+        # shed for overload, not for the user's own usage: give the tokens back
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is not None:
+                bucket[0] = min(settings.ADMISSION_BURST, bucket[0] + min(cost, settings.ADMISSION_BURST))
+
+    # ---- gate 2: bounded priority queues over shared slots ----
+    def _can_run(self, c: _Class) -> bool:
+        return self.inflight < settings.ADMISSION_MAX_INFLIGHT and c.inflight < c.slots
+
+    def _start(self, c: _Class) -> None:
+        self.inflight += 1
+        c.inflight += 1
+        c.counters["admitted"] += 1
+
+    def _retry_after(self, c: _Class) -> float:
+        # roughly how long the current queue takes to clear
+        return (len(c.waiters) + 1) * (c.service_s or 1.0) / max(c.slots, 1)
+
+    async def acquire(self, cls: str) -> None:
+        c = self.classes[cls]
+        with self._lock:
+            if not c.waiters and self._can_run(c):
+                self._start(c)
+                return
+            if len(c.waiters) >= c.queue_max:
+                c.counters["shed_queue_full"] += 1
+                raise Rejected(503, f"Server busy ({cls} queue full)", self._retry_after(c))
+            fut = asyncio.get_running_loop().create_future()
+            c.waiters.append(fut)
+            c.counters["queued"] += 1
+        t0 = time.perf_counter()
+        try:
+            await asyncio.wait_for(fut, c.wait_seconds)
+        except BaseException as e:
+            with self._lock:
+                granted = fut not in c.waiters
+                if not granted:
+                    c.waiters.remove(fut)
+            if granted:
+                # the slot was handed over as the wait ended: keep it, or give it back on disconnect
+                if not isinstance(e, asyncio.TimeoutError):
+                    self.release(cls, 0.0)
+                    raise
+            elif isinstance(e, asyncio.TimeoutError):
+                with self._lock:
+                    c.counters["shed_deadline"] += 1
+                    retry = self._retry_after(c)
+                raise Rejected(503, f"Server busy ({cls} queue wait exceeded)", retry)
+            else:
+                raise
+        waited = (time.perf_counter() - t0) * 1000
+        with self._lock:
+            c.counters["wait_ms_total"] += waited
+            c.counters["wait_ms_max"] = max(c.counters["wait_ms_max"], waited)
+
+    def release(self, cls: str, seconds: float) -> None:
+        c = self.classes[cls]
+        with self._lock:
+            self.inflight -= 1
+            c.inflight -= 1
+            if seconds:
+                c.service_s = seconds if not c.service_s else 0.8 * c.service_s + 0.2 * seconds
+            self._dispatch()
+
+    def _dispatch(self) -> None:
+        # caller holds the lock; highest priority first, each class up to its own slots.
+        # A waiter that timed out or went away meanwhile still owns what it is handed
+        # here: acquire() sees it left the queue and keeps or releases the slot.
+        for c in self._by_priority:
+            while c.waiters and self._can_run(c):
+                fut = c.waiters.popleft()
+                self._start(c)
+                fut.get_loop().call_soon_threadsafe(_grant, fut)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            out: Dict[str, Any] = {
+                "enabled": settings.ADMISSION_ENABLED,
+                "inflight": self.inflight,
+                "max_inflight": settings.ADMISSION_MAX_INFLIGHT,
+                "buckets": len(self._buckets),
+            }
+            for c in self._by_priority:
+                waited = c.counters["admitted"] and c.counters["wait_ms_total"] / c.counters["admitted"]
+                out[c.name] = {
+                    "inflight": c.inflight, "slots": c.slots,
+                    "queue_depth": len(c.waiters), "queue_max": c.queue_max,
+                    **{k: v for k, v in c.counters.items() if k != "wait_ms_total"},
+                    "wait_ms_avg": round(waited, 2), "wait_ms_max": round(c.counters["wait_ms_max"], 2),
+                    "service_ms_avg": round(c.service_s * 1000, 1),
+                }
+            return out
+
+
+def _grant(fut: asyncio.Future) -> None:
+    if not fut.done():
+        fut.set_result(None)
+
+
+controller = AdmissionController()
+metrics.register("admission", controller.stats)
+
+
+def client_key(scope) -> str:
+    """The JWT subject when the bearer token is valid, else the client address."""
+    for name, value in scope.get("headers") or []:
+        if name == b"authorization":
+            scheme, _, token = value.decode("latin-1").partition(" ")
+            if scheme.lower() == "bearer" and token:
+                try:
+                    return "user:" + str(decode_token(token.strip())["sub"])
+                except Exception:
+                    pass
+            break
+    client = scope.get("client")
+    return "ip:" + (client[0] if client else "unknown")
+
+
+class AdmissionMiddleware:
+    """Plain ASGI middleware (streamed responses and uploads pass through untouched)."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        route = classify(scope.get("method", ""), scope.get("path", "")) if scope["type"] == "http" else None
+        if route is None or not settings.ADMISSION_ENABLED:
+            return await self.app(scope, receive, send)
+        cls, cost = route
+        key = client_key(scope)
+        try:
+            controller.take(key, cost, cls)
+            try:
+                await controller.acquire(cls)
+            except Rejected:
+                controller.refund(key, cost)
+                raise
+        except Rejected as r:
+            return await _reject(send, r)
+        t0 = time.perf_counter()
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            controller.release(cls, time.perf_counter() - t0)
+
+
+async def _reject(send, r: Rejected) -> None:
+    body = json.dumps({"detail": r.detail}).encode()
+    await send({
+        "type": "http.response.start",
+        "status": r.status,
+        "headers": [
+            (b"content-type", b"application/json"),
+            (b"content-length", str(len(body)).encode()),
+            (b"retry-after", str(r.retry_after).encode()),
+        ],
+    })
+    await send({"type": "http.response.body", "body": body})
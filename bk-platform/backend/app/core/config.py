@@ -8,17 +8,227 @@ class Settings(BaseSettings):
     ACCESS_TOKEN_EXPIRE_MINUTES: int = 60 * 24
     DATABASE_URL: str = "sqlite:///./bk.db"
 
+    # SQLite tuning (WAL + synchronous=NORMAL are always on for file databases)
+    SQLITE_MMAP_BYTES: int = 256 * 1024 * 1024
+    SQLITE_CACHE_KB: int = 64 * 1024
+    SQLITE_BUSY_TIMEOUT_SECONDS: float = 15.0
+    # Connection pool for server databases (Postgres)
+    DB_POOL_SIZE: int = 10
+    DB_MAX_OVERFLOW: int = 20
+    DB_POOL_TIMEOUT: float = 30.0
+    DB_POOL_RECYCLE: int = 1800
+    # Create tables / run migrations when app.main is imported. serve.py does
+    # it once in the parent and turns it off for its workers
+    INIT_DB_ON_STARTUP: bool = True
+
+    # Auth: authenticated users are cached per token `sub`; bcrypt runs in its own pool
+    AUTH_USER_CACHE_TTL_SECONDS: int = 60
+    AUTH_USER_CACHE_SIZE: int = 10000
+    PASSWORD_HASH_WORKERS: int = 2
+    PASSWORD_HASH_MAX_PENDING: int = 64
+
     OLLAMA_HOST: str | None = None
     OLLAMA_MODEL: str | None = None
+    # Warm OLLAMA_MODEL at startup and hold it loaded for OLLAMA_KEEP_ALIVE ("-1" = forever);
+    # num_ctx is bucketed from the packed prompt, num_predict from max_answer_chars
+    OLLAMA_WARMUP: bool = True
+    OLLAMA_KEEP_ALIVE: str = "30m"
+    OLLAMA_NUM_CTX_MAX: int = 8192
+    OLLAMA_NUM_PREDICT: int = 256
+    OLLAMA_COLD_LOAD_MS: float = 1000.0
     OPENAI_API_KEY: str | None = None
     OPENAI_MODEL: str | None = None
     EMBED_MODEL: str = "sentence-transformers/all-MiniLM-L6-v2"
+    # "inprocess" loads the model in every worker; "sidecar" sends texts to one
+    # model process per node (python -m app.services.embed_sidecar, or serve.py)
+    # over EMBED_SOCKET, which batches across workers (up to EMBED_BATCH_MAX texts,
+    # waiting EMBED_BATCH_WAIT_MS) and returns vectors through shared memory
+    EMBED_MODE: str = "inprocess"
+    EMBED_SOCKET: str = "embed.sock"
+    EMBED_BATCH_MAX: int = 128
+    EMBED_BATCH_WAIT_MS: float = 3.0
+    EMBED_SIDECAR_TIMEOUT_SECONDS: float = 60.0
+    # LRU of query embeddings keyed by (model, case/whitespace-folded query); 0 = off
+    QUERY_EMBED_CACHE_SIZE: int = 2048
 
     # NEW: Hugging Face
     HF_TOKEN: str | None = None
     HF_MODEL_ID: str | None = None
     HF_API_BASE: str | None = "https://api-inference.huggingface.co/models"
 
+    # Max in-flight LLM requests per provider (shared by ask, chat and ask_batch)
+    LLM_CONCURRENCY_OPENAI: int = 8
+    LLM_CONCURRENCY_HF: int = 4
+    LLM_CONCURRENCY_OLLAMA: int = 2
+
+    # LLM router: per-request deadline (queueing + HTTP), circuit breaker per provider
+    # over a rolling window (error rate or slow-call rate), optional fallback provider
+    # used on failover and, with LLM_HEDGE_ENABLED, hedged once the primary passes its p95
+    LLM_DEADLINE_SECONDS: float = 120.0
+    LLM_BREAKER_WINDOW: int = 50
+    LLM_BREAKER_MIN_REQUESTS: int = 10
+    LLM_BREAKER_ERROR_RATE: float = 0.5
+    LLM_BREAKER_SLOW_SECONDS: float = 30.0
+    LLM_BREAKER_SLOW_RATE: float = 0.8
+    LLM_BREAKER_COOLDOWN_SECONDS: float = 30.0
+    LLM_FALLBACK_PROVIDER: str | None = None
+    LLM_HEDGE_ENABLED: bool = False
+    LLM_HEDGE_MIN_SAMPLES: int = 20
+
+    # Offline providers for load tests. "stub": a fake Ollama/OpenAI server
+    # (in-process, or STUB_LLM_URL for a shared `python -m app.services.llm_stub`)
+    # with fixed latency + tokens/s. "replay": responses from a cassette keyed by
+    # prompt hash; LLM_REPLAY_RECORD=true records misses from LLM_REPLAY_UPSTREAM.
+    STUB_LLM_URL: str | None = None
+    STUB_LLM_API: str = "ollama"
+    STUB_LLM_LATENCY_MS: float = 50.0
+    STUB_LLM_TOKENS_PER_SECOND: float = 50.0
+    STUB_LLM_REPLY_TOKENS: int = 24
+    LLM_CONCURRENCY_STUB: int = 64
+    LLM_CASSETTE_PATH: str = "llm_cassette.jsonl"
+    LLM_REPLAY_RECORD: bool = False
+    LLM_REPLAY_UPSTREAM: str | None = None
+    ASK_BATCH_MAX_QUESTIONS: int = 200
+
+    # Uploads: content-addressed blob store ("local" sharded dirs, or "object-local",
+    # an object-store-like stand-in); text-like files are gzip'd at rest
+    BLOB_BACKEND: str = "local"
+    BLOB_ROOT: str = "uploads"
+    BLOB_COMPRESS_TEXT: bool = True
+    # deleting a document only queues its blob; a sweep removes it after the grace
+    # period if nothing references it again (must exceed any upload's duration)
+    BLOB_GC_GRACE_SECONDS: int = 3600
+    # Extracted text is cached (gzip'd) in the blob store per blob hash + extractor version
+    TEXT_CACHE_ENABLED: bool = True
+
+    # Text extraction runs in a pool of worker processes (0 = inline, dev only).
+    # A file over the wall-clock timeout or RSS cap gets its worker killed and
+    # replaced; workers are recycled after N jobs. EXTRACT_MAX_VM_MB > 0 also sets
+    # RLIMIT_AS inside the workers.
+    EXTRACT_WORKERS: int = 2
+    EXTRACT_TIMEOUT_SECONDS: float = 300.0
+    EXTRACT_MAX_RSS_MB: int = 1536
+    EXTRACT_MAX_VM_MB: int = 0
+    EXTRACT_MAX_JOBS_PER_WORKER: int = 50
+
+    # Streaming ingestion for .txt/.csv/.json/.log: spooled, decoded and chunked
+    # block by block, chunk rows inserted INGEST_WINDOW at a time; CSV_ROW_GROUPS
+    # chunks CSVs by whole rows with the header repeated (overridable per upload)
+    STREAM_MAX_MB: int = 2048
+    STREAM_BLOCK_BYTES: int = 1024 * 1024
+    INGEST_WINDOW: int = 500
+    CSV_ROW_GROUPS: bool = False
+
+    # Vector store: "embedded" opens VECTOR_PATH in this process (single worker);
+    # "http" talks to one vector service (python -m app.vector.server, or serve.py)
+    # shared by every API worker, over a pooled HTTP session
+    VECTOR_MODE: str = "embedded"
+    VECTOR_PATH: str = "vectorstore"
+    VECTOR_HOST: str = "127.0.0.1"
+    VECTOR_PORT: int = 8001
+    VECTOR_HTTP_POOL_SIZE: int = 64
+
+    # Snapshots (python -m app.services.snapshot / POST /api/admin/snapshots):
+    # DB backup + vectors + blob manifest under SNAPSHOT_ROOT, incremental
+    # against the previous snapshot unless full
+    SNAPSHOT_ROOT: str = "snapshots"
+    SNAPSHOT_INCLUDE_BLOBS: bool = True
+    SNAPSHOT_FETCH_BATCH: int = 1000
+    SNAPSHOT_RESTORE_BATCH: int = 2000
+
+    # Vector outbox: chunk rows + outbox entry commit together; a worker embeds
+    # and upserts them into Chroma in batches (and retries after failures)
+    OUTBOX_INLINE_DRAIN: bool = True
+    OUTBOX_BATCH_SIZE: int = 256
+    OUTBOX_POLL_SECONDS: float = 2.0
+    OUTBOX_MAX_ATTEMPTS: int = 5
+    OUTBOX_CLAIM_TIMEOUT_SECONDS: int = 600
+
+    # Keyword gates (search + ask) share one tokenizer; stored chunk term ids
+    # depend on this, so re-ingest after changing it. Query-side gate terms
+    # drop stop-words (terms.STOPWORDS), so short ones like "of" don't match everything
+    TERM_MIN_LEN: int = 2
+
+    # /api/search candidate pool: starts at SEARCH_POOL_MIN chunks and grows
+    # (x SEARCH_POOL_GROWTH) until a page of documents passes the keyword gate
+    SEARCH_POOL_MIN: int = 50
+    SEARCH_POOL_GROWTH: int = 4
+    SEARCH_POOL_MAX: int = 5000
+
+    # Two-stage retrieval (search + ask): document vectors (centroid of chunk
+    # embeddings, kept in "bk_docs") pick candidate documents, chunks are then
+    # searched only inside them. Backfill old documents with
+    # `python -m app.services.doc_vectors backfill`.
+    RETRIEVAL_TWO_STAGE: bool = False
+    RETRIEVAL_DOC_CANDIDATES: int = 50
+    RETRIEVAL_DOC_CANDIDATES_MAX: int = 1000
+
+    # Duplicate chunks: at ingest a chunk with the same term set as one the user
+    # already has is linked to it instead of embedded (short chunks never are).
+    # SimHash fingerprints within DEDUP_MAX_HAMMING bits (<= 3 keeps the banded
+    # lookup exact) mark near-duplicates, collapsed on /api/search pages.
+    DEDUP_ENABLED: bool = True
+    DEDUP_MAX_HAMMING: int = 3
+    DEDUP_MIN_CHARS: int = 80
+
+    # RAG context packing: 1.0 = pure relevance, lower = more diversity (MMR)
+    CONTEXT_MMR_LAMBDA: float = 0.7
+    # Tokenizers load in the background (startup, or the first request for a
+    # model); a failed load (offline, gated repo) is retried after this long
+    TOKENIZER_RETRY_SECONDS: int = 300
+
+    # Optional cross-encoder reranking (CPU) between retrieval and context packing
+    RERANK_ENABLED: bool = False
+    RERANK_MODEL: str = "cross-encoder/ms-marco-MiniLM-L-6-v2"
+    RERANK_BUDGET_MS: int = 150
+    RERANK_BATCH_SIZE: int = 16
+    RERANK_CACHE_SIZE: int = 4096
+    RERANK_RETRY_SECONDS: int = 300  # after a failed model load
+
+    # Extractive answers (/ask mode=extractive|auto): score = weight * query-term
+    # coverage + (1 - weight) * embedding cosine over the top chunks' sentences;
+    # auto calls the LLM only below EXTRACTIVE_MIN_CONFIDENCE
+    EXTRACTIVE_MIN_CONFIDENCE: float = 0.7
+    EXTRACTIVE_LEXICAL_WEIGHT: float = 0.6
+    EXTRACTIVE_MAX_SENTENCES: int = 64
+
+    # Multi-turn chat: reuse the retrieved pool while the topic holds, keep the
+    # last N turns verbatim and fold older ones into a rolling summary
+    CHAT_TOPIC_SIMILARITY: float = 0.75
+    CHAT_CONTEXT_CACHE_SIZE: int = 256
+    CHAT_CONTEXT_TTL_SECONDS: int = 1800
+    CHAT_RECENT_TURNS: int = 3
+    CHAT_SUMMARY_MAX_TOKENS: int = 200
+
+    # Admission control for search/ask/upload (per API worker, see app/core/admission.py):
+    # per-user token buckets charged a cost per endpoint (429), then bounded
+    # per-class queues sharing ADMISSION_MAX_INFLIGHT slots with search served
+    # first (503 when a queue is full or its wait deadline passes)
+    ADMISSION_ENABLED: bool = True
+    ADMISSION_RATE: float = 2.0
+    ADMISSION_BURST: float = 40.0
+    ADMISSION_MAX_KEYS: int = 10000
+    ADMISSION_MAX_INFLIGHT: int = 16
+    ADMISSION_COST_SEARCH: float = 1.0
+    ADMISSION_COST_ASK: float = 5.0
+    ADMISSION_COST_ASK_BATCH: float = 20.0
+    ADMISSION_COST_UPLOAD: float = 10.0
+    ADMISSION_SEARCH_SLOTS: int = 16
+    ADMISSION_SEARCH_QUEUE: int = 128
+    ADMISSION_SEARCH_WAIT_SECONDS: float = 2.0
+    ADMISSION_ASK_SLOTS: int = 6
+    ADMISSION_ASK_QUEUE: int = 32
+    ADMISSION_ASK_WAIT_SECONDS: float = 20.0
+    ADMISSION_UPLOAD_SLOTS: int = 2
+    ADMISSION_UPLOAD_QUEUE: int = 16
+    ADMISSION_UPLOAD_WAIT_SECONDS: float = 30.0
+
+    # Analytics: events are buffered in memory and flushed in batches off the request path
+    ANALYTICS_ENABLED: bool = True
+    ANALYTICS_BUFFER_SIZE: int = 10000
+    ANALYTICS_BATCH_SIZE: int = 500
+    ANALYTICS_FLUSH_SECONDS: float = 5.0
+
     model_config = SettingsConfigDict(env_file=".env", extra="ignore")
 
 settings = Settings()
@@ -0,0 +1,18 @@
+# app/core/metrics.py
+# Tiny in-process metrics registry: components register a callable that
+# returns a dict of counters/gauges; /api/analytics/metrics serves a snapshot.
+from typing import Any, Callable, Dict
+
+_providers: Dict[str, Callable[[], Dict[str, Any]]] = {}
+
+def register(name: str, fn: Callable[[], Dict[str, Any]]) -> None:
+    _providers[name] = fn
+
+def snapshot() -> Dict[str, Any]:
+    out: Dict[str, Any] = {}
+    for name, fn in list(_providers.items()):
+        try:
+            out[name] = fn()
+        except Exception as e:  # a broken provider shouldn't hide the others
+            out[name] = {"error": str(e)}
+    return out
@@ -1,5 +1,8 @@
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta, timezone
 from typing import Any
+import asyncio
+import threading
 import jwt
 from passlib.context import CryptContext
 from app.core.config import settings
@@ -13,6 +16,37 @@ def hash_password(pw: str) -> str:
 def verify_password(pw: str, pw_hash: str) -> bool:
     return pwd_context.verify(pw, pw_hash)
 
+# ---- bcrypt off the event loop and off the shared request threadpool ----
+# A login burst queues here (bounded) instead of starving other requests.
+class HashQueueFull(RuntimeError):
+    pass
+
+_hash_pool = ThreadPoolExecutor(max_workers=settings.PASSWORD_HASH_WORKERS, thread_name_prefix="pwhash")
+_hash_pending = 0
+_hash_lock = threading.Lock()
+
+async def _run_hash(fn, *args):
+    global _hash_pending
+    with _hash_lock:
+        if _hash_pending >= settings.PASSWORD_HASH_MAX_PENDING:
+            raise HashQueueFull("password hashing queue is full")
+        _hash_pending += 1
+    try:
+        return await asyncio.get_running_loop().run_in_executor(_hash_pool, fn, *args)
+    finally:
+        with _hash_lock:
+            _hash_pending -= 1
+
+async def hash_password_async(pw: str) -> str:
+    return await _run_hash(hash_password, pw)
+
+async def verify_password_async(pw: str, pw_hash: str) -> bool:
+    return await _run_hash(verify_password, pw, pw_hash)
+
+def hash_queue_stats() -> dict[str, int]:
+    return {"workers": settings.PASSWORD_HASH_WORKERS, "pending": _hash_pending,
+            "max_pending": settings.PASSWORD_HASH_MAX_PENDING}
+
 def create_access_token(subject: str | int, expires_minutes: int | None = None) -> str:
     if expires_minutes is None:
         expires_minutes = settings.ACCESS_TOKEN_EXPIRE_MINUTES
@@ -1,17 +1,43 @@
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
 from sqlalchemy.orm import sessionmaker, DeclarativeBase
 from app.core.config import settings
 
 class Base(DeclarativeBase): pass
 
-engine = create_engine(
-    settings.DATABASE_URL,
-    connect_args={"check_same_thread": False} if settings.DATABASE_URL.startswith("sqlite") else {},
-    future=True,
-)
+_is_sqlite = settings.DATABASE_URL.startswith("sqlite")
+
+def _engine_options() -> dict:
+    if _is_sqlite:
+        # busy timeout instead of immediate "database is locked" under concurrent writers
+        return {"connect_args": {"check_same_thread": False, "timeout": settings.SQLITE_BUSY_TIMEOUT_SECONDS}}
+    return {
+        "pool_size": settings.DB_POOL_SIZE,
+        "max_overflow": settings.DB_MAX_OVERFLOW,
+        "pool_timeout": settings.DB_POOL_TIMEOUT,
+        "pool_recycle": settings.DB_POOL_RECYCLE,
+        "pool_pre_ping": True,
+    }
+
+engine = create_engine(settings.DATABASE_URL, future=True, **_engine_options())
 SessionLocal = sessionmaker(bind=engine, autocommit=False, autoflush=False, future=True)
 
-def init_db():
+if _is_sqlite:
+    @event.listens_for(engine, "connect")
+    def _sqlite_pragmas(dbapi_conn, _record):
+        cur = dbapi_conn.cursor()
+        if ":memory:" not in settings.DATABASE_URL:
+            # WAL: readers don't block the writer; NORMAL is durable across app crashes in WAL mode
+            cur.execute("PRAGMA journal_mode=WAL")
+        cur.execute("PRAGMA synchronous=NORMAL")
+        cur.execute(f"PRAGMA mmap_size={int(settings.SQLITE_MMAP_BYTES)}")
+        cur.execute(f"PRAGMA cache_size={-int(settings.SQLITE_CACHE_KB)}")
+        cur.execute("PRAGMA temp_store=MEMORY")
+        cur.close()
+
+def init_db(bind=None):
     # imported here to register models with Base before create_all
-    from app.models import user, document, chunk, chat, events  # noqa: F401
-    Base.metadata.create_all(bind=engine)
+    from app.models import user, document, chunk, chat, events, outbox  # noqa: F401
+    from app.migrations import run_migrations
+    bind = bind if bind is not None else engine
+    Base.metadata.create_all(bind=bind)
+    run_migrations(bind)
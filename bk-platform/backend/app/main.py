@@ -1,11 +1,23 @@
+import threading
+
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
+from app.core.admission import AdmissionMiddleware
 from app.core.config import settings
 from app.db import init_db
 from app.api import auth as auth_router
 from app.api import search as search_router
 from app.api import documents as documents_router
 from app.api import knowledge as knowledge_router
+from app.api import chat as chat_router
+from app.api import analytics as analytics_router
+from app.api import snapshots as snapshots_router
+from app.services import events, outbox
+from app.services.extract_pool import pool as extract_pool
+from app.services.files import sweep_blobs
+from app.services.llm import warm_ollama
+from app.services.context import warm_tokenizer
+from app.services.rerank import warm_reranker
 
 
 app = FastAPI(
@@ -14,6 +26,8 @@ app = FastAPI(
 )
 
 
+# added before CORS so CORS stays outermost and 429/503 responses carry its headers
+app.add_middleware(AdmissionMiddleware)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"], allow_credentials=True, allow_methods=["*"], allow_headers=["*"],
@@ -28,8 +42,32 @@ app.include_router(auth_router.router)
 app.include_router(documents_router.router)
 app.include_router(search_router.router)
 app.include_router(knowledge_router.router)
+app.include_router(chat_router.router)
+app.include_router(analytics_router.router)
+app.include_router(snapshots_router.router)
+
+@app.on_event("startup")
+def start_background_workers():
+    events.buffer.start()
+    outbox.worker.start()
+    if settings.EXTRACT_WORKERS > 0:
+        extract_pool.start()
+    # blobs queued by deletes before the last shutdown
+    threading.Thread(target=sweep_blobs, name="blob-sweep", daemon=True).start()
+    warm_tokenizer()  # background load: the first /ask shouldn't wait on a Hub download
+    warm_reranker()
+    if settings.OLLAMA_WARMUP and settings.OLLAMA_MODEL:
+        # load the model off the startup path; the first question shouldn't pay for it
+        threading.Thread(target=warm_ollama, name="ollama-warmup", daemon=True).start()
+
+@app.on_event("shutdown")
+def stop_background_workers():
+    outbox.worker.stop()
+    events.buffer.stop()
+    extract_pool.close()
 
 
 
-# init tables
-init_db()
+# init tables (serve.py already did, once, before spawning its workers)
+if settings.INIT_DB_ON_STARTUP:
+    init_db()
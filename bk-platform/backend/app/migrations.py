@@ -0,0 +1,76 @@
+# app/migrations.py
+# Versioned schema changes on top of create_all (which only creates missing
+# tables). Each step runs once, in order, and is recorded in schema_migrations.
+# Statements must be idempotent so fresh databases (where create_all already
+# built the index from the model) and old ones end up identical; a step that
+# SQL can't make idempotent (ADD COLUMN) is a callable taking the connection.
+from typing import Callable, List, Tuple, Union
+import logging
+
+from sqlalchemy import inspect, text
+from sqlalchemy.engine import Connection, Engine
+
+log = logging.getLogger(__name__)
+
+Step = Union[str, Callable[[Connection], None]]
+
+def _add_column(table: str, column: str, ddl_type: str) -> Callable[[Connection], None]:
+    def step(conn: Connection) -> None:
+        if column not in {c["name"] for c in inspect(conn).get_columns(table)}:
+            conn.execute(text(f"ALTER TABLE {table} ADD COLUMN {column} {ddl_type}"))
+    return step
+
+MIGRATIONS: List[Tuple[int, str, List[Step]]] = [
+    (1, "hot-path indexes", [
+        "CREATE INDEX IF NOT EXISTS ix_documents_user_id ON documents (user_id)",
+        # serves both `WHERE document_id = ?` and `... ORDER BY position`
+        "CREATE INDEX IF NOT EXISTS ix_document_chunks_document_id_position ON document_chunks (document_id, position)",
+        "CREATE INDEX IF NOT EXISTS ix_chat_messages_session_id ON chat_messages (session_id)",
+    ]),
+    (2, "link duplicate chunks by term set", [
+        _add_column("chunk_fingerprints", "terms_hash", "BIGINT"),
+        "CREATE INDEX IF NOT EXISTS ix_chunk_fingerprints_user_terms ON chunk_fingerprints (user_id, terms_hash)",
+        # links made by SimHash distance alone may hide text the gates can tell
+        # apart: give those chunks their own vectors again
+        "INSERT INTO vector_outbox (document_id, user_id, filename, status, attempts)"
+        " SELECT d.id, d.user_id, d.filename, 'pending', 0 FROM documents d"
+        " WHERE d.id IN (SELECT document_id FROM chunk_fingerprints"
+        "  WHERE canonical_document_id IS NOT NULL AND terms_hash IS NULL)",
+        "UPDATE chunk_fingerprints SET canonical_document_id = NULL, canonical_position = NULL"
+        " WHERE canonical_document_id IS NOT NULL AND terms_hash IS NULL",
+    ]),
+]
+
+def current_version(engine: Engine) -> int:
+    with engine.connect() as conn:
+        return int(conn.execute(text("SELECT COALESCE(MAX(version), 0) FROM schema_migrations")).scalar() or 0)
+
+def run_migrations(engine: Engine) -> int:
+    """Apply pending migrations; returns the schema version afterwards."""
+    with engine.begin() as conn:
+        conn.execute(text(
+            "CREATE TABLE IF NOT EXISTS schema_migrations ("
+            " version INTEGER PRIMARY KEY,"
+            " name VARCHAR(255) NOT NULL,"
+            " applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP)"
+        ))
+    version = current_version(engine)
+    for v, name, statements in MIGRATIONS:
+        if v <= version:
+            continue
+        # one transaction per step; a concurrent worker that lost the race
+        # fails on the primary key and simply re-reads the version
+        try:
+            with engine.begin() as conn:
+                for stmt in statements:
+                    if callable(stmt):
+                        stmt(conn)
+                    else:
+                        conn.execute(text(stmt))
+                conn.execute(text("INSERT INTO schema_migrations (version, name) VALUES (:v, :n)"), {"v": v, "n": name})
+            log.info("applied migration %d: %s", v, name)
+        except Exception:
+            if current_version(engine) < v:
+                raise
+        version = v
+    return version
@@ -1,6 +1,7 @@
 # makes importing side-effect free for create_all
 from .user import User  # noqa
-from .document import Document  # noqa
-from .chunk import DocumentChunk  # noqa
-from .chat import ChatSession, ChatMessage  # noqa
-from .events import SearchQuery, UserActivity  # noqa
+from .document import Document, BlobDeletion  # noqa
+from .chunk import DocumentChunk, ChunkFingerprint  # noqa
+from .chat import ChatSession, ChatMessage, ChatSummary  # noqa
+from .events import SearchQuery, UserActivity, ActivityRollup, QueryRollup  # noqa
+from .outbox import VectorOutbox  # noqa
@@ -12,7 +12,15 @@ class ChatSession(Base):
 class ChatMessage(Base):
     __tablename__ = "chat_messages"
     id: Mapped[int] = mapped_column(primary_key=True)
-    session_id: Mapped[int] = mapped_column(ForeignKey("chat_sessions.id"))
+    session_id: Mapped[int] = mapped_column(ForeignKey("chat_sessions.id"), index=True)
     role: Mapped[str]  # "user" | "assistant"
     content: Mapped[str]
     timestamp: Mapped["DateTime"] = mapped_column(DateTime(timezone=True), server_default=func.now())
+
+class ChatSummary(Base):
+    """Rolling summary of a session's older turns (messages with id <= until_message_id)."""
+    __tablename__ = "chat_summaries"
+    session_id: Mapped[int] = mapped_column(ForeignKey("chat_sessions.id"), primary_key=True)
+    content: Mapped[str] = mapped_column(default="")
+    until_message_id: Mapped[int] = mapped_column(Integer, default=0)
+    updated_at: Mapped["DateTime"] = mapped_column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
@@ -1,9 +1,10 @@
-from sqlalchemy import Integer, ForeignKey
+from sqlalchemy import BigInteger, Integer, ForeignKey, Index
 from sqlalchemy.orm import Mapped, mapped_column, relationship
 from app.db import Base
 
 class DocumentChunk(Base):
     __tablename__ = "document_chunks"
+    __table_args__ = (Index("ix_document_chunks_document_id_position", "document_id", "position"),)
     id: Mapped[int] = mapped_column(primary_key=True)
     document_id: Mapped[int] = mapped_column(ForeignKey("documents.id"))
     content: Mapped[str]
@@ -11,3 +12,32 @@ class DocumentChunk(Base):
     position: Mapped[int] = mapped_column(Integer, default=0)
 
     document = relationship("Document", back_populates="chunks")
+
+class ChunkFingerprint(Base):
+    """
+    SimHash of a chunk (64 bits, stored signed) split into four 16-bit LSH bands,
+    and a hash of its term set. canonical_* point at the chunk with the same
+    term set whose vector this one shares; NULL means the chunk has its own
+    vector. See app/services/dedup.py.
+    """
+    __tablename__ = "chunk_fingerprints"
+    __table_args__ = (
+        Index("ix_chunk_fingerprints_document_id_position", "document_id", "position"),
+        Index("ix_chunk_fingerprints_user_band0", "user_id", "band0"),
+        Index("ix_chunk_fingerprints_user_band1", "user_id", "band1"),
+        Index("ix_chunk_fingerprints_user_band2", "user_id", "band2"),
+        Index("ix_chunk_fingerprints_user_band3", "user_id", "band3"),
+        Index("ix_chunk_fingerprints_user_terms", "user_id", "terms_hash"),
+    )
+    id: Mapped[int] = mapped_column(primary_key=True)
+    user_id: Mapped[int] = mapped_column(ForeignKey("users.id"))
+    document_id: Mapped[int] = mapped_column(ForeignKey("documents.id"))
+    position: Mapped[int] = mapped_column(Integer)
+    simhash: Mapped[int] = mapped_column(BigInteger)
+    band0: Mapped[int] = mapped_column(Integer)
+    band1: Mapped[int] = mapped_column(Integer)
+    band2: Mapped[int] = mapped_column(Integer)
+    band3: Mapped[int] = mapped_column(Integer)
+    terms_hash: Mapped[int | None] = mapped_column(BigInteger, nullable=True)
+    canonical_document_id: Mapped[int | None] = mapped_column(Integer, nullable=True, index=True)
+    canonical_position: Mapped[int | None] = mapped_column(Integer, nullable=True)
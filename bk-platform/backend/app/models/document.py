@@ -5,7 +5,7 @@ from app.db import Base
 class Document(Base):
     __tablename__ = "documents"
     id: Mapped[int] = mapped_column(primary_key=True)
-    user_id: Mapped[int] = mapped_column(ForeignKey("users.id"))
+    user_id: Mapped[int] = mapped_column(ForeignKey("users.id"), index=True)
     filename: Mapped[str] = mapped_column(String(255))
     path: Mapped[str] = mapped_column(String(512))
     size: Mapped[int] = mapped_column(Integer)
@@ -15,3 +15,15 @@ class Document(Base):
     created_at: Mapped["DateTime"] = mapped_column(DateTime(timezone=True), server_default=func.now())
 
     chunks = relationship("DocumentChunk", back_populates="document")
+
+
+class BlobDeletion(Base):
+    """
+    A blob whose last document was deleted. Blobs are shared by content hash, so
+    they are only removed by a later sweep (app/services/files.py:sweep_blobs),
+    and an upload of the same bytes in the meantime cancels the row.
+    """
+    __tablename__ = "blob_deletions"
+    id: Mapped[int] = mapped_column(primary_key=True)
+    ref: Mapped[str] = mapped_column(String(512), index=True)
+    queued_at: Mapped["DateTime"] = mapped_column(DateTime(timezone=True))
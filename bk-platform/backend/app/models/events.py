@@ -1,4 +1,4 @@
-from sqlalchemy import Integer, ForeignKey, DateTime, func, String
+from sqlalchemy import Integer, ForeignKey, DateTime, func, String, Float, JSON, UniqueConstraint
 from sqlalchemy.orm import Mapped, mapped_column
 from app.db import Base
 
@@ -16,3 +16,25 @@ class UserActivity(Base):
     action: Mapped[str] = mapped_column(String(64))
     resource_id: Mapped[int | None]
     timestamp: Mapped["DateTime"] = mapped_column(DateTime(timezone=True), server_default=func.now())
+
+# ---- hourly rollups (maintained by app/services/events.py on every flush) ----
+class ActivityRollup(Base):
+    __tablename__ = "activity_rollups"
+    __table_args__ = (UniqueConstraint("user_id", "hour", "action", name="uq_activity_rollup"),)
+    id: Mapped[int] = mapped_column(primary_key=True)
+    user_id: Mapped[int] = mapped_column(ForeignKey("users.id"))
+    hour: Mapped["DateTime"] = mapped_column(DateTime(timezone=True), index=True)
+    action: Mapped[str] = mapped_column(String(64))
+    count: Mapped[int] = mapped_column(Integer, default=0)
+    latency_sum_ms: Mapped[float] = mapped_column(Float, default=0.0)
+    # counts per LATENCY_BUCKETS_MS bucket; percentiles are read off this histogram
+    latency_hist: Mapped[list] = mapped_column(JSON, default=list)
+
+class QueryRollup(Base):
+    __tablename__ = "query_rollups"
+    __table_args__ = (UniqueConstraint("user_id", "hour", "query", name="uq_query_rollup"),)
+    id: Mapped[int] = mapped_column(primary_key=True)
+    user_id: Mapped[int] = mapped_column(ForeignKey("users.id"))
+    hour: Mapped["DateTime"] = mapped_column(DateTime(timezone=True), index=True)
+    query: Mapped[str] = mapped_column(String(255))
+    count: Mapped[int] = mapped_column(Integer, default=0)
@@ -0,0 +1,20 @@
+from sqlalchemy import Integer, String, ForeignKey, DateTime, func
+from sqlalchemy.orm import Mapped, mapped_column
+from app.db import Base
+
+class VectorOutbox(Base):
+    """
+    One row per document whose chunks still have to reach the vector store.
+    Written in the same transaction as the (first) chunk rows; drained by
+    app/services/outbox.py (ingesting -> pending -> processing -> done | failed).
+    """
+    __tablename__ = "vector_outbox"
+    id: Mapped[int] = mapped_column(primary_key=True)
+    document_id: Mapped[int] = mapped_column(ForeignKey("documents.id"), index=True)
+    user_id: Mapped[int] = mapped_column(ForeignKey("users.id"))
+    filename: Mapped[str] = mapped_column(String(255))
+    status: Mapped[str] = mapped_column(String(16), default="pending", index=True)
+    attempts: Mapped[int] = mapped_column(Integer, default=0)
+    last_error: Mapped[str | None] = mapped_column(String(500), nullable=True)
+    claimed_at: Mapped["DateTime | None"] = mapped_column(DateTime(timezone=True), nullable=True)
+    created_at: Mapped["DateTime"] = mapped_column(DateTime(timezone=True), server_default=func.now())
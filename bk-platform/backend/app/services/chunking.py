@@ -1,4 +1,9 @@
-from typing import Iterable
+from typing import Iterable, Iterator, List, Optional
+import csv
+import io
+import re
+
+_non_space = re.compile(r"\S")
 
 def simple_chunks(text: str, chunk_size: int = 1000, overlap: int = 200) -> Iterable[str]:
     text = text.strip()
@@ -15,3 +20,60 @@ def simple_chunks(text: str, chunk_size: int = 1000, overlap: int = 200) -> Iter
             break
         start = end - overlap
     return chunks
+
+
+def stream_chunks(pieces: Iterable[str], chunk_size: int = 1000, overlap: int = 200) -> Iterator[str]:
+    """
+    Same chunks as simple_chunks("".join(pieces)), but holding only about one
+    chunk plus the current piece in memory.
+    """
+    buf, pos = "", 0  # unconsumed text is buf[pos:]; buf is rebuilt once per piece, not per chunk
+    started = False
+    for piece in pieces:
+        if not started:
+            piece = piece.lstrip()
+            if not piece:
+                continue
+            started = True
+        buf = buf[pos:] + piece
+        pos = 0
+        # only cut while real text follows: trailing whitespace is stripped at the end
+        while len(buf) - pos > chunk_size and _non_space.search(buf, pos + chunk_size):
+            yield buf[pos:pos + chunk_size]
+            pos += chunk_size - overlap
+    buf = buf[pos:].rstrip()
+    if buf:
+        yield buf
+
+
+def csv_row_chunks(lines: Iterable[str], chunk_size: int = 1000) -> Iterator[str]:
+    """
+    Chunk CSV by whole rows, repeating the header row at the top of every chunk
+    so each one is self-describing. A row longer than chunk_size becomes its own chunk.
+    """
+    reader = csv.reader(lines)
+    header: Optional[List[str]] = next(reader, None)
+    if header is None:
+        return
+
+    def render(rows: List[List[str]]) -> str:
+        out = io.StringIO()
+        csv.writer(out, lineterminator="\n").writerows(rows)
+        return out.getvalue().strip()
+
+    head = render([header])
+    group: List[str] = []
+    size = len(head)
+    for row in reader:
+        if not any(cell.strip() for cell in row):
+            continue
+        line = render([row])
+        if group and size + 1 + len(line) > chunk_size:
+            yield "\n".join([head, *group])
+            group, size = [], len(head)
+        group.append(line)
+        size += 1 + len(line)
+    if group:
+        yield "\n".join([head, *group])
+    elif head:
+        yield head
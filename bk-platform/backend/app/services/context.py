@@ -0,0 +1,287 @@
+# app/services/context.py
+from __future__ import annotations
+from typing import Callable, List, Dict, Any, Optional, Tuple
+import logging
+import os
+import re
+import threading
+import time
+
+import numpy as np
+
+from app.core.config import settings
+
+log = logging.getLogger(__name__)
+
+# ---------- token counting ----------
+# Tokenizers are optional: tiktoken for OpenAI models, transformers for HF repos.
+try:
+    import tiktoken
+except Exception:
+    tiktoken = None
+
+try:
+    from transformers import AutoTokenizer
+except Exception:
+    AutoTokenizer = None
+
+
+def _load_tokenizer(provider: str, model: str):
+    """Return an `encode(str) -> list` callable for the target model, or None. May hit the network."""
+    try:
+        if provider == "openai" and tiktoken:
+            try:
+                enc = tiktoken.encoding_for_model(model)
+            except KeyError:
+                enc = tiktoken.get_encoding("o200k_base")
+            return enc.encode
+        if provider == "hf" and AutoTokenizer:
+            tok = AutoTokenizer.from_pretrained(model, token=settings.HF_TOKEN)
+            return lambda s: tok.encode(s, add_special_tokens=False)
+    except Exception:
+        # offline / gated repo: fall back to the heuristic below
+        log.warning("tokenizer for %s/%s unavailable, counting ~4 chars/token", provider, model, exc_info=True)
+        return None
+    return None
+
+
+# Loaded tokenizers, by (provider, model). A load (a Hub or BPE download on
+# first use) never runs on a request: a miss starts it in the background and
+# the request counts with the heuristic meanwhile. Failures are not cached for
+# good, only for TOKENIZER_RETRY_SECONDS.
+_MAX_TOKENIZERS = 8
+_tokenizers: Dict[Tuple[str, str], Callable[[str], list]] = {}
+_loading: set = set()
+_failed_at: Dict[Tuple[str, str], float] = {}
+_tok_lock = threading.Lock()
+
+
+def _load_in_background(key: Tuple[str, str]) -> None:
+    enc = _load_tokenizer(*key)
+    with _tok_lock:
+        _loading.discard(key)
+        if enc is None:
+            _failed_at[key] = time.monotonic()
+        else:
+            _tokenizers[key] = enc
+            _failed_at.pop(key, None)
+
+
+def _tokenizer(provider: str, model: str) -> Optional[Callable[[str], list]]:
+    """The cached encoder for the target model, or None (heuristic) while it loads or is unavailable."""
+    if provider not in ("openai", "hf") or not model:
+        return None
+    key = (provider, model)
+    with _tok_lock:
+        enc = _tokenizers.get(key)
+        if enc is not None or key in _loading:
+            return enc
+        failed = _failed_at.get(key)
+        if failed is not None and time.monotonic() - failed < settings.TOKENIZER_RETRY_SECONDS:
+            return None
+        if len(_tokenizers) + len(_loading) >= _MAX_TOKENIZERS:
+            return None
+        _loading.add(key)
+    threading.Thread(target=_load_in_background, args=(key,), name="tokenizer-load", daemon=True).start()
+    return None
+
+
+def warm_tokenizer() -> None:
+    """Start loading the default target model's tokenizer (startup; returns immediately)."""
+    _tokenizer(*_target_model(None, None))
+
+
+def _target_model(provider: Optional[str], model: Optional[str]) -> tuple[str, str]:
+    # same auto-detection as llm.resolve_provider: HF only with a token *and* a model
+    p = (provider or "").lower()
+    if p == "openai" or (not p and settings.OPENAI_API_KEY):
+        return "openai", model or settings.OPENAI_MODEL or "gpt-4o-mini"
+    if p == "hf" or (not p and os.getenv("HF_TOKEN") and (model or settings.HF_MODEL_ID)):
+        return "hf", model or settings.HF_MODEL_ID or "mistralai/Mistral-7B-Instruct-v0.2"
+    # Ollama model tags don't map to a downloadable tokenizer
+    return "ollama", model or settings.OLLAMA_MODEL or ""
+
+
+class TokenCounter:
+    """Counts tokens with the target model's tokenizer; ~4 chars/token if unavailable."""
+
+    def __init__(self, provider: Optional[str] = None, model: Optional[str] = None):
+        self.provider, self.model = _target_model(provider, model)
+        self._encode = _tokenizer(self.provider, self.model)
+
+    @property
+    def exact(self) -> bool:
+        return self._encode is not None
+
+    def count(self, text: str) -> int:
+        if not text:
+            return 0
+        if self._encode is not None:
+            return len(self._encode(text))
+        return (len(text) + 3) // 4
+
+    def count_messages(self, messages: List[Dict[str, str]]) -> int:
+        """Tokens in the messages' contents (the chat template's own tokens not included)."""
+        return sum(self.count(m.get("content") or "") for m in messages)
+
+    def truncate(self, text: str, max_tokens: int) -> str:
+        """Cut text to at most `max_tokens`, preferring a line/sentence boundary."""
+        if max_tokens <= 0:
+            return ""
+        if self.count(text) <= max_tokens:
+            return text
+        lo, hi = 0, len(text)
+        while lo < hi:  # longest prefix that fits
+            mid = (lo + hi + 1) // 2
+            if self.count(text[:mid]) <= max_tokens:
+                lo = mid
+            else:
+                hi = mid - 1
+        cut = text[:lo]
+        for sep in ("\n", ". "):
+            i = cut.rfind(sep)
+            if i > len(cut) // 2:
+                return cut[: i + len(sep)].rstrip()
+        return cut.rstrip()
+
+
+# ---------- MMR selection ----------
+def mmr_select(
+    rows: List[Dict[str, Any]],
+    k: int,
+    lambda_mult: float = 0.7,
+) -> List[Dict[str, Any]]:
+    """
+    Maximal Marginal Relevance over retrieved rows.
+    Rows need an `embedding` (normalized); relevance is `rerank_score` when the
+    pool was reranked (rows the reranker didn't reach count as 0), else `score`.
+    Rows without embeddings keep their incoming order.
+    """
+    if len(rows) <= k:
+        return list(rows)
+    if any(r.get("embedding") is None for r in rows):
+        return list(rows[:k])
+
+    E = np.asarray([r["embedding"] for r in rows], dtype=np.float32)
+    if any("rerank_score" in r for r in rows):
+        rel = np.asarray([r.get("rerank_score", 0.0) for r in rows], dtype=np.float32)
+    else:
+        rel = np.asarray([r["score"] for r in rows], dtype=np.float32)
+    sim = E @ E.T
+
+    selected: List[int] = []
+    max_sim = np.full(len(rows), -np.inf, dtype=np.float32)
+    candidates = np.ones(len(rows), dtype=bool)
+    for _ in range(k):
+        redundancy = np.where(np.isfinite(max_sim), max_sim, 0.0)
+        mmr = lambda_mult * rel - (1.0 - lambda_mult) * redundancy
+        mmr[~candidates] = -np.inf
+        i = int(np.argmax(mmr))
+        selected.append(i)
+        candidates[i] = False
+        max_sim = np.maximum(max_sim, sim[i])
+    return [rows[i] for i in selected]
+
+
+# ---------- redundancy removal & packing ----------
+def _strip_overlap(prev: str, nxt: str, min_overlap: int = 20) -> str:
+    """Drop the prefix of `nxt` that repeats the tail of `prev` (chunk overlap)."""
+    max_len = min(len(prev), len(nxt), 512)
+    for size in range(max_len, min_overlap - 1, -1):
+        if prev.endswith(nxt[:size]):
+            return nxt[size:]
+    return nxt
+
+
+_line_norm = re.compile(r"\s+")
+
+
+def _merge_runs(chunks: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """
+    Group chunks by document (keeping first-seen order) and merge consecutive
+    chunk indexes into one block with the overlapping text removed.
+    """
+    by_doc: Dict[int, List[Dict[str, Any]]] = {}
+    for c in chunks:
+        by_doc.setdefault(c["document_id"], []).append(c)
+
+    blocks = []
+    for doc_id, items in by_doc.items():
+        items = sorted(items, key=lambda c: (c.get("chunk_index") is None, c.get("chunk_index") or 0))
+        run = [items[0]]
+        for c in items[1:]:
+            prev = run[-1]
+            if (
+                c.get("chunk_index") is not None
+                and prev.get("chunk_index") is not None
+                and c["chunk_index"] == prev["chunk_index"] + 1
+            ):
+                run.append(c)
+            else:
+                blocks.append(run)
+                run = [c]
+        blocks.append(run)
+
+    rank = {id(c): i for i, c in enumerate(chunks)}
+    blocks.sort(key=lambda run: min(rank[id(c)] for c in run))
+
+    merged = []
+    for run in blocks:
+        text = run[0]["content"] or ""
+        for c in run[1:]:
+            text += _strip_overlap(text, c["content"] or "")
+        first, last = run[0].get("chunk_index"), run[-1].get("chunk_index")
+        label = f"#{first}" if first == last else f"#{first}-{last}"
+        merged.append({"filename": run[0].get("filename"), "label": label, "content": text})
+    return merged
+
+
+def _line_key(line: str) -> str:
+    return _line_norm.sub(" ", line).strip().lower()
+
+
+def _drop_seen_lines(text: str, seen: set) -> str:
+    """Remove lines already emitted in an earlier block (headers, boilerplate) or earlier in this one."""
+    out, fresh = [], set()
+    for line in text.splitlines():
+        key = _line_key(line)
+        if len(key) >= 8:
+            if key in seen or key in fresh:
+                continue
+            fresh.add(key)
+        out.append(line)
+    return "\n".join(out).strip()
+
+
+def pack_context(
+    chunks: List[Dict[str, Any]],
+    token_limit: int,
+    counter: Optional[TokenCounter] = None,
+) -> str:
+    """
+    Pack chunks (already in selection order) into at most `token_limit` tokens:
+    merge adjacent chunks of a document, drop repeated text, and trim the last
+    block that doesn't fit instead of discarding it.
+    """
+    counter = counter or TokenCounter()
+    out, used, seen = [], 0, set()
+    for b in _merge_runs(chunks):
+        body = _drop_seen_lines(b["content"], seen)
+        if not body:
+            continue
+        header = f"[{b['filename']} {b['label']}]\n"
+        block = f"{header}{body}\n---\n"
+        cost = counter.count(block)
+        if used + cost > token_limit:
+            room = token_limit - used - counter.count(header + "\n---\n")
+            if room < 32:
+                continue
+            body = counter.truncate(body, room)
+            block = f"{header}{body}\n---\n"
+            cost = counter.count(block)
+        out.append(block)
+        used += cost
+        # only lines that made it into the context count as seen: a skipped or
+        # trimmed block must not hide its lines from the blocks after it
+        seen.update(k for k in map(_line_key, body.splitlines()) if len(k) >= 8)
+    return "".join(out).strip()
@@ -0,0 +1,210 @@
+# app/services/dedup.py
+"""
+Duplicate chunks (repeated headers, footers, boilerplate) at ingest, and
+near-duplicates at query time.
+
+Every chunk is fingerprinted twice:
+  * a hash of its term set (the distinct term ids the keyword gates match on).
+    A chunk whose term set equals one of the user's already indexed chunks is
+    linked to it (canonical_document_id/position) instead of being embedded:
+    the outbox skips it and search reports it as a copy of the indexed chunk.
+    Anything the gates could tell apart keeps its own vector, so two invoices
+    that differ only in their number are both indexed.
+  * a 64-bit SimHash over word 3-shingles, split into four 16-bit bands.
+    Chunks within DEDUP_MAX_HAMMING bits are near-duplicates; since chunks at
+    most 3 bits apart always agree on one band, finding them is an indexed
+    lookup. SimHash never decides what gets indexed: search uses it to report
+    near-duplicates and to collapse them on a result page.
+"""
+from __future__ import annotations
+from collections import defaultdict
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+import hashlib
+import threading
+
+import numpy as np
+from sqlalchemy import insert, or_, select, tuple_, update
+from sqlalchemy.orm import Session
+
+from app.core import metrics
+from app.core.config import settings
+from app.models.chunk import ChunkFingerprint
+from app.models.document import Document
+from app.models.outbox import VectorOutbox
+from app.services.terms import term_ids, tokenize
+
+BANDS = 4
+BAND_BITS = 64 // BANDS
+_MASK64 = (1 << 64) - 1
+_bit_index = np.arange(64, dtype=np.uint64)
+
+_stats = {"chunks": 0, "linked": 0, "promoted": 0}
+_stats_lock = threading.Lock()
+metrics.register("dedup", lambda: dict(_stats))
+
+Key = Tuple[int, int]  # (document_id, position)
+
+
+def simhash64(text: str) -> int:
+    """Unsigned 64-bit SimHash of the text's distinct word 3-shingles (words, for very short texts)."""
+    words = tokenize(text)
+    shingles = sorted({" ".join(words[i:i + 3]) for i in range(max(len(words) - 2, 1))}) if words else [""]
+    H = np.fromiter(
+        (int.from_bytes(hashlib.blake2b(s.encode(), digest_size=8).digest(), "little") for s in shingles),
+        dtype=np.uint64, count=len(shingles),
+    )
+    bits = ((H[:, None] >> _bit_index) & np.uint64(1)).astype(np.int32)
+    votes = (2 * bits - 1).sum(axis=0)
+    return int(sum(1 << i for i in np.flatnonzero(votes > 0)))
+
+
+def terms_hash(text: str) -> int:
+    """Signed 64-bit hash of the text's term set: equal for chunks the keyword gates can't tell apart."""
+    digest = hashlib.blake2b(term_ids(text).tobytes(), digest_size=8).digest()
+    return _to_signed(int.from_bytes(digest, "little"))
+
+
+def bands(h: int) -> List[int]:
+    return [(h >> (i * BAND_BITS)) & ((1 << BAND_BITS) - 1) for i in range(BANDS)]
+
+
+def hamming(a: int, b: int) -> int:
+    return bin((a ^ b) & _MASK64).count("1")
+
+
+def _to_signed(h: int) -> int:
+    return h - (1 << 64) if h >= 1 << 63 else h
+
+
+def _to_unsigned(h: int) -> int:
+    return h & _MASK64
+
+
+def fingerprint_window(
+    db: Session, *, chunks: Sequence[str], document_id: int, user_id: int, start: int,
+) -> int:
+    """
+    Insert fingerprints for chunks at positions start.. and link exact term-set
+    copies of the user's existing canonical chunks (this document's earlier
+    ones included). Runs inside the ingest transaction; returns how many
+    chunks were linked.
+    """
+    t_hashes = [terms_hash(ch) for ch in chunks]
+    # term-set hash -> canonical chunk carrying it
+    canon: Dict[int, Key] = {}
+    for doc_id, position, th in db.execute(
+        select(ChunkFingerprint.document_id, ChunkFingerprint.position, ChunkFingerprint.terms_hash)
+        .where(
+            ChunkFingerprint.user_id == user_id,
+            ChunkFingerprint.canonical_document_id.is_(None),
+            ChunkFingerprint.terms_hash.in_(sorted(set(t_hashes))),
+        )
+        .order_by(ChunkFingerprint.document_id, ChunkFingerprint.position)
+    ):
+        canon.setdefault(th, (doc_id, position))
+
+    rows, linked = [], 0
+    for offset, (text, th) in enumerate(zip(chunks, t_hashes)):
+        position = start + offset
+        match: Optional[Key] = canon.get(th) if len(text) >= settings.DEDUP_MIN_CHARS else None
+        if match is None:
+            canon.setdefault(th, (document_id, position))
+        else:
+            linked += 1
+        h = simhash64(text)
+        b0, b1, b2, b3 = bands(h)
+        rows.append({
+            "user_id": user_id, "document_id": document_id, "position": position,
+            "simhash": _to_signed(h), "band0": b0, "band1": b1, "band2": b2, "band3": b3,
+            "terms_hash": th,
+            "canonical_document_id": match[0] if match else None,
+            "canonical_position": match[1] if match else None,
+        })
+    db.execute(insert(ChunkFingerprint.__table__), rows)
+    with _stats_lock:
+        _stats["chunks"] += len(rows)
+        _stats["linked"] += linked
+    return linked
+
+
+def release_document(db: Session, document_id: int) -> List[int]:
+    """
+    Before a document's chunks go away (delete/reindex): for every chunk of it
+    that others link to, promote the first linked chunk to canonical, point
+    the rest at that one, and queue the promoted chunks' documents for
+    embedding. Then drop the document's fingerprints. Caller commits; returns
+    the requeued document ids.
+    """
+    deps = db.execute(
+        select(ChunkFingerprint.id, ChunkFingerprint.document_id, ChunkFingerprint.position,
+               ChunkFingerprint.canonical_position)
+        .where(ChunkFingerprint.canonical_document_id == document_id,
+               ChunkFingerprint.document_id != document_id)
+        .order_by(ChunkFingerprint.document_id, ChunkFingerprint.position)
+    ).all()
+    groups: Dict[int, List] = defaultdict(list)
+    for row in deps:
+        groups[row.canonical_position].append(row)
+    requeue = set()
+    for rows in groups.values():
+        head, rest = rows[0], rows[1:]
+        db.execute(update(ChunkFingerprint).where(ChunkFingerprint.id == head.id)
+                   .values(canonical_document_id=None, canonical_position=None))
+        if rest:
+            db.execute(update(ChunkFingerprint).where(ChunkFingerprint.id.in_([r.id for r in rest]))
+                       .values(canonical_document_id=head.document_id, canonical_position=head.position))
+        requeue.add(head.document_id)
+    for doc in db.query(Document).filter(Document.id.in_(requeue)).all() if requeue else []:
+        db.add(VectorOutbox(document_id=doc.id, user_id=doc.user_id, filename=doc.filename))
+    db.query(ChunkFingerprint).filter(ChunkFingerprint.document_id == document_id).delete()
+    with _stats_lock:
+        _stats["promoted"] += len(groups)
+    return sorted(requeue)
+
+
+def duplicates_of(db: Session, user_id: int, keys: Iterable[Key]) -> Dict[Key, List[Key]]:
+    """
+    For the given chunks: the user's other chunks that are copies of them
+    (linked at ingest) or near-duplicates (SimHash within DEDUP_MAX_HAMMING).
+    Chunks without a fingerprint (ingested with DEDUP_ENABLED off) have none.
+    """
+    keys = sorted(set(keys))
+    if not keys:
+        return {}
+    doc_ids = sorted({doc_id for doc_id, _ in keys})
+    # by document id, not user: with a user_id term SQLite picks a per-user band
+    # index and walks every fingerprint the user has (links never cross users)
+    own = {
+        (doc_id, pos): _to_unsigned(h)
+        for doc_id, pos, h in db.execute(
+            select(ChunkFingerprint.document_id, ChunkFingerprint.position, ChunkFingerprint.simhash)
+            .where(ChunkFingerprint.document_id.in_(doc_ids),
+                   tuple_(ChunkFingerprint.document_id, ChunkFingerprint.position).in_(keys))
+        )
+    }
+    out: Dict[Key, set] = defaultdict(set)
+    for canon_doc, canon_pos, doc_id, pos in db.execute(
+        select(ChunkFingerprint.canonical_document_id, ChunkFingerprint.canonical_position,
+               ChunkFingerprint.document_id, ChunkFingerprint.position)
+        .where(ChunkFingerprint.canonical_document_id.in_(doc_ids),
+               tuple_(ChunkFingerprint.canonical_document_id, ChunkFingerprint.canonical_position).in_(keys))
+    ):
+        out[(canon_doc, canon_pos)].add((doc_id, pos))
+    if own:
+        # band value -> the given chunks carrying it, per band
+        index: List[Dict[int, List[Key]]] = [defaultdict(list) for _ in range(BANDS)]
+        for key, h in own.items():
+            for i, b in enumerate(bands(h)):
+                index[i][b].append(key)
+        cols = [ChunkFingerprint.band0, ChunkFingerprint.band1, ChunkFingerprint.band2, ChunkFingerprint.band3]
+        for doc_id, pos, h in db.execute(
+            select(ChunkFingerprint.document_id, ChunkFingerprint.position, ChunkFingerprint.simhash)
+            .where(ChunkFingerprint.user_id == user_id,
+                   or_(*[col.in_(sorted(band)) for col, band in zip(cols, index)]))
+        ):
+            h = _to_unsigned(h)
+            for i, b in enumerate(bands(h)):
+                for key in index[i].get(b, ()):
+                    if key != (doc_id, pos) and hamming(h, own[key]) <= settings.DEDUP_MAX_HAMMING:
+                        out[key].add((doc_id, pos))
+    return {key: sorted(v) for key, v in out.items()}
@@ -0,0 +1,196 @@
+# app/services/doc_vectors.py
+"""
+Document-level vectors for two-stage retrieval.
+
+Each indexed document gets one vector in the "bk_docs" collection: the
+normalized mean of its chunk embeddings, written by the outbox drain right
+after the chunks (so it costs no extra embedding). A two-stage query first
+picks the user's RETRIEVAL_DOC_CANDIDATES closest documents, then searches
+chunks only inside them, so a few documents with many near-identical chunks
+can no longer fill the whole over-fetch.
+
+    python -m app.services.doc_vectors backfill [--force]   # documents indexed before this existed
+"""
+from __future__ import annotations
+from typing import Any, Callable, Dict, Iterable, List, Optional
+import argparse
+import json
+import logging
+import threading
+
+import numpy as np
+
+from app.core import metrics
+from app.core.config import settings
+from app.vector.chroma_client import get_collection, get_doc_collection
+
+log = logging.getLogger(__name__)
+
+_stats = {"centroids_upserted": 0, "stage1_queries": 0, "candidate_docs": 0, "flat_fallbacks": 0, "widened_queries": 0}
+_stats_lock = threading.Lock()
+metrics.register("doc_vectors", lambda: dict(_stats))
+
+
+def _bump(key: str, n: int = 1) -> None:
+    with _stats_lock:
+        _stats[key] += n
+
+
+def doc_vector_id(document_id: int) -> str:
+    return f"doc{document_id}"
+
+
+def centroid(vector_sum: np.ndarray) -> List[float]:
+    norm = float(np.linalg.norm(vector_sum))
+    return (vector_sum / norm if norm else vector_sum).astype(np.float32).tolist()
+
+
+def upsert_centroids(docs: Dict[int, Dict[str, Any]]) -> None:
+    """docs: document_id -> {"sum": ndarray, "count", "user_id", "filename"}."""
+    if not docs:
+        return
+    ids, embs, metas = [], [], []
+    for doc_id, d in docs.items():
+        ids.append(doc_vector_id(doc_id))
+        embs.append(centroid(d["sum"]))
+        metas.append({"document_id": doc_id, "user_id": d["user_id"], "filename": d["filename"], "chunks": d["count"]})
+    get_doc_collection().upsert(ids=ids, embeddings=embs, metadatas=metas)
+    _bump("centroids_upserted", len(ids))
+
+
+def delete_centroid(document_id: int) -> None:
+    get_doc_collection().delete(ids=[doc_vector_id(document_id)])
+
+
+def delete_document_vectors(document_id: int) -> None:
+    """A document's chunk vectors and its document vector."""
+    get_collection().delete(where={"document_id": document_id})
+    delete_centroid(document_id)
+
+
+def use_two_stage(flag: Optional[bool]) -> bool:
+    return settings.RETRIEVAL_TWO_STAGE if flag is None else flag
+
+
+# ---------- retrieval ----------
+def candidate_documents(q_embs: List[List[float]], user_id: int, n: int) -> List[List[int]]:
+    """Stage 1: the user's n closest documents per query vector (one Chroma call)."""
+    res = get_doc_collection().query(
+        query_embeddings=q_embs,
+        n_results=n,
+        where={"user_id": user_id},
+        include=["metadatas"],
+    )
+    _bump("stage1_queries")
+    out = []
+    for metas in res.get("metadatas") or [[] for _ in q_embs]:
+        ids = [int(m["document_id"]) for m in (metas or []) if m]
+        _bump("candidate_docs", len(ids))
+        out.append(ids)
+    return out
+
+
+def chunk_filter(user_id: int, doc_ids: Optional[List[int]]) -> Dict[str, Any]:
+    if doc_ids is None:
+        return {"user_id": user_id}
+    return {"$and": [{"user_id": user_id}, {"document_id": {"$in": doc_ids}}]}
+
+
+def query_chunks(col, q_embs: List[List[float]], n_results: int, user_id: int, include: List[str]) -> Dict[str, Any]:
+    """
+    col.query over chunks, two-stage: stage 2 runs once per query vector inside
+    its own candidate documents. A query with no candidate documents (nothing
+    backfilled yet) falls back to the flat search. Same result shape as col.query.
+    """
+    candidates = candidate_documents(q_embs, user_id, settings.RETRIEVAL_DOC_CANDIDATES)
+    merged: Dict[str, List[Any]] = {key: [] for key in include}
+    for q_emb, doc_ids in zip(q_embs, candidates):
+        if not doc_ids:
+            _bump("flat_fallbacks")
+        res = col.query(
+            query_embeddings=[q_emb],
+            n_results=n_results,
+            where=chunk_filter(user_id, doc_ids or None),
+            include=include,
+        )
+        for key in include:
+            merged[key].append((res.get(key) or [[]])[0])
+    return merged
+
+
+def widen_chunks(
+    col, q_emb: List[float], n_results: int, user_id: int, include: List[str],
+    gate: Callable[[Dict[str, Any]], List[Any]],
+) -> List[Any]:
+    """
+    A two-stage query whose candidate documents had nothing that passed the
+    caller's gate: re-run stage 2 over a growing candidate set (x SEARCH_POOL_GROWTH,
+    up to RETRIEVAL_DOC_CANDIDATES_MAX) while stage 1 keeps coming back full,
+    then fall back to the flat search. Returns the first non-empty gate(result).
+    """
+    _bump("widened_queries")
+    doc_n, searched = settings.RETRIEVAL_DOC_CANDIDATES, 0
+    while doc_n < settings.RETRIEVAL_DOC_CANDIDATES_MAX:
+        doc_n = min(doc_n * max(2, settings.SEARCH_POOL_GROWTH), settings.RETRIEVAL_DOC_CANDIDATES_MAX)
+        doc_ids = candidate_documents([q_emb], user_id, doc_n)[0]
+        if len(doc_ids) <= max(searched, settings.RETRIEVAL_DOC_CANDIDATES):
+            break  # no documents beyond the ones already searched
+        rows = gate(col.query(query_embeddings=[q_emb], n_results=n_results,
+                              where=chunk_filter(user_id, doc_ids), include=include))
+        if rows:
+            return rows
+        if len(doc_ids) < doc_n:
+            break  # that was every document with a vector
+        searched = len(doc_ids)
+    # documents indexed before their vectors existed (not backfilled) are only found flat
+    _bump("flat_fallbacks")
+    return gate(col.query(query_embeddings=[q_emb], n_results=n_results,
+                          where=chunk_filter(user_id, None), include=include))
+
+
+# ---------- backfill ----------
+def backfill(force: bool = False, document_ids: Optional[Iterable[int]] = None) -> Dict[str, int]:
+    """Centroids for documents that have chunk vectors but no document vector (all of them with force)."""
+    from app.db import SessionLocal
+    from app.models.document import Document
+
+    chunks, docs_col = get_collection(), get_doc_collection()
+    done = skipped = 0
+    with SessionLocal() as db:
+        q = db.query(Document.id, Document.user_id, Document.filename).order_by(Document.id)
+        if document_ids is not None:
+            q = q.filter(Document.id.in_(list(document_ids)))
+        rows = q.all()
+    pending: Dict[int, Dict[str, Any]] = {}
+    for doc_id, user_id, filename in rows:
+        if not force and docs_col.get(ids=[doc_vector_id(doc_id)])["ids"]:
+            skipped += 1
+            continue
+        got = chunks.get(where={"document_id": doc_id}, include=["embeddings"])
+        embs = got.get("embeddings")
+        if embs is None or not len(embs):
+            skipped += 1
+            continue
+        E = np.asarray(embs, dtype=np.float32)
+        pending[doc_id] = {"sum": E.sum(axis=0), "count": len(E), "user_id": user_id, "filename": filename}
+        if len(pending) >= 100:
+            upsert_centroids(pending)
+            done += len(pending)
+            pending = {}
+    upsert_centroids(pending)
+    done += len(pending)
+    return {"documents": done, "skipped": skipped}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Document vectors for two-stage retrieval")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    b = sub.add_parser("backfill", help="compute missing document vectors from stored chunk vectors")
+    b.add_argument("--force", action="store_true", help="recompute every document")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    print(json.dumps(backfill(force=args.force)))
+
+
+if __name__ == "__main__":
+    main()
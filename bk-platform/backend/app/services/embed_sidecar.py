@@ -0,0 +1,358 @@
+# app/services/embed_sidecar.py
+"""
+Embedding sidecar: one process per node holds the SentenceTransformer model
+and embeds for every API worker (EMBED_MODE=sidecar), so model memory no
+longer grows with the worker count.
+
+    python -m app.services.embed_sidecar               # listens on EMBED_SOCKET
+
+Workers send texts over a Unix socket (length-prefixed JSON frames). Requests
+from all connections go through one queue; the batcher waits up to
+EMBED_BATCH_WAIT_MS for more requests (up to EMBED_BATCH_MAX texts) and runs
+a single encode for all of them. Each request's float32 matrix is written to a
+fresh shared-memory block, and only its name goes back over the socket; the
+client copies the rows out and unlinks the block.
+"""
+from __future__ import annotations
+from multiprocessing import resource_tracker, shared_memory
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+import argparse
+import json
+import os
+import queue
+import socket
+import struct
+import subprocess
+import sys
+import threading
+import time
+
+import numpy as np
+
+from app.core import metrics
+from app.core.config import settings
+
+_header = struct.Struct(">I")
+
+BACKEND_ROOT = Path(__file__).resolve().parents[2]
+
+
+class EmbedSidecarError(RuntimeError):
+    pass
+
+
+# ---------- framing ----------
+def _recv_exact(sock: socket.socket, n: int) -> Optional[bytes]:
+    buf = bytearray()
+    while len(buf) < n:
+        part = sock.recv(n - len(buf))
+        if not part:
+            return None
+        buf += part
+    return bytes(buf)
+
+
+def _send_msg(sock: socket.socket, msg: Dict[str, Any]) -> None:
+    body = json.dumps(msg).encode("utf-8")
+    sock.sendall(_header.pack(len(body)) + body)
+
+
+def _recv_msg(sock: socket.socket) -> Optional[Dict[str, Any]]:
+    head = _recv_exact(sock, _header.size)
+    if head is None:
+        return None
+    body = _recv_exact(sock, _header.unpack(head)[0])
+    if body is None:
+        return None
+    return json.loads(body)
+
+
+# ---------- server ----------
+def _discard_shm(reply: Dict[str, Any]) -> None:
+    if "shm" not in reply:
+        return
+    try:
+        shm = shared_memory.SharedMemory(name=reply["shm"])
+    except FileNotFoundError:
+        return
+    shm.close()
+    shm.unlink()
+
+
+class _Job:
+    __slots__ = ("texts", "done", "result", "error")
+
+    def __init__(self, texts: List[str]):
+        self.texts = texts
+        self.done = threading.Event()
+        self.result: Optional[np.ndarray] = None
+        self.error: Optional[str] = None
+
+
+class EmbedServer:
+    def __init__(self, path: str, batch_max: Optional[int] = None, wait_ms: Optional[float] = None):
+        self.path = path
+        self.batch_max = batch_max or settings.EMBED_BATCH_MAX
+        self.wait = (settings.EMBED_BATCH_WAIT_MS if wait_ms is None else wait_ms) / 1000.0
+        self._jobs: "queue.Queue[_Job]" = queue.Queue()
+        self._stats = {"requests": 0, "texts": 0, "batches": 0, "encode_ms_total": 0.0, "errors": 0}
+        self._lock = threading.Lock()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            out = dict(self._stats)
+        out["encode_ms_total"] = round(out["encode_ms_total"], 1)
+        out["avg_batch_texts"] = round(out["texts"] / out["batches"], 2) if out["batches"] else None
+        out["model"] = settings.EMBED_MODEL
+        return out
+
+    def _batcher(self) -> None:
+        from app.services.embeddings import get_embedder
+        while True:
+            batch = [self._jobs.get()]
+            n = len(batch[0].texts)
+            deadline = time.monotonic() + self.wait
+            while n < self.batch_max:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    job = self._jobs.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                batch.append(job)
+                n += len(job.texts)
+
+            t0 = time.perf_counter()
+            try:
+                texts = [t for job in batch for t in job.texts]
+                E = np.asarray(get_embedder().encode(texts, normalize_embeddings=True), dtype=np.float32)
+                start = 0
+                for job in batch:
+                    job.result = E[start:start + len(job.texts)]
+                    start += len(job.texts)
+            except Exception as e:
+                for job in batch:
+                    job.error = f"{type(e).__name__}: {e}"
+            with self._lock:
+                self._stats["batches"] += 1
+                self._stats["requests"] += len(batch)
+                self._stats["texts"] += n
+                self._stats["encode_ms_total"] += (time.perf_counter() - t0) * 1000
+            for job in batch:
+                job.done.set()
+
+    def _embed(self, msg: Dict[str, Any]) -> Dict[str, Any]:
+        if msg.get("model") != settings.EMBED_MODEL:
+            return {"error": f"sidecar serves {settings.EMBED_MODEL!r}, not {msg.get('model')!r}"}
+        job = _Job(list(msg.get("texts") or []))
+        self._jobs.put(job)
+        job.done.wait()
+        if job.error:
+            with self._lock:
+                self._stats["errors"] += 1
+            return {"error": job.error}
+        arr = np.ascontiguousarray(job.result)
+        shm = shared_memory.SharedMemory(create=True, size=max(arr.nbytes, 1))
+        try:
+            np.ndarray(arr.shape, dtype=np.float32, buffer=shm.buf)[:] = arr
+            # the client unlinks it; don't let this process's tracker reap it at exit
+            resource_tracker.unregister(shm._name, "shared_memory")
+            return {"shm": shm.name, "rows": arr.shape[0], "dim": arr.shape[1]}
+        finally:
+            shm.close()
+
+    def _handle(self, conn: socket.socket) -> None:
+        with conn:
+            while True:
+                try:
+                    msg = _recv_msg(conn)
+                except (OSError, ValueError):
+                    return
+                if msg is None:
+                    return
+                op = msg.get("op", "embed")
+                if op == "embed":
+                    reply = self._embed(msg)
+                elif op == "ping":
+                    reply = {"ok": True, "model": settings.EMBED_MODEL}
+                elif op == "stats":
+                    reply = self.stats()
+                else:
+                    reply = {"error": f"unknown op {op!r}"}
+                try:
+                    _send_msg(conn, reply)
+                except OSError:
+                    # the client gave up (timeout) or went away: nobody will unlink the block
+                    _discard_shm(reply)
+                    return
+
+    def serve_forever(self) -> None:
+        from app.services.embeddings import get_embedder
+        get_embedder()  # load before accepting, so the first request doesn't pay for it
+        try:
+            os.unlink(self.path)  # stale socket from a previous run
+        except FileNotFoundError:
+            pass
+        srv = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        srv.bind(self.path)
+        os.chmod(self.path, 0o600)
+        srv.listen(256)
+        threading.Thread(target=self._batcher, name="embed-batcher", daemon=True).start()
+        try:
+            while True:
+                conn, _ = srv.accept()
+                threading.Thread(target=self._handle, args=(conn,), name="embed-conn", daemon=True).start()
+        finally:
+            srv.close()
+            try:
+                os.unlink(self.path)
+            except FileNotFoundError:
+                pass
+
+
+# ---------- client ----------
+class _Closed(ConnectionError):
+    pass
+
+
+class SidecarClient:
+    """One connection per calling thread; a connection found broken before the request went out is reopened once."""
+
+    def __init__(self, path: Optional[str] = None):
+        self.path = path
+        self._local = threading.local()
+        self._stats = {"requests": 0, "texts": 0, "errors": 0, "ms_total": 0.0}
+        self._lock = threading.Lock()
+
+    def _socket(self) -> socket.socket:
+        sock = getattr(self._local, "sock", None)
+        if sock is None:
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            sock.settimeout(settings.EMBED_SIDECAR_TIMEOUT_SECONDS)
+            try:
+                sock.connect(self.path or settings.EMBED_SOCKET)
+            except OSError:
+                sock.close()
+                raise
+            self._local.sock = sock
+        return sock
+
+    def _drop(self) -> None:
+        sock = getattr(self._local, "sock", None)
+        self._local.sock = None
+        if sock is not None:
+            sock.close()
+
+    def call(self, msg: Dict[str, Any]) -> Dict[str, Any]:
+        for attempt in (1, 2):
+            sent = False
+            try:
+                sock = self._socket()
+                _send_msg(sock, msg)
+                sent = True
+                reply = _recv_msg(sock)
+                if reply is None:
+                    raise _Closed("embedding sidecar closed the connection")
+                return reply
+            except (OSError, ValueError) as e:
+                self._drop()
+                # Retry only when the request can't have been processed: connect/send
+                # failed, or a pooled connection turned out closed (the sidecar restarted).
+                # After a timeout the reply may still come; resending would encode twice.
+                if attempt == 2 or (sent and not isinstance(e, _Closed)):
+                    raise EmbedSidecarError(f"embedding sidecar at {self.path or settings.EMBED_SOCKET}: {e}") from e
+
+    def embed(self, texts: List[str], model: str) -> np.ndarray:
+        if not texts:
+            return np.zeros((0, 0), dtype=np.float32)
+        t0 = time.perf_counter()
+        reply = self.call({"op": "embed", "model": model, "texts": list(texts)})
+        if "error" in reply:
+            with self._lock:
+                self._stats["errors"] += 1
+            raise EmbedSidecarError(reply["error"])
+        shm = shared_memory.SharedMemory(name=reply["shm"])
+        try:
+            out = np.ndarray((reply["rows"], reply["dim"]), dtype=np.float32, buffer=shm.buf).copy()
+        finally:
+            shm.close()
+            shm.unlink()
+        with self._lock:
+            self._stats["requests"] += 1
+            self._stats["texts"] += len(texts)
+            self._stats["ms_total"] += (time.perf_counter() - t0) * 1000
+        return out
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            out = dict(self._stats)
+        out["ms_total"] = round(out["ms_total"], 1)
+        if settings.EMBED_MODE == "sidecar":
+            try:
+                out["server"] = self.call({"op": "stats"})
+            except EmbedSidecarError as e:
+                out["server"] = {"error": str(e)}
+        return out
+
+
+client = SidecarClient()
+metrics.register("embed_sidecar", client.stats)
+
+
+# ---------- launcher ----------
+class SidecarProcess:
+    """Run the sidecar as a child process (serve.py, tests); start() returns once it answers a ping."""
+
+    def __init__(self, path: Optional[str] = None):
+        self.path = str(Path(path or settings.EMBED_SOCKET).resolve())
+        self.proc: Optional[subprocess.Popen] = None
+
+    def start(self, timeout: float = 120.0) -> "SidecarProcess":
+        self.proc = subprocess.Popen(
+            [sys.executable, "-m", "app.services.embed_sidecar", "--socket", self.path],
+            env={**os.environ, "PYTHONPATH": os.pathsep.join(
+                p for p in (str(BACKEND_ROOT), os.environ.get("PYTHONPATH")) if p)},
+        )
+        probe = SidecarClient(self.path)
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if self.proc.poll() is not None:
+                raise RuntimeError(f"embedding sidecar exited with code {self.proc.returncode}")
+            try:
+                if probe.call({"op": "ping"}).get("ok"):
+                    probe._drop()
+                    return self
+            except EmbedSidecarError:
+                pass
+            time.sleep(0.2)
+        self.stop()
+        raise RuntimeError(f"embedding sidecar did not come up on {self.path} within {timeout:.0f}s")
+
+    def stop(self) -> None:
+        if self.proc and self.proc.poll() is None:
+            self.proc.terminate()
+            try:
+                self.proc.wait(timeout=15)
+            except subprocess.TimeoutExpired:
+                self.proc.kill()
+                self.proc.wait()
+        self.proc = None
+
+    def __enter__(self) -> "SidecarProcess":
+        return self.start()
+
+    def __exit__(self, *exc) -> None:
+        self.stop()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Serve embeddings to the API workers over a Unix socket")
+    parser.add_argument("--socket", default=settings.EMBED_SOCKET)
+    args = parser.parse_args()
+    EmbedServer(args.socket).serve_forever()
+
+
+if __name__ == "__main__":
+    main()
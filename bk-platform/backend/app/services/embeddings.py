@@ -1,14 +1,104 @@
-from sentence_transformers import SentenceTransformer
+from collections import OrderedDict
+import threading
+
+from app.core import metrics
 from app.core.config import settings
 
 _model = None
+_model_name = None
 
-def get_embedder() -> SentenceTransformer:
-    global _model
-    if _model is None:
+def get_embedder():
+    # imported here: in sidecar mode API workers never load torch at all
+    from sentence_transformers import SentenceTransformer
+    global _model, _model_name
+    if _model is None or _model_name != settings.EMBED_MODEL:
         _model = SentenceTransformer(settings.EMBED_MODEL)
+        _model_name = settings.EMBED_MODEL
+        query_cache.clear()  # vectors from another model are meaningless now
     return _model
 
+def _sync_model() -> None:
+    """Clear the query cache if EMBED_MODEL changed (loading the model only when embedding in-process)."""
+    global _model_name
+    if settings.EMBED_MODE != "sidecar":
+        get_embedder()
+    elif _model_name != settings.EMBED_MODEL:
+        _model_name = settings.EMBED_MODEL
+        query_cache.clear()
+
 def embed_texts(texts: list[str]) -> list[list[float]]:
+    if settings.EMBED_MODE == "sidecar":
+        # one model per node, shared by every worker (app/services/embed_sidecar.py)
+        from app.services.embed_sidecar import client
+        return client.embed(texts, settings.EMBED_MODEL).tolist()
     model = get_embedder()
     return model.encode(texts, normalize_embeddings=True).tolist()
+
+# ---- query embedding cache ----
+# Search/ask/chat traffic is dominated by repeated queries and type-ahead
+# variants: (model, normalized query) -> vector, bounded LRU.
+def normalize_query(q: str) -> str:
+    return " ".join(q.casefold().split())
+
+class _QueryCache:
+    def __init__(self, max_items: int):
+        self.max_items = max_items
+        self._items: "OrderedDict[tuple[str, str], tuple[float, ...]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = self.misses = 0
+
+    def get(self, key: tuple[str, str]) -> list[float] | None:
+        with self._lock:
+            vec = self._items.get(key)
+            if vec is None:
+                self.misses += 1
+                return None
+            self._items.move_to_end(key)
+            self.hits += 1
+            return list(vec)
+
+    def put(self, key: tuple[str, str], vec: list[float]) -> None:
+        if self.max_items <= 0:
+            return
+        with self._lock:
+            self._items[key] = tuple(vec)
+            self._items.move_to_end(key)
+            while len(self._items) > self.max_items:
+                self._items.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._items.clear()
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {"model": _model_name, "size": len(self._items), "max_size": self.max_items,
+                "hits": self.hits, "misses": self.misses,
+                "hit_rate": round(self.hits / total, 4) if total else None}
+
+query_cache = _QueryCache(settings.QUERY_EMBED_CACHE_SIZE)
+metrics.register("query_embedding_cache", query_cache.stats)
+
+def embed_query(q: str) -> list[float]:
+    """Embedding of a search/question string, cached per (model, normalized query)."""
+    _sync_model()
+    text = normalize_query(q)
+    key = (settings.EMBED_MODEL, text)
+    vec = query_cache.get(key)
+    if vec is None:
+        vec = embed_texts([text])[0]
+        query_cache.put(key, vec)
+    return vec
+
+def embed_queries(qs: list[str]) -> list[list[float]]:
+    """embed_query for many strings: cache hits are reused, all misses go through one encode."""
+    _sync_model()
+    texts = [normalize_query(q) for q in qs]
+    out: list[list[float] | None] = [query_cache.get((settings.EMBED_MODEL, t)) for t in texts]
+    missing = list(dict.fromkeys(t for t, v in zip(texts, out) if v is None))
+    if missing:
+        fresh = dict(zip(missing, embed_texts(missing)))
+        for t, vec in fresh.items():
+            query_cache.put((settings.EMBED_MODEL, t), vec)
+        out = [v if v is not None else fresh[t] for t, v in zip(texts, out)]
+    return out
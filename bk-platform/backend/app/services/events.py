@@ -0,0 +1,246 @@
+# app/services/events.py
+from __future__ import annotations
+from bisect import bisect_left
+from collections import defaultdict
+from datetime import datetime, timezone
+from typing import List, Dict, Any, Optional, Tuple
+import logging
+import threading
+import time
+
+from sqlalchemy import insert
+from sqlalchemy.exc import IntegrityError
+
+from app.core import metrics
+from app.core.config import settings
+from app.db import SessionLocal
+from app.models.events import SearchQuery, UserActivity, ActivityRollup, QueryRollup
+
+log = logging.getLogger(__name__)
+
+# Upper bucket edges (ms) of the latency histogram kept per rollup row.
+LATENCY_BUCKETS_MS = [5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000, 60000, float("inf")]
+
+QUERY_ACTIONS = {"search", "ask", "chat"}
+
+
+def _hour(ts: datetime) -> datetime:
+    return ts.replace(minute=0, second=0, microsecond=0)
+
+
+def _norm_query(q: str) -> str:
+    return " ".join((q or "").lower().split())[:255]
+
+
+def percentile(hist: List[int], p: float) -> Optional[float]:
+    """Approximate percentile (ms) from a LATENCY_BUCKETS_MS histogram, interpolating inside the bucket."""
+    total = sum(hist)
+    if not total:
+        return None
+    target = p / 100.0 * total
+    seen = 0
+    for i, n in enumerate(hist):
+        if n and seen + n >= target:
+            lo = LATENCY_BUCKETS_MS[i - 1] if i else 0.0
+            hi = LATENCY_BUCKETS_MS[i]
+            if hi == float("inf"):
+                return float(lo)
+            return round(lo + (hi - lo) * (target - seen) / n, 1)
+        seen += n
+    return None
+
+
+class EventBuffer:
+    """
+    Bounded in-memory event queue drained by a background thread.
+
+    `record()` never blocks on the database: when the buffer is full the event
+    is dropped and counted. The flusher writes raw rows with executemany and
+    folds the same batch into the hourly rollup tables in one transaction.
+    """
+
+    def __init__(self, capacity: int, batch_size: int, interval: float):
+        self.capacity, self.batch_size, self.interval = capacity, batch_size, interval
+        self._events: List[Dict[str, Any]] = []
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self.recorded = self.dropped = self.flushed = self.flush_errors = 0
+        self.last_flush_ms = 0.0
+
+    # ---- producer side ----
+    def record(self, event: Dict[str, Any]) -> bool:
+        with self._lock:
+            if len(self._events) >= self.capacity:
+                self.dropped += 1
+                return False
+            self._events.append(event)
+            self.recorded += 1
+            full = len(self._events) >= self.batch_size
+        if full:
+            self._wake.set()
+        return True
+
+    # ---- flusher thread ----
+    def start(self) -> None:
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="analytics-flush", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        self._wake.set()
+        if self._thread:
+            self._thread.join(timeout=10)
+        self.flush()
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            self._wake.wait(self.interval)
+            self._wake.clear()
+            self.flush()
+
+    def flush(self) -> int:
+        with self._lock:
+            batch, self._events = self._events, []
+        if not batch:
+            return 0
+        t0 = time.perf_counter()
+        for attempt in range(2):
+            try:
+                self._write(batch)
+                break
+            except IntegrityError:
+                # another worker created the same rollup row first; re-read and merge
+                if attempt == 1:
+                    self._requeue(batch)
+                    return 0
+            except Exception:
+                log.exception("analytics flush failed (%d events)", len(batch))
+                self._requeue(batch)
+                return 0
+        self.flushed += len(batch)
+        self.last_flush_ms = round((time.perf_counter() - t0) * 1000, 1)
+        return len(batch)
+
+    def _requeue(self, batch: List[Dict[str, Any]]) -> None:
+        self.flush_errors += 1
+        with self._lock:
+            room = max(0, self.capacity - len(self._events))
+            self._events[:0] = batch[:room]
+            self.dropped += len(batch) - min(room, len(batch))
+
+    def _write(self, batch: List[Dict[str, Any]]) -> None:
+        queries = [
+            {"user_id": e["user_id"], "query": e["query"], "timestamp": e["ts"]}
+            for e in batch if e.get("query") and e["action"] in QUERY_ACTIONS
+        ]
+        activities = [
+            {"user_id": e["user_id"], "action": e["action"], "resource_id": e.get("resource_id"), "timestamp": e["ts"]}
+            for e in batch
+        ]
+        with SessionLocal() as db:
+            if queries:
+                db.execute(insert(SearchQuery), queries)
+            db.execute(insert(UserActivity), activities)
+            _apply_rollups(db, batch)
+            db.commit()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            queued = len(self._events)
+        return {
+            "queued": queued,
+            "capacity": self.capacity,
+            "recorded": self.recorded,
+            "dropped": self.dropped,
+            "flushed": self.flushed,
+            "flush_errors": self.flush_errors,
+            "last_flush_ms": self.last_flush_ms,
+        }
+
+
+def _apply_rollups(db, batch: List[Dict[str, Any]]) -> None:
+    """Merge a batch of events into ActivityRollup / QueryRollup rows."""
+    acts: Dict[Tuple[int, datetime, str], Dict[str, Any]] = {}
+    qcounts: Dict[Tuple[int, datetime, str], int] = defaultdict(int)
+    for e in batch:
+        hour = _hour(e["ts"])
+        a = acts.setdefault((e["user_id"], hour, e["action"]), {"count": 0, "sum": 0.0, "hist": [0] * len(LATENCY_BUCKETS_MS)})
+        a["count"] += 1
+        if e.get("latency_ms") is not None:
+            a["sum"] += e["latency_ms"]
+            a["hist"][bisect_left(LATENCY_BUCKETS_MS, e["latency_ms"])] += 1
+        if e.get("query") and e["action"] in QUERY_ACTIONS:
+            qcounts[(e["user_id"], hour, _norm_query(e["query"]))] += 1
+
+    users = {k[0] for k in acts}
+    hours = {k[1] for k in acts}
+    existing = {
+        (r.user_id, _hour(_aware(r.hour)), r.action): r
+        for r in db.query(ActivityRollup).filter(ActivityRollup.user_id.in_(users), ActivityRollup.hour.in_(hours))
+    }
+    for key, a in acts.items():
+        row = existing.get(key)
+        if row is None:
+            db.add(ActivityRollup(user_id=key[0], hour=key[1], action=key[2],
+                                  count=a["count"], latency_sum_ms=a["sum"], latency_hist=a["hist"]))
+        else:
+            hist = list(row.latency_hist or [0] * len(LATENCY_BUCKETS_MS))
+            row.latency_hist = [x + y for x, y in zip(hist, a["hist"])]
+            row.count += a["count"]
+            row.latency_sum_ms += a["sum"]
+
+    if qcounts:
+        existing_q = {
+            (r.user_id, _hour(_aware(r.hour)), r.query): r
+            for r in db.query(QueryRollup).filter(
+                QueryRollup.user_id.in_({k[0] for k in qcounts}),
+                QueryRollup.hour.in_({k[1] for k in qcounts}),
+                QueryRollup.query.in_({k[2] for k in qcounts}),
+            )
+        }
+        for key, n in qcounts.items():
+            row = existing_q.get(key)
+            if row is None:
+                db.add(QueryRollup(user_id=key[0], hour=key[1], query=key[2], count=n))
+            else:
+                row.count += n
+
+
+def _aware(ts: datetime) -> datetime:
+    # SQLite hands back naive datetimes; everything here is UTC
+    return ts if ts.tzinfo else ts.replace(tzinfo=timezone.utc)
+
+
+# ---------- process-wide buffer ----------
+buffer = EventBuffer(
+    capacity=settings.ANALYTICS_BUFFER_SIZE,
+    batch_size=settings.ANALYTICS_BATCH_SIZE,
+    interval=settings.ANALYTICS_FLUSH_SECONDS,
+)
+metrics.register("analytics", buffer.stats)
+
+
+def record_event(
+    user_id: int,
+    action: str,
+    *,
+    query: Optional[str] = None,
+    resource_id: Optional[int] = None,
+    latency_ms: Optional[float] = None,
+) -> None:
+    """Queue an analytics event; cheap and non-blocking (dropped if the buffer is full)."""
+    if not settings.ANALYTICS_ENABLED:
+        return
+    buffer.record({
+        "user_id": user_id,
+        "action": action,
+        "query": query,
+        "resource_id": resource_id,
+        "latency_ms": latency_ms,
+        "ts": datetime.now(tz=timezone.utc),
+    })
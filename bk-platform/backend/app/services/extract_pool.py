@@ -0,0 +1,226 @@
+# app/services/extract_pool.py
+# pypdf/Tesseract run in long-lived worker processes instead of the API process:
+# a hung or runaway parse is killed (wall-clock timeout, RSS cap) without taking
+# the server with it, and workers are recycled after N jobs to shed leaked memory.
+from __future__ import annotations
+from typing import Optional
+import logging
+import multiprocessing as mp
+import os
+import queue
+import signal
+import threading
+import time
+
+from app.core import metrics
+from app.core.config import settings
+
+log = logging.getLogger(__name__)
+
+_POLL_SECONDS = 0.1
+
+
+class ExtractionError(RuntimeError):
+    pass
+
+
+class ExtractionTimeout(ExtractionError):
+    pass
+
+
+class _JobFailed(ExtractionError):
+    """The file itself couldn't be parsed; the worker that said so is still healthy."""
+
+
+def _rss_bytes(pid: int) -> int:
+    """Resident set size from /proc (Linux); 0 where unavailable."""
+    try:
+        with open(f"/proc/{pid}/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return 0
+
+
+def _worker_main(conn, max_vm_bytes: int) -> None:
+    # own process group, so poppler/tesseract subprocesses die with the worker
+    if hasattr(os, "setsid"):
+        os.setsid()
+    if max_vm_bytes:
+        try:
+            import resource
+            resource.setrlimit(resource.RLIMIT_AS, (max_vm_bytes, max_vm_bytes))
+        except (ImportError, ValueError, OSError):
+            pass
+    from app.services.text_extract import extract_text_from_bytes
+
+    while True:
+        try:
+            job = conn.recv()
+        except (EOFError, OSError):
+            return
+        if job is None:  # graceful retire
+            return
+        data, filename, mime = job
+        try:
+            conn.send(("ok", extract_text_from_bytes(data, filename, mime)))
+        except MemoryError:
+            # the heap may be left in any state: exit and let the pool replace us
+            conn.send(("fatal", "MemoryError: extraction exceeded the worker memory limit"))
+            return
+        except Exception as e:
+            conn.send(("err", f"{type(e).__name__}: {e}"))
+
+
+class _Worker:
+    def __init__(self, ctx):
+        self.conn, child = ctx.Pipe()
+        self.proc = ctx.Process(
+            target=_worker_main, args=(child, settings.EXTRACT_MAX_VM_MB * 1024 * 1024),
+            name="bk-extract", daemon=True,
+        )
+        self.proc.start()
+        child.close()
+        self.jobs = 0
+
+    def alive(self) -> bool:
+        return self.proc.is_alive()
+
+    def stop(self, graceful: bool = True) -> None:
+        if graceful and self.proc.is_alive():
+            try:
+                self.conn.send(None)
+                self.proc.join(timeout=2)
+            except (OSError, ValueError):
+                pass
+        if self.proc.is_alive():
+            try:
+                os.killpg(self.proc.pid, signal.SIGKILL)
+            except (AttributeError, OSError):
+                self.proc.kill()
+            self.proc.join(timeout=5)
+        self.conn.close()
+
+
+class ExtractPool:
+    """
+    Fixed-size pool of extraction processes. `extract` blocks the calling thread
+    (never call it on the event loop) until a worker is free and has finished.
+    """
+
+    def __init__(self, size: int, timeout: float, max_rss_mb: int, max_jobs: int):
+        self.size, self.timeout = size, timeout
+        self.max_rss = max_rss_mb * 1024 * 1024
+        self.max_jobs = max_jobs
+        # spawn: workers start from a clean interpreter, not a fork of a threaded server
+        self._ctx = mp.get_context("spawn")
+        self._idle: "queue.LifoQueue[_Worker]" = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(max(size, 1))
+        self._closed = False
+        self._stats = {"jobs": 0, "failures": 0, "timeouts": 0, "rss_kills": 0,
+                       "crashes": 0, "recycled": 0, "spawned": 0, "busy": 0}
+
+    def start(self) -> None:
+        """Pre-spawn workers so the first uploads don't pay interpreter start-up."""
+        self._closed = False
+        for _ in range(self.size - self._idle.qsize()):
+            self._idle.put(self._spawn())
+
+    def close(self) -> None:
+        self._closed = True
+        while True:
+            try:
+                self._idle.get_nowait().stop()
+            except queue.Empty:
+                return
+
+    def stats(self) -> dict:
+        return {**self._stats, "workers": self.size, "idle": self._idle.qsize()}
+
+    def _spawn(self) -> _Worker:
+        self._stats["spawned"] += 1
+        return _Worker(self._ctx)
+
+    def _checkout(self) -> _Worker:
+        try:
+            w = self._idle.get_nowait()
+        except queue.Empty:
+            return self._spawn()
+        if not w.alive():
+            w.stop(graceful=False)
+            return self._spawn()
+        return w
+
+    def _checkin(self, w: _Worker) -> None:
+        w.jobs += 1
+        if self._closed or w.jobs >= self.max_jobs or (self.max_rss and _rss_bytes(w.proc.pid) > self.max_rss // 2):
+            # retire between jobs (job count, or idle RSS past half the cap):
+            # long-lived parsers fragment and leak memory
+            self._stats["recycled"] += 1
+            w.stop()
+            return
+        self._idle.put(w)
+
+    def _run(self, w: _Worker, data: bytes, filename: str, mime: Optional[str]) -> str:
+        deadline = time.monotonic() + self.timeout
+        w.conn.send((data, filename, mime))
+        while True:
+            if w.conn.poll(_POLL_SECONDS):
+                try:
+                    status, payload = w.conn.recv()
+                except (EOFError, OSError):
+                    break
+                if status == "err":
+                    self._stats["failures"] += 1
+                    raise _JobFailed(payload)
+                if status != "ok":
+                    self._stats["failures"] += 1
+                    raise ExtractionError(payload)
+                return payload
+            if not w.alive():
+                break
+            if time.monotonic() > deadline:
+                self._stats["timeouts"] += 1
+                raise ExtractionTimeout(f"extraction of {filename!r} exceeded {self.timeout:.0f}s")
+            if self.max_rss and _rss_bytes(w.proc.pid) > self.max_rss:
+                self._stats["rss_kills"] += 1
+                raise ExtractionError(f"extraction of {filename!r} exceeded {self.max_rss // (1024 * 1024)}MB RSS")
+        self._stats["crashes"] += 1
+        raise ExtractionError(f"extraction worker exited (code {w.proc.exitcode}) on {filename!r}")
+
+    def extract(self, data: bytes, filename: str, mime: Optional[str]) -> str:
+        if not self._slots.acquire(timeout=self.timeout):
+            raise ExtractionTimeout("no extraction worker became free in time")
+        self._stats["busy"] += 1
+        try:
+            w = self._checkout()
+            try:
+                text = self._run(w, data, filename, mime)
+            except _JobFailed:
+                # a corrupt or unsupported file: the worker answered, keep it
+                self._checkin(w)
+                raise
+            except BaseException:
+                # a worker that timed out, grew too big, ran out of memory or died is never reused
+                w.stop(graceful=False)
+                raise
+            self._stats["jobs"] += 1
+            self._checkin(w)
+            return text
+        finally:
+            self._stats["busy"] -= 1
+            self._slots.release()
+
+
+pool = ExtractPool(
+    settings.EXTRACT_WORKERS, settings.EXTRACT_TIMEOUT_SECONDS,
+    settings.EXTRACT_MAX_RSS_MB, settings.EXTRACT_MAX_JOBS_PER_WORKER,
+)
+metrics.register("extract_pool", pool.stats)
+
+
+def extract_text(data: bytes, filename: str, mime: Optional[str]) -> str:
+    """Isolated extraction (inline when EXTRACT_WORKERS is 0). Raises ExtractionError."""
+    if settings.EXTRACT_WORKERS <= 0:
+        from app.services.text_extract import extract_text_from_bytes
+        return extract_text_from_bytes(data, filename, mime)
+    return pool.extract(data, filename, mime)
@@ -0,0 +1,113 @@
+# app/services/extractive.py
+"""
+Extractive answers: pick the best sentence (or the value of a "Label: value"
+field) out of the retrieved chunks instead of generating one.
+
+Candidates are the lines/sentences of the top chunks. Each is scored by
+query-term coverage (same tokenizer as the keyword gates) blended with the
+cosine between its embedding and the question's; only the lexically best
+EXTRACTIVE_MAX_SENTENCES are embedded. The blended score is the confidence
+that /ask's `auto` mode compares against EXTRACTIVE_MIN_CONFIDENCE.
+"""
+from __future__ import annotations
+from typing import List, Dict, Any, Optional
+import re
+import threading
+import time
+
+import numpy as np
+
+from app.core import metrics
+from app.core.config import settings
+from app.services.embeddings import embed_query, embed_texts
+from app.services.terms import STOPWORDS, tokenize
+
+_sentence_split = re.compile(r"(?<=[.!?])\s+(?=[A-Z0-9\"'(])")
+_field = re.compile(r"^\s*([^:=\n]{1,60}?)\s*[:=]\s*(\S.*)$")
+_MAX_UNIT_CHARS = 400
+
+_stats = {"calls": 0, "candidates": 0, "spans": 0, "sentences": 0, "ms_total": 0.0}
+_stats_lock = threading.Lock()
+
+
+def _metrics() -> Dict[str, Any]:
+    with _stats_lock:
+        out = dict(_stats)
+    out["ms_total"] = round(out["ms_total"], 1)
+    return out
+
+
+metrics.register("extractive", _metrics)
+
+
+def query_terms(q: str) -> set:
+    terms = {t for t in tokenize(q) if t not in STOPWORDS}
+    return terms or set(tokenize(q))
+
+
+def _coverage(q_terms: set, text: str) -> float:
+    if not q_terms:
+        return 0.0
+    return len(q_terms & set(tokenize(text))) / len(q_terms)
+
+
+def _units(rows: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Lines, then sentences within lines, of every chunk (first occurrence wins)."""
+    out, seen = [], set()
+    for rank, r in enumerate(rows):
+        for line in (r.get("content") or "").splitlines():
+            for s in _sentence_split.split(line.strip()):
+                s = s.strip()
+                key = s.lower()
+                if len(s) < 3 or key in seen:
+                    continue
+                seen.add(key)
+                out.append({"text": s[:_MAX_UNIT_CHARS], "row": r, "rank": rank})
+    return out
+
+
+def extract_answer(q: str, rows: List[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+    """
+    Best span for `q` in `rows` (ranked chunks, best first) as
+    {"answer", "confidence", "kind": "span"|"sentence", "row"}; None if nothing matches.
+    """
+    t0 = time.perf_counter()
+    q_terms = query_terms(q)
+    units = _units(rows)
+    for u in units:
+        m = _field.match(u["text"])
+        label_cov = _coverage(q_terms, m.group(1)) if m else 0.0
+        # a field whose label names the question answers with just its value
+        if m and label_cov >= 0.5:
+            u["span"] = m.group(2).strip()
+            u["lex"] = label_cov
+        else:
+            u["lex"] = _coverage(q_terms, u["text"])
+    # earlier (better-ranked) chunks win ties
+    units = [u for u in units if u["lex"] > 0]
+    units.sort(key=lambda u: (-u["lex"], u["rank"]))
+    units = units[: settings.EXTRACTIVE_MAX_SENTENCES]
+
+    best = None
+    if units:
+        q_emb = np.asarray(embed_query(q), dtype=np.float32)
+        E = np.asarray(embed_texts([u["text"] for u in units]), dtype=np.float32)
+        sims = np.clip(E @ q_emb, 0.0, 1.0)
+        w = settings.EXTRACTIVE_LEXICAL_WEIGHT
+        scores = w * np.asarray([u["lex"] for u in units]) + (1.0 - w) * sims
+        i = int(np.argmax(scores))
+        u = units[i]
+        best = {
+            "answer": u.get("span") or u["text"],
+            "confidence": float(scores[i]),
+            "kind": "span" if "span" in u else "sentence",
+            "row": u["row"],
+        }
+
+    with _stats_lock:
+        _stats["calls"] += 1
+        _stats["candidates"] += len(units)
+        if best:
+            _stats["spans" if best["kind"] == "span" else "sentences"] += 1
+        _stats["ms_total"] += (time.perf_counter() - t0) * 1000
+    return best
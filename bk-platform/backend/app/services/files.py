@@ -1,29 +1,371 @@
+from __future__ import annotations
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone
 from pathlib import Path
-from typing import Tuple
+from typing import BinaryIO, Dict, Iterator, List, Optional, Tuple, Type
+import fcntl
+import gzip
+import hashlib
+import json
+import os
+import tempfile
+import urllib.parse
+
 from fastapi import UploadFile, HTTPException
 
-UPLOAD_DIR = Path("uploads")
-UPLOAD_DIR.mkdir(parents=True, exist_ok=True)
+from app.core.config import settings
 
 MAX_BYTES = 100 * 1024 * 1024  # 100MB
 
+# Document.path holds "blob:<key>"; anything else is a legacy CWD-relative path.
+BLOB_REF_PREFIX = "blob:"
+
+TEXT_LIKE_MIMES = {"application/json", "application/xml", "application/x-ndjson"}
+TEXT_LIKE_EXTS = (".txt", ".md", ".csv", ".json", ".log", ".xml", ".ndjson", ".tsv")
+
+
+# ---------- backends ----------
+class BlobBackend(ABC):
+    """Whole-object byte store addressed by relative '/'-separated keys."""
+
+    @abstractmethod
+    def put(self, key: str, data: bytes) -> None: ...
+
+    @abstractmethod
+    def open(self, key: str) -> BinaryIO: ...
+
+    @abstractmethod
+    def exists(self, key: str) -> bool: ...
+
+    @abstractmethod
+    def delete(self, key: str) -> None: ...
+
+    def get(self, key: str) -> bytes:
+        with self.open(key) as f:
+            return f.read()
+
+    def put_file(self, key: str, src: Path) -> None:
+        """Move an already-written (fsynced) local file into the store under `key`."""
+        try:
+            self.put(key, Path(src).read_bytes())
+        finally:
+            Path(src).unlink(missing_ok=True)
+
+
+def _atomic_write(dest: Path, data: bytes) -> None:
+    """Write to a temp file next to `dest`, fsync, then rename over it."""
+    dest.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=dest.parent, prefix=".tmp-")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, dest)
+    except BaseException:
+        try:
+            os.unlink(tmp)
+        except FileNotFoundError:
+            pass
+        raise
+
+
+class LocalFSBackend(BlobBackend):
+    """Keys map to files under `root`; shard prefixes in the key become subdirectories."""
+
+    def __init__(self, root: Path):
+        self.root = Path(root).resolve()
+        self.root.mkdir(parents=True, exist_ok=True)
+
+    def _path(self, key: str) -> Path:
+        p = (self.root / key).resolve()
+        if self.root not in p.parents:
+            raise ValueError(f"invalid blob key: {key!r}")
+        return p
+
+    def put(self, key: str, data: bytes) -> None:
+        _atomic_write(self._path(key), data)
+
+    def put_file(self, key: str, src: Path) -> None:
+        dest = self._path(key)
+        dest.parent.mkdir(parents=True, exist_ok=True)
+        os.replace(src, dest)
+
+    def open(self, key: str) -> BinaryIO:
+        return open(self._path(key), "rb")
+
+    def exists(self, key: str) -> bool:
+        return self._path(key).is_file()
+
+    def delete(self, key: str) -> None:
+        try:
+            self._path(key).unlink()
+        except FileNotFoundError:
+            pass
+
+
+class LocalObjectStoreBackend(BlobBackend):
+    """
+    Object-store stand-in (S3-like semantics) on local disk, for tests and dev:
+    flat bucket namespace (keys are URL-quoted into single file names), no
+    directory listing assumptions, and a JSON sidecar with size/etag per object.
+    """
+
+    def __init__(self, root: Path, bucket: str = "bk-blobs"):
+        self.bucket_dir = Path(root).resolve() / bucket
+        self.bucket_dir.mkdir(parents=True, exist_ok=True)
+
+    def _obj(self, key: str) -> Path:
+        return self.bucket_dir / urllib.parse.quote(key, safe="")
+
+    def put(self, key: str, data: bytes) -> None:
+        obj = self._obj(key)
+        _atomic_write(obj, data)
+        self._write_meta(obj, key, len(data), hashlib.md5(data).hexdigest())
+
+    def put_file(self, key: str, src: Path) -> None:
+        etag, size = hashlib.md5(), 0
+        with open(src, "rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                etag.update(block)
+                size += len(block)
+        obj = self._obj(key)
+        os.replace(src, obj)
+        self._write_meta(obj, key, size, etag.hexdigest())
+
+    def _write_meta(self, obj: Path, key: str, size: int, etag: str) -> None:
+        meta = {"key": key, "size": size, "etag": etag}
+        _atomic_write(obj.with_name(obj.name + ".meta.json"), json.dumps(meta).encode())
+
+    def open(self, key: str) -> BinaryIO:
+        return open(self._obj(key), "rb")
+
+    def exists(self, key: str) -> bool:
+        return self._obj(key).is_file()
+
+    def delete(self, key: str) -> None:
+        obj = self._obj(key)
+        for p in (obj, obj.with_name(obj.name + ".meta.json")):
+            try:
+                p.unlink()
+            except FileNotFoundError:
+                pass
+
+
+BACKENDS: Dict[str, Type[BlobBackend]] = {
+    "local": LocalFSBackend,
+    "object-local": LocalObjectStoreBackend,
+}
+
+_store: Optional[BlobBackend] = None
+
+
+def get_blob_store() -> BlobBackend:
+    global _store
+    if _store is None:
+        backend = BACKENDS.get(settings.BLOB_BACKEND)
+        if backend is None:
+            raise RuntimeError(f"Unknown BLOB_BACKEND {settings.BLOB_BACKEND!r}")
+        _store = backend(Path(settings.BLOB_ROOT))
+    return _store
+
+
+# ---------- content addressing ----------
+def _is_text_like(filename: str, mime: str) -> bool:
+    m = (mime or "").lower()
+    return m.startswith("text/") or m in TEXT_LIKE_MIMES or (filename or "").lower().endswith(TEXT_LIKE_EXTS)
+
+
+def content_key(digest: str, compressed: bool) -> str:
+    # sha256/ab/cd/abcd…: two shard levels keep every directory small
+    return f"sha256/{digest[:2]}/{digest[2:4]}/{digest}" + (".gz" if compressed else "")
+
+
+# ---------- deferred deletion ----------
+# Blobs are shared by content hash. An upload of the same bytes can be handed
+# an existing blob's ref before its Document is committed, so a delete that
+# saw no other reference could still remove a blob about to be used. Deleting
+# a document therefore only queues its blob (BlobDeletion). sweep_blobs removes
+# the blob once the row is older than BLOB_GC_GRACE_SECONDS and nothing
+# references it. An upload of the same content cancels the row. Lookups and
+# sweeps take one file lock, shared by every worker on the node.
+@contextmanager
+def _blob_lock() -> Iterator[None]:
+    root = Path(settings.BLOB_ROOT)
+    root.mkdir(parents=True, exist_ok=True)
+    with open(root / ".gc.lock", "a+b") as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def _existing_ref(store: BlobBackend, digest: str) -> Optional[str]:
+    """Ref of a stored copy of this content (None: caller stores it); cancels any queued deletion."""
+    from app.db import SessionLocal
+    from app.models.document import BlobDeletion
+
+    refs = [BLOB_REF_PREFIX + content_key(digest, compressed) for compressed in (False, True)]
+    with _blob_lock():
+        with SessionLocal() as db:
+            if db.query(BlobDeletion.id).filter(BlobDeletion.ref.in_(refs)).first():
+                db.query(BlobDeletion).filter(BlobDeletion.ref.in_(refs)).delete(synchronize_session=False)
+                db.commit()
+        for ref in refs:
+            if store.exists(ref[len(BLOB_REF_PREFIX):]):
+                return ref
+    return None
+
+
+def queue_blob_delete(db, ref: str) -> None:
+    """Queue a blob whose document is being deleted (in the caller's transaction)."""
+    from app.models.document import BlobDeletion
+
+    if ref.startswith(BLOB_REF_PREFIX):
+        db.add(BlobDeletion(ref=ref, queued_at=datetime.now(tz=timezone.utc)))
+
+
+def sweep_blobs(grace_seconds: Optional[int] = None) -> int:
+    """
+    Delete queued blobs past the grace period that no document references,
+    with their extracted-text artifacts; returns how many.
+    """
+    from app.db import SessionLocal
+    from app.models.document import BlobDeletion, Document
+    from app.services.text_cache import delete_cached_text  # imports this module
+
+    grace = settings.BLOB_GC_GRACE_SECONDS if grace_seconds is None else grace_seconds
+    cutoff = datetime.now(tz=timezone.utc) - timedelta(seconds=grace)
+    deleted = 0
+    with SessionLocal() as db:
+        due: List[str] = sorted({
+            ref for (ref,) in db.query(BlobDeletion.ref).filter(BlobDeletion.queued_at <= cutoff)
+        })
+        db.rollback()
+        for ref in due:
+            with _blob_lock():
+                # fresh reads under the lock: an upload may have cancelled the row meanwhile
+                still_queued = db.query(BlobDeletion.id).filter(BlobDeletion.ref == ref).first()
+                referenced = db.query(Document.id).filter(Document.path == ref).first()
+                if still_queued and not referenced:
+                    delete_blob(ref)
+                    # nothing else references the text cache: it goes with its blob
+                    delete_cached_text(blob_digest(ref))
+                    deleted += 1
+                db.query(BlobDeletion).filter(BlobDeletion.ref == ref).delete(synchronize_session=False)
+                db.commit()
+    return deleted
+
+
+def put_blob(data: bytes, filename: str = "", mime: str = "") -> str:
+    """Store bytes under their content hash (deduplicated); returns the blob ref for Document.path."""
+    store = get_blob_store()
+    digest = hashlib.sha256(data).hexdigest()
+    ref = _existing_ref(store, digest)
+    if ref:
+        return ref
+    compress = settings.BLOB_COMPRESS_TEXT and _is_text_like(filename, mime)
+    key = content_key(digest, compress)
+    store.put(key, gzip.compress(data, compresslevel=6, mtime=0) if compress else data)
+    return BLOB_REF_PREFIX + key
+
+
+def put_blob_stream(f: BinaryIO, filename: str = "", mime: str = "", max_bytes: int = MAX_BYTES) -> Tuple[str, int]:
+    """
+    put_blob for a stream: spooled block by block to a temp file (hashing and,
+    for text-like files, gzip'ing on the way) and then moved into the store.
+    Returns (blob ref, original size); memory stays at one block.
+    """
+    compress = settings.BLOB_COMPRESS_TEXT and _is_text_like(filename, mime)
+    spool = Path(settings.BLOB_ROOT) / ".spool"  # same filesystem as the store: the final move is a rename
+    spool.mkdir(parents=True, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=spool, prefix="up-")
+    digest, size = hashlib.sha256(), 0
+    try:
+        with os.fdopen(fd, "wb") as raw:
+            out = gzip.GzipFile(fileobj=raw, mode="wb", compresslevel=6, mtime=0) if compress else raw
+            for block in iter(lambda: f.read(settings.STREAM_BLOCK_BYTES), b""):
+                size += len(block)
+                if size > max_bytes:
+                    raise HTTPException(status_code=413, detail=f"File too large (limit {max_bytes // (1024 * 1024)}MB)")
+                digest.update(block)
+                out.write(block)
+            if compress:
+                out.close()
+            raw.flush()
+            os.fsync(raw.fileno())
+        store = get_blob_store()
+        hexdigest = digest.hexdigest()
+        ref = _existing_ref(store, hexdigest)
+        if ref:
+            os.unlink(tmp)
+            return ref, size
+        key = content_key(hexdigest, compress)
+        store.put_file(key, Path(tmp))
+        return BLOB_REF_PREFIX + key, size
+    except BaseException:
+        Path(tmp).unlink(missing_ok=True)
+        raise
+
+
+def blob_digest(ref: str) -> Optional[str]:
+    """sha256 of the original bytes for a blob ref, None for legacy paths."""
+    if not ref.startswith(BLOB_REF_PREFIX):
+        return None
+    return ref.rsplit("/", 1)[-1].split(".", 1)[0]
+
+
+class _GzipBlob(gzip.GzipFile):
+    # GzipFile leaves a caller-supplied fileobj open; blobs own theirs
+    def __init__(self, raw: BinaryIO):
+        super().__init__(fileobj=raw, mode="rb")
+        self._raw = raw
+
+    def close(self) -> None:
+        try:
+            super().close()
+        finally:
+            self._raw.close()
+
+
+def open_blob(ref: str) -> BinaryIO:
+    """Readable stream of the original bytes (decompressed) for a blob ref or legacy path."""
+    if not ref.startswith(BLOB_REF_PREFIX):
+        return open(ref, "rb")
+    key = ref[len(BLOB_REF_PREFIX):]
+    f = get_blob_store().open(key)
+    return _GzipBlob(f) if key.endswith(".gz") else f
+
+
+def read_blob(ref: str) -> bytes:
+    with open_blob(ref) as f:
+        return f.read()
+
+
+def delete_blob(ref: str) -> None:
+    if ref.startswith(BLOB_REF_PREFIX):
+        get_blob_store().delete(ref[len(BLOB_REF_PREFIX):])
+
+
+# ---------- uploads ----------
 def _read_all(file: UploadFile) -> bytes:
     data = file.file.read()
     if len(data) > MAX_BYTES:
         raise HTTPException(status_code=413, detail="File too large (limit 100MB)")
     return data
 
+
 def save_upload_file(file: UploadFile) -> Tuple[str, int, str, bytes]:
     data = _read_all(file)
-    safe_name = file.filename.replace("/", "_")
+    mime = file.content_type or "application/octet-stream"
+    ref = put_blob(data, file.filename or "", mime)
+    return ref, len(data), mime, data
 
-    dest = UPLOAD_DIR / safe_name
-    i = 1
-    while dest.exists():
-        dest = UPLOAD_DIR / f"{dest.stem}_{i}{dest.suffix}"
-        i += 1
 
-    dest.write_bytes(data)
-    size = len(data)
+def save_upload_stream(file: UploadFile) -> Tuple[str, int, str]:
+    """Streaming variant for large text formats (limit STREAM_MAX_MB); the bytes are not kept in memory."""
     mime = file.content_type or "application/octet-stream"
-    return str(dest), size, mime, data
+    ref, size = put_blob_stream(file.file, file.filename or "", mime, settings.STREAM_MAX_MB * 1024 * 1024)
+    return ref, size, mime
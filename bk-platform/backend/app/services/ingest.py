@@ -1,29 +1,103 @@
-from app.services.chunking import simple_chunks
-from app.services.embeddings import embed_texts
-from app.vector.chroma_client import get_collection
+from datetime import datetime, timezone
+from itertools import islice
+from typing import Iterable
+import logging
+
+from sqlalchemy import insert, update
 from sqlalchemy.orm import Session
+
+from app.core.config import settings
 from app.models.chunk import DocumentChunk
+from app.models.outbox import VectorOutbox
+from app.services.chunking import simple_chunks
+from app.services.dedup import fingerprint_window, release_document
+from app.services.outbox import drain_document
+
+log = logging.getLogger(__name__)
+
+def ingest_chunks_for_document(
+    db: Session, *, chunks: Iterable[str], document_id: int, user_id: int, filename: str
+) -> int:
+    """
+    Persist chunks and queue them for the vector store.
+    Embedding + Chroma upsert happen from the outbox (inline right after the
+    commit when OUTBOX_INLINE_DRAIN, else by the background worker), so a
+    failed embed is retried instead of leaving chunks without vectors.
+
+    `chunks` may be a generator: rows are inserted and committed INGEST_WINDOW
+    at a time (a big file doesn't hold the SQLite write lock for the whole
+    ingest) and the outbox drain pages through them, so memory doesn't grow
+    with the file. The outbox row goes in with the first window as
+    "ingesting", which the drain leaves alone, and turns "pending" once every
+    window is in; each window's commit also refreshes its claimed_at. If the
+    process dies mid-ingest, the drain picks the row up once claimed_at is
+    OUTBOX_CLAIM_TIMEOUT_SECONDS old, so the committed chunks still reach the
+    vector store. If ingest fails with an exception, the windows already
+    committed are removed again.
+
+    With DEDUP_ENABLED each chunk is also fingerprinted; exact term-set copies of the
+    user's existing chunks are linked to them and never embedded (see dedup).
+    """
+    it = iter(chunks)
+    total = 0
+    entry_id = None
+    try:
+        while True:
+            window = list(islice(it, settings.INGEST_WINDOW))
+            if not window:
+                break
+            # Core executemany: no ORM identity-map/unit-of-work overhead per chunk
+            db.execute(
+                insert(DocumentChunk.__table__),
+                [{"document_id": document_id, "content": ch, "position": total + i} for i, ch in enumerate(window)],
+            )
+            if settings.DEDUP_ENABLED:
+                fingerprint_window(db, chunks=window, document_id=document_id, user_id=user_id, start=total)
+            if entry_id is None:
+                # same transaction as the first chunks: no committed chunk is ever without its outbox row
+                entry = VectorOutbox(document_id=document_id, user_id=user_id, filename=filename,
+                                     status="ingesting", claimed_at=datetime.now(tz=timezone.utc))
+                db.add(entry)
+                db.flush()
+                entry_id = entry.id
+            else:
+                db.execute(update(VectorOutbox).where(VectorOutbox.id == entry_id).values(claimed_at=datetime.now(tz=timezone.utc)))
+            db.commit()
+            total += len(window)
+        if entry_id is None:
+            return 0
+        db.execute(update(VectorOutbox).where(VectorOutbox.id == entry_id)
+                   .values(status="pending", claimed_at=None))
+        db.commit()
+    except BaseException:
+        db.rollback()
+        if total:
+            _discard_partial(db, document_id)
+        raise
+
+    if settings.OUTBOX_INLINE_DRAIN:
+        drain_document(document_id)
+    return total
+
+
+def _discard_partial(db: Session, document_id: int) -> None:
+    try:
+        promoted = release_document(db, document_id)  # others may have linked to these chunks meanwhile
+        db.query(VectorOutbox).filter(VectorOutbox.document_id == document_id).delete()
+        db.query(DocumentChunk).filter(DocumentChunk.document_id == document_id).delete()
+        db.commit()
+    except Exception:
+        db.rollback()
+        log.exception("could not remove partially ingested chunks of document %s", document_id)
+        return
+    if settings.OUTBOX_INLINE_DRAIN:
+        for doc_id in promoted:
+            drain_document(doc_id)
+
 
 def ingest_text_for_document(
     db: Session, *, text: str, document_id: int, user_id: int, filename: str
 ) -> int:
-    chunks = simple_chunks(text)
-    if not chunks:
-        return 0
-
-    # Save chunks to DB
-    db_chunks = [DocumentChunk(document_id=document_id, content=ch, position=i)
-                 for i, ch in enumerate(chunks)]
-    db.add_all(db_chunks)
-    db.commit()
-
-    # Embed + upsert into Chroma, scoped by user_id
-    embeddings = embed_texts(chunks)
-    col = get_collection()
-    ids = [f"doc{document_id}_chunk{i}" for i in range(len(chunks))]
-    metadatas = [
-        {"document_id": document_id, "chunk_index": i, "user_id": user_id, "filename": filename}
-        for i in range(len(chunks))
-    ]
-    col.upsert(ids=ids, documents=chunks, embeddings=embeddings, metadatas=metadatas)
-    return len(chunks)
+    return ingest_chunks_for_document(
+        db, chunks=simple_chunks(text), document_id=document_id, user_id=user_id, filename=filename,
+    )
@@ -1,16 +1,28 @@
 # app/services/llm.py
 from __future__ import annotations
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FuturesTimeout, as_completed
+from pathlib import Path
 from typing import List, Dict, Optional
+import logging
 import os
+import threading
+import time
 import httpx
+from app.core import metrics
 from app.core.config import settings
+from app.services.llm_replay import Cassette, prompt_key
+from app.services.llm_stub import stub_url
+
+log = logging.getLogger(__name__)
 
 OPENAI_BASE = os.getenv("OPENAI_BASE", "https://api.openai.com/v1")
 HF_API_BASE = os.getenv("HF_API_BASE", "https://api-inference.huggingface.co/models")
 
 # ---------------- OpenAI ----------------
-def _openai_chat(messages: List[Dict[str, str]], model: Optional[str] = None) -> str:
-    api_key = settings.OPENAI_API_KEY
+def _openai_chat(messages: List[Dict[str, str]], model: Optional[str] = None, timeout: Optional[float] = None,
+                 base: Optional[str] = None, api_key: Optional[str] = None, max_tokens: Optional[int] = None) -> str:
+    api_key = api_key or settings.OPENAI_API_KEY
     if not api_key:
         raise RuntimeError("OPENAI_API_KEY not configured")
     payload = {
@@ -18,43 +30,139 @@ def _openai_chat(messages: List[Dict[str, str]], model: Optional[str] = None) ->
         "messages": messages,
         "temperature": 0.2,
     }
+    if max_tokens:
+        payload["max_tokens"] = max_tokens
     headers = {"Authorization": f"Bearer {api_key}"}
-    with httpx.Client(timeout=60) as client:
-        r = client.post(f"{OPENAI_BASE}/chat/completions", json=payload, headers=headers)
+    with httpx.Client(timeout=min(timeout or 60, 60)) as client:
+        r = client.post(f"{base or OPENAI_BASE}/chat/completions", json=payload, headers=headers)
         r.raise_for_status()
         data = r.json()
     return data["choices"][0]["message"]["content"]
 
 # ---------------- Ollama (local) ----------------
-def _ollama_chat(messages: List[Dict[str, str]], model: Optional[str] = None) -> str:
-    base = settings.OLLAMA_HOST or "http://localhost:11434"
+# num_ctx is bucketed: Ollama reloads the model whenever num_ctx changes, so
+# requests alternating between two buckets would reload it on every switch.
+# The bucket a model is loaded with is therefore sticky: a request that fits
+# reuses it, and only a longer prompt moves the model up to a bigger bucket
+# (one reload). Short prompts then pay for the larger KV cache, not a reload.
+OLLAMA_CTX_BUCKETS = (2048, 4096, 8192, 16384, 32768)
+OLLAMA_CHARS_PER_TOKEN = 3.5  # conservative for English; overshooting only costs KV cache
+_ollama_ctx: Dict[str, int] = {}  # model -> num_ctx it was last loaded with
+
+_ollama_stats = {"requests": 0, "cold_loads": 0, "load_ms_total": 0.0, "load_ms_max": 0.0,
+                 "prompt_eval_ms_total": 0.0, "eval_ms_total": 0.0, "eval_tokens": 0,
+                 "num_ctx": {}, "warmup": None}
+
+def _ollama_metrics() -> dict:
+    st = _ollama_stats
+    return {**st, "num_ctx": dict(st["num_ctx"]),
+            "tokens_per_s": round(st["eval_tokens"] / (st["eval_ms_total"] / 1000), 1) if st["eval_ms_total"] else None}
+
+metrics.register("ollama", _ollama_metrics)
+
+def answer_tokens(max_chars: int) -> int:
+    """num_predict / max_tokens for an answer trimmed to `max_chars` (a little slack for the cut)."""
+    return int(max_chars / OLLAMA_CHARS_PER_TOKEN * 1.5) + 16
+
+def ollama_num_ctx(messages: List[Dict[str, str]], num_predict: int, prompt_tokens: Optional[int] = None) -> int:
+    """
+    Smallest bucket that fits the prompt plus the answer, capped at OLLAMA_NUM_CTX_MAX.
+    `prompt_tokens` is the caller's count of the packed messages (the same
+    TokenCounter that budgeted the context); without it, chars are estimated.
+    """
+    if prompt_tokens is None:
+        prompt_tokens = int(sum(len(m.get("content") or "") for m in messages) / OLLAMA_CHARS_PER_TOKEN)
+    need = prompt_tokens + 16 * len(messages) + num_predict  # + chat template overhead per message
+    fits = [b for b in OLLAMA_CTX_BUCKETS if need <= b <= settings.OLLAMA_NUM_CTX_MAX]
+    return fits[0] if fits else settings.OLLAMA_NUM_CTX_MAX
+
+def _record_ollama_timings(data: dict, model: str) -> None:
+    """Ollama reports durations in ns; a load_duration over OLLAMA_COLD_LOAD_MS is a cold start."""
+    load_ms = (data.get("load_duration") or 0) / 1e6
+    st = _ollama_stats
+    st["requests"] += 1
+    st["load_ms_total"] += load_ms
+    st["load_ms_max"] = max(st["load_ms_max"], load_ms)
+    st["prompt_eval_ms_total"] += (data.get("prompt_eval_duration") or 0) / 1e6
+    st["eval_ms_total"] += (data.get("eval_duration") or 0) / 1e6
+    st["eval_tokens"] += data.get("eval_count") or 0
+    if load_ms >= settings.OLLAMA_COLD_LOAD_MS:
+        st["cold_loads"] += 1
+        log.warning("ollama cold start: %s took %.0f ms to load (generation %.0f ms)",
+                    model, load_ms, (data.get("eval_duration") or 0) / 1e6)
+
+def _ollama_chat(messages: List[Dict[str, str]], model: Optional[str] = None, timeout: Optional[float] = None,
+                 base: Optional[str] = None, max_tokens: Optional[int] = None,
+                 prompt_tokens: Optional[int] = None) -> str:
+    base = base or settings.OLLAMA_HOST or "http://localhost:11434"
     mdl = model or settings.OLLAMA_MODEL or "tinyllama:latest"
 
+    num_predict = max_tokens or settings.OLLAMA_NUM_PREDICT
+    # keep the loaded bucket when the prompt fits it (see above)
+    num_ctx = min(max(ollama_num_ctx(messages, num_predict, prompt_tokens), _ollama_ctx.get(mdl, 0)),
+                  settings.OLLAMA_NUM_CTX_MAX)
+    _ollama_ctx[mdl] = num_ctx
+    _ollama_stats["num_ctx"][num_ctx] = _ollama_stats["num_ctx"].get(num_ctx, 0) + 1
     payload = {
         "model": mdl,
         "messages": messages,
         "stream": False,
-        "options": {"temperature": 0.2},
+        "keep_alive": settings.OLLAMA_KEEP_ALIVE,  # hold the model between bursts
+        "options": {"temperature": 0.2, "num_ctx": num_ctx, "num_predict": num_predict},
     }
 
-    # generous timeouts; pulling a big model can take minutes
-    timeout = httpx.Timeout(connect=5.0, read=600.0, write=120.0, pool=5.0)
+    # generous timeouts (pulling a big model can take minutes), capped by the
+    # router's deadline; retries back off and stop once the deadline is spent
+    deadline = time.monotonic() + (timeout or 600.0)
 
     # small retry loop for transient timeouts
     for attempt in range(3):
+        left = deadline - time.monotonic()
+        if left <= 0:
+            raise httpx.ReadTimeout("Ollama request deadline exceeded")
+        t = httpx.Timeout(connect=min(5.0, left), read=min(600.0, left), write=min(120.0, left), pool=min(5.0, left))
         try:
-            with httpx.Client(timeout=timeout) as client:
+            with httpx.Client(timeout=t) as client:
                 r = client.post(f"{base}/api/chat", json=payload)
                 r.raise_for_status()
                 data = r.json()
+                _record_ollama_timings(data, mdl)
                 return data["message"]["content"]
         except httpx.ReadTimeout:
-            if attempt == 2:
+            backoff = 0.5 * 2 ** attempt
+            if attempt == 2 or deadline - time.monotonic() <= backoff:
                 raise
+            time.sleep(backoff)
         except httpx.HTTPStatusError as e:
             # surface useful info
             raise RuntimeError(f"Ollama error {e.response.status_code}: {e.response.text[:300]}") from e
 
+def warm_ollama(model: Optional[str] = None, base: Optional[str] = None) -> Optional[float]:
+    """
+    Load the model before traffic arrives (an empty generate only loads it), at
+    the smallest num_ctx bucket and with keep_alive. Returns load ms, None on failure.
+    """
+    base = base or settings.OLLAMA_HOST or "http://localhost:11434"
+    mdl = model or settings.OLLAMA_MODEL or "tinyllama:latest"
+    payload = {"model": mdl, "prompt": "", "stream": False, "keep_alive": settings.OLLAMA_KEEP_ALIVE,
+               "options": {"num_ctx": OLLAMA_CTX_BUCKETS[0]}}
+    t0 = time.monotonic()
+    try:
+        with httpx.Client(timeout=httpx.Timeout(connect=5.0, read=600.0, write=30.0, pool=5.0)) as client:
+            r = client.post(f"{base}/api/generate", json=payload)
+            r.raise_for_status()
+            data = r.json()
+    except Exception as e:
+        _ollama_stats["warmup"] = {"model": mdl, "ok": False, "error": str(e)[:200]}
+        log.warning("ollama warm-up of %s failed: %s", mdl, e)
+        return None
+    load_ms = (data.get("load_duration") or 0) / 1e6
+    _ollama_ctx[mdl] = OLLAMA_CTX_BUCKETS[0]
+    _ollama_stats["warmup"] = {"model": mdl, "ok": True, "load_ms": round(load_ms, 1),
+                               "wall_ms": round((time.monotonic() - t0) * 1000, 1)}
+    log.info("ollama warm-up: %s loaded in %.0f ms (keep_alive=%s)", mdl, load_ms, settings.OLLAMA_KEEP_ALIVE)
+    return load_ms
+
 # app/services/llm.py — HF section only
 from app.core.config import settings
 import httpx
@@ -163,7 +271,8 @@ def _hf_chat(messages, model: str | None = None) -> str:
             return (data["choices"][0].get("text") or "").strip()
     return ""
 
-def _hf_chat(messages, model: str | None = None) -> str:
+def _hf_chat(messages, model: str | None = None, timeout: float | None = None,
+             max_tokens: int | None = None) -> str:
     token = settings.HF_TOKEN
     if not token:
         raise RuntimeError("HF_TOKEN not configured")
@@ -187,11 +296,11 @@ def _hf_chat(messages, model: str | None = None) -> str:
 
     payload = {
         "inputs": to_prompt(messages),
-        "parameters": {"temperature": 0.2, "max_new_tokens": 256, "return_full_text": False}
+        "parameters": {"temperature": 0.2, "max_new_tokens": max_tokens or 256, "return_full_text": False}
     }
 
     try:
-        with httpx.Client(timeout=120) as client:
+        with httpx.Client(timeout=min(timeout or 120, 120)) as client:
             r = client.post(url, json=payload, headers=headers)
             r.raise_for_status()
             data = r.json()
@@ -211,10 +320,305 @@ def _hf_chat(messages, model: str | None = None) -> str:
             return (data["choices"][0].get("text") or "").strip()
     return ""
 # ---------------- Public API ----------------
+def resolve_provider(provider: Optional[str] = None, model: Optional[str] = None) -> str:
+    """The backend `chat` will actually call: 'openai', 'hf', 'ollama', 'stub' or 'replay'."""
+    p = (provider or "").lower()
+    if p in ("openai", "hf", "stub", "replay"):
+        return p
+    if p in ("ollama", "tinyllm"):
+        return "ollama"
+    # auto-detect order: OpenAI -> HF -> Ollama
+    if settings.OPENAI_API_KEY:
+        return "openai"
+    if os.getenv("HF_TOKEN") and (model or os.getenv("HF_MODEL_ID")):
+        return "hf"
+    return "ollama"
+
+# ---------------- Provider router ----------------
+# Every chat() goes through the router: a bounded semaphore per backend (a burst
+# queues instead of overrunning a rate-limited API or a single local Ollama), a
+# circuit breaker per backend, a per-request deadline that becomes the httpx
+# timeouts, and an optional fallback provider (failover when the primary is
+# open/failing, hedged request once the primary runs past its p95 latency).
+class LLMError(RuntimeError):
+    pass
+
+class ProviderUnavailable(LLMError):
+    """Circuit open (and no usable fallback)."""
+
+class DeadlineExceeded(LLMError):
+    pass
+
+class ReplayMiss(LLMError):
+    """The replay cassette has no response for this prompt (and recording is off)."""
+
+class _Ticket:
+    """Admission from _Breaker.allow(); `probe` is set for the one half-open trial request."""
+    __slots__ = ("probe",)
+
+    def __init__(self, probe: bool = False):
+        self.probe = probe
+
+class _Breaker:
+    """Rolling-window breaker: opens on error rate or slow-call rate, half-opens after a cooldown."""
+
+    def __init__(self):
+        self.window: "deque[tuple[bool, float]]" = deque(maxlen=max(1, settings.LLM_BREAKER_WINDOW))
+        self.state = "closed"
+        self.opened_until = 0.0
+        self.probing = False
+        self.lock = threading.Lock()
+
+    def allow(self) -> Optional[_Ticket]:
+        """A ticket to pass back to record()/release_probe(), or None while the circuit is open."""
+        with self.lock:
+            if self.state == "closed":
+                return _Ticket()
+            if self.state == "open" and time.monotonic() >= self.opened_until:
+                self.state = "half_open"
+            if self.state == "half_open" and not self.probing:
+                self.probing = True  # exactly one trial request
+                return _Ticket(probe=True)
+            return None
+
+    def record(self, ok: bool, latency: float, ticket: _Ticket) -> None:
+        with self.lock:
+            if self.state == "half_open":
+                if not ticket.probe:
+                    return  # admitted before the circuit opened: only the probe decides
+                ticket.probe = self.probing = False
+                if ok and latency <= settings.LLM_BREAKER_SLOW_SECONDS:
+                    self.state = "closed"
+                    self.window.clear()
+                else:
+                    self._open()
+                return
+            self.window.append((ok, latency))
+            n = len(self.window)
+            if n < settings.LLM_BREAKER_MIN_REQUESTS:
+                return
+            errors = sum(1 for good, _ in self.window if not good)
+            slow = sum(1 for _, lat in self.window if lat > settings.LLM_BREAKER_SLOW_SECONDS)
+            if errors / n >= settings.LLM_BREAKER_ERROR_RATE or slow / n >= settings.LLM_BREAKER_SLOW_RATE:
+                self._open()
+
+    def _open(self) -> None:
+        self.state = "open"
+        self.opened_until = time.monotonic() + settings.LLM_BREAKER_COOLDOWN_SECONDS
+        self.window.clear()
+
+    def release_probe(self, ticket: _Ticket) -> None:
+        # a probe that ended without an outcome (no slot, cassette miss, client error)
+        # must not keep the half-open trial: let the next request probe instead.
+        # Any other call ending here leaves a probe in flight alone.
+        with self.lock:
+            if ticket.probe:
+                ticket.probe = self.probing = False
+
+    def p95(self) -> Optional[float]:
+        with self.lock:
+            lats = sorted(lat for ok, lat in self.window if ok)
+        if len(lats) < settings.LLM_HEDGE_MIN_SAMPLES:
+            return None
+        return lats[min(len(lats) - 1, int(0.95 * len(lats)))]
+
+def _client_error(e: BaseException) -> bool:
+    """HTTP 4xx (bar 408/429) from the provider: the request was bad, the provider is fine."""
+    for err in (e, e.__cause__):
+        if isinstance(err, httpx.HTTPStatusError):
+            code = err.response.status_code
+            return 400 <= code < 500 and code not in (408, 429)
+    return False
+
+class _Provider:
+    def __init__(self, name: str, concurrency: int, call):
+        self.name, self.call = name, call
+        self.slots = threading.BoundedSemaphore(max(1, concurrency))
+        self.breaker = _Breaker()
+        self.stats = {"requests": 0, "errors": 0, "timeouts": 0, "queue_timeouts": 0}
+
+# prompt_tokens (the caller's count of the packed prompt) only matters to Ollama's num_ctx
+def _call_openai(messages, model, timeout, max_tokens, prompt_tokens):
+    return _openai_chat(messages, model or settings.OPENAI_MODEL, timeout=timeout, max_tokens=max_tokens)
+
+def _call_hf(messages, model, timeout, max_tokens, prompt_tokens):
+    return _hf_chat(messages, model or os.getenv("HF_MODEL_ID"), timeout=timeout, max_tokens=max_tokens)
+
+def _call_ollama(messages, model, timeout, max_tokens, prompt_tokens):
+    return _ollama_chat(messages, model or settings.OLLAMA_MODEL, timeout=timeout, max_tokens=max_tokens,
+                        prompt_tokens=prompt_tokens)
+
+# offline providers for load tests: the stub goes through the real HTTP client
+# code above, against a local fake server; replay never leaves the process
+def _call_stub(messages, model, timeout, max_tokens, prompt_tokens):
+    base = stub_url()
+    if settings.STUB_LLM_API == "openai":
+        return _openai_chat(messages, model or "stub", timeout=timeout, base=f"{base}/v1", api_key="stub",
+                            max_tokens=max_tokens)
+    return _ollama_chat(messages, model or "stub", timeout=timeout, base=base, max_tokens=max_tokens,
+                        prompt_tokens=prompt_tokens)
+
+cassette = Cassette(Path(settings.LLM_CASSETTE_PATH))
+
+def _call_replay(messages, model, timeout, max_tokens, prompt_tokens):
+    key = prompt_key(messages)
+    out = cassette.get(key)
+    if out is not None:
+        return out
+    upstream = resolve_provider(settings.LLM_REPLAY_UPSTREAM, model)
+    if not settings.LLM_REPLAY_RECORD or upstream == "replay":
+        raise ReplayMiss(f"no recorded response for prompt {key[:12]}")
+    out = router.chat(messages, provider=upstream, model=model, deadline_seconds=timeout, max_tokens=max_tokens,
+                      prompt_tokens=prompt_tokens)
+    cassette.put(key, messages, out, upstream)
+    return out
+
+class ProviderRouter:
+    def __init__(self):
+        self.providers: Dict[str, _Provider] = {
+            "openai": _Provider("openai", settings.LLM_CONCURRENCY_OPENAI, _call_openai),
+            "hf": _Provider("hf", settings.LLM_CONCURRENCY_HF, _call_hf),
+            "ollama": _Provider("ollama", settings.LLM_CONCURRENCY_OLLAMA, _call_ollama),
+            "stub": _Provider("stub", settings.LLM_CONCURRENCY_STUB, _call_stub),
+            "replay": _Provider("replay", settings.LLM_CONCURRENCY_STUB, _call_replay),
+        }
+        self.decisions = {"primary": 0, "short_circuit": 0, "failover": 0, "hedged": 0, "hedge_wins": 0}
+        self._hedge_pool = ThreadPoolExecutor(max_workers=32, thread_name_prefix="llm-hedge")
+
+    def _call(self, name: str, ticket: _Ticket, messages, model: Optional[str], deadline: float,
+              max_tokens: Optional[int] = None, prompt_tokens: Optional[int] = None) -> str:
+        p = self.providers[name]
+        left = deadline - time.monotonic()
+        if left <= 0 or not p.slots.acquire(timeout=left):
+            p.stats["queue_timeouts"] += 1
+            p.breaker.release_probe(ticket)
+            raise DeadlineExceeded(f"{name}: no free slot before the deadline")
+        p.stats["requests"] += 1
+        t0 = time.monotonic()
+        try:
+            out = p.call(messages, model, max(0.1, deadline - time.monotonic()), max_tokens, prompt_tokens)
+        except ReplayMiss:
+            p.breaker.release_probe(ticket)
+            raise  # a missing cassette entry says nothing about provider health
+        except Exception as e:
+            p.stats["errors"] += 1
+            if _client_error(e):
+                # e.g. an unknown user-supplied model: one user must not open the circuit for everyone
+                p.breaker.release_probe(ticket)
+                raise
+            p.breaker.record(False, time.monotonic() - t0, ticket)
+            if isinstance(e, httpx.TimeoutException):
+                p.stats["timeouts"] += 1
+                raise DeadlineExceeded(f"{name}: {type(e).__name__}") from e
+            raise
+        except BaseException:
+            p.breaker.release_probe(ticket)
+            raise
+        finally:
+            p.slots.release()
+        p.breaker.record(True, time.monotonic() - t0, ticket)
+        return out
+
+    def _fallback(self, primary: str) -> Optional[str]:
+        fb = resolve_provider(settings.LLM_FALLBACK_PROVIDER) if settings.LLM_FALLBACK_PROVIDER else None
+        return fb if fb and fb != primary else None
+
+    def chat(self, messages, provider: Optional[str] = None, model: Optional[str] = None,
+             deadline_seconds: Optional[float] = None, max_tokens: Optional[int] = None,
+             prompt_tokens: Optional[int] = None) -> str:
+        primary = resolve_provider(provider, model)
+        if (provider or "").lower() == "tinyllm" and not model:
+            model = "tinyllama"
+        deadline = time.monotonic() + (deadline_seconds or settings.LLM_DEADLINE_SECONDS)
+        fallback = self._fallback(primary)
+
+        ticket = self.providers[primary].breaker.allow()
+        if ticket is None:
+            self.decisions["short_circuit"] += 1
+            fb_ticket = self.providers[fallback].breaker.allow() if fallback else None
+            if fb_ticket is not None:
+                self.decisions["failover"] += 1
+                # model names are provider-specific: the fallback uses its own default
+                return self._call(fallback, fb_ticket, messages, None, deadline, max_tokens, prompt_tokens)
+            raise ProviderUnavailable(f"LLM provider '{primary}' is unavailable (circuit open)")
+
+        self.decisions["primary"] += 1
+        hedge_after = self.providers[primary].breaker.p95() if fallback and settings.LLM_HEDGE_ENABLED else None
+        if hedge_after is None:
+            try:
+                return self._call(primary, ticket, messages, model, deadline, max_tokens, prompt_tokens)
+            except DeadlineExceeded:
+                raise
+            except Exception:
+                fb_ticket = self.providers[fallback].breaker.allow() if fallback else None
+                if fb_ticket is None:
+                    raise
+                self.decisions["failover"] += 1
+                return self._call(fallback, fb_ticket, messages, None, deadline, max_tokens, prompt_tokens)
+        return self._hedged(primary, ticket, fallback, messages, model, deadline, hedge_after, max_tokens,
+                            prompt_tokens)
+
+    def _hedged(self, primary: str, ticket: _Ticket, fallback: str, messages, model, deadline: float,
+                hedge_after: float, max_tokens: Optional[int], prompt_tokens: Optional[int]) -> str:
+        first = self._hedge_pool.submit(self._call, primary, ticket, messages, model, deadline, max_tokens,
+                                        prompt_tokens)
+        try:
+            return first.result(timeout=min(hedge_after, max(0.0, deadline - time.monotonic())))
+        except FuturesTimeout:
+            pass
+        except DeadlineExceeded:
+            raise
+        except Exception:
+            fb_ticket = self.providers[fallback].breaker.allow()
+            if fb_ticket is None:
+                raise
+            self.decisions["failover"] += 1
+            return self._call(fallback, fb_ticket, messages, None, deadline, max_tokens, prompt_tokens)
+
+        # primary is past its p95: race a second request on the fallback. The loser
+        # can't be cancelled mid-HTTP call; it finishes in the background.
+        fb_ticket = self.providers[fallback].breaker.allow()
+        if fb_ticket is None:
+            futures = [first]
+        else:
+            self.decisions["hedged"] += 1
+            futures = [first, self._hedge_pool.submit(self._call, fallback, fb_ticket, messages, None, deadline,
+                                                      max_tokens, prompt_tokens)]
+        error: Optional[BaseException] = None
+        try:
+            for fut in as_completed(futures, timeout=max(0.0, deadline - time.monotonic())):
+                try:
+                    out = fut.result()
+                except Exception as e:
+                    error = error or e
+                    continue
+                if fut is not first:
+                    self.decisions["hedge_wins"] += 1
+                return out
+        except FuturesTimeout:
+            raise DeadlineExceeded(f"{primary}: no answer before the deadline")
+        raise error
+
+    def stats(self) -> dict:
+        out: Dict[str, object] = {"decisions": dict(self.decisions),
+                                  "fallback": settings.LLM_FALLBACK_PROVIDER, "hedging": settings.LLM_HEDGE_ENABLED}
+        for name, p in self.providers.items():
+            p95 = p.breaker.p95()
+            out[name] = {**p.stats, "state": p.breaker.state,
+                         "p95_ms": round(p95 * 1000, 1) if p95 is not None else None}
+        out["replay"]["cassette"] = cassette.stats()
+        return out
+
+router = ProviderRouter()
+metrics.register("llm", router.stats)
+
 def chat(
     messages: List[Dict[str, str]],
     provider: Optional[str] = None,
     model: Optional[str] = None,
+    deadline: Optional[float] = None,
+    max_tokens: Optional[int] = None,
+    prompt_tokens: Optional[int] = None,
 ) -> str:
     """
     provider:
@@ -222,21 +626,14 @@ def chat(
       - "ollama": Local Ollama
       - "hf":     Hugging Face Inference API / Endpoint
       - "tinyllm": alias for Ollama + tinyllama
+      - "stub":   local fake Ollama/OpenAI server (load tests, see llm_stub.py)
+      - "replay": recorded responses from LLM_CASSETTE_PATH (LLM_REPLAY_RECORD records misses)
       - None: auto -> OpenAI if key set; else HF if HF_TOKEN set; else Ollama
+    deadline: seconds for the whole call incl. queueing (default LLM_DEADLINE_SECONDS).
+    max_tokens: answer length cap (Ollama num_predict, OpenAI max_tokens, HF max_new_tokens).
+    prompt_tokens: the caller's token count of `messages` (TokenCounter.count_messages);
+      sizes Ollama's num_ctx instead of a chars-per-token estimate.
+    Raises ProviderUnavailable / DeadlineExceeded (both LLMError) from the router.
     """
-    p = (provider or "").lower()
-
-    if p == "openai":
-        return _openai_chat(messages, model or settings.OPENAI_MODEL)
-    if p == "hf":
-        return _hf_chat(messages, model or os.getenv("HF_MODEL_ID"))
-    if p in ("ollama", "tinyllm"):
-        forced = "tinyllama" if p == "tinyllm" and not model else model
-        return _ollama_chat(messages, forced or settings.OLLAMA_MODEL)
-
-    # auto-detect order: OpenAI -> HF -> Ollama
-    if settings.OPENAI_API_KEY:
-        return _openai_chat(messages, model or settings.OPENAI_MODEL)
-    if os.getenv("HF_TOKEN") and (model or os.getenv("HF_MODEL_ID")):
-        return _hf_chat(messages, model or os.getenv("HF_MODEL_ID"))
-    return _ollama_chat(messages, model or settings.OLLAMA_MODEL)
+    return router.chat(messages, provider=provider, model=model, deadline_seconds=deadline, max_tokens=max_tokens,
+                       prompt_tokens=prompt_tokens)
@@ -0,0 +1,66 @@
+# app/services/llm_replay.py
+# Cassette for the "replay" LLM provider: one JSON line per recorded exchange,
+# keyed by a hash of the exact prompt (messages), so load tests get real
+# answers with zero provider latency and fully reproducible output.
+from __future__ import annotations
+from pathlib import Path
+from typing import Dict, List, Optional
+import hashlib
+import json
+import threading
+import time
+
+
+def prompt_key(messages: List[Dict[str, str]]) -> str:
+    canon = json.dumps([[m.get("role", ""), m.get("content", "")] for m in messages],
+                       ensure_ascii=False, separators=(",", ":"))
+    return hashlib.sha256(canon.encode("utf-8")).hexdigest()
+
+
+class Cassette:
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self._entries: Optional[Dict[str, str]] = None
+        self._lock = threading.Lock()
+        self.hits = self.misses = self.recorded = 0
+
+    def _load(self) -> Dict[str, str]:
+        if self._entries is None:
+            entries: Dict[str, str] = {}
+            if self.path.exists():
+                with open(self.path, encoding="utf-8") as f:
+                    for line in f:
+                        line = line.strip()
+                        if not line:
+                            continue
+                        try:
+                            rec = json.loads(line)
+                            entries[rec["key"]] = rec["response"]
+                        except (ValueError, KeyError):
+                            continue  # a torn last line from a killed recorder
+            self._entries = entries
+        return self._entries
+
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            out = self._load().get(key)
+        if out is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return out
+
+    def put(self, key: str, messages: List[Dict[str, str]], response: str, provider: str) -> None:
+        rec = {"key": key, "provider": provider, "recorded_at": int(time.time()),
+               "messages": messages, "response": response}
+        with self._lock:
+            self._load()[key] = response
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            # append-only: concurrent recorders (several workers) interleave whole lines
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(rec, ensure_ascii=False) + "\n")
+            self.recorded += 1
+
+    def stats(self) -> dict:
+        return {"path": str(self.path), "entries": len(self._entries or {}),
+                "hits": self.hits, "misses": self.misses, "recorded": self.recorded}
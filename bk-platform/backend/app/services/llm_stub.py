@@ -0,0 +1,151 @@
+# app/services/llm_stub.py
+# A fake LLM server that speaks enough of the Ollama (/api/chat, /api/generate,
+# /api/tags) and OpenAI (/v1/chat/completions) HTTP APIs for load tests: fixed
+# latency plus a tokens-per-second generation delay, deterministic replies, no
+# model. The "stub" provider starts it in-process on demand; run it standalone
+# to share one between several API workers:
+#
+#   python -m app.services.llm_stub --port 11500 --latency-ms 200 --tps 40
+#   STUB_LLM_URL=http://127.0.0.1:11500 uvicorn app.main:app --workers 4
+from __future__ import annotations
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional, Tuple
+import argparse
+import json
+import threading
+import time
+
+from app.core.config import settings
+
+
+def _reply(messages: List[Dict[str, str]], n_tokens: int) -> str:
+    """Deterministic answer: the first words of the prompt's context (or last message)."""
+    last = (messages[-1].get("content") if messages else "") or ""
+    body = last.split("Context:", 1)[1] if "Context:" in last else last
+    words = body.split()[:n_tokens]
+    return " ".join(words) if words else "Not found in the provided documents."
+
+
+class _Handler(BaseHTTPRequestHandler):
+    server: "StubLLMServer"
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args) -> None:  # quiet: this runs under load
+        pass
+
+    def _send(self, status: int, payload: dict) -> None:
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _generate(self, messages: List[Dict[str, str]], max_tokens: Optional[int]) -> Tuple[str, int, float]:
+        n = min(self.server.reply_tokens, max_tokens or self.server.reply_tokens)
+        text = _reply(messages, n)
+        tokens = max(1, len(text.split()))
+        gen_s = tokens / self.server.tokens_per_second if self.server.tokens_per_second > 0 else 0.0
+        time.sleep(self.server.latency_ms / 1000.0 + gen_s)
+        self.server.requests += 1
+        return text, tokens, gen_s
+
+    def do_GET(self) -> None:
+        if self.path.rstrip("/") == "/api/tags":
+            return self._send(200, {"models": [{"name": "stub:latest", "model": "stub:latest"}]})
+        self._send(404, {"error": "not found"})
+
+    def do_POST(self) -> None:
+        try:
+            req = json.loads(self.rfile.read(int(self.headers.get("Content-Length") or 0)) or b"{}")
+        except ValueError:
+            return self._send(400, {"error": "invalid json"})
+        path = self.path.rstrip("/")
+        model = req.get("model") or "stub"
+
+        if path in ("/api/chat", "/api/generate"):  # Ollama
+            messages = req.get("messages") or [{"role": "user", "content": req.get("prompt") or ""}]
+            opts = req.get("options") or {}
+            text, tokens, gen_s = self._generate(messages, opts.get("num_predict"))
+            prompt_tokens = sum(len((m.get("content") or "").split()) for m in messages)
+            out = {
+                "model": model, "created_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()), "done": True,
+                "total_duration": int((self.server.latency_ms / 1000.0 + gen_s) * 1e9),
+                "load_duration": 0, "prompt_eval_count": prompt_tokens,
+                "prompt_eval_duration": int(self.server.latency_ms * 1e6),
+                "eval_count": tokens, "eval_duration": int(gen_s * 1e9),
+            }
+            if path == "/api/chat":
+                out["message"] = {"role": "assistant", "content": text}
+            else:
+                out["response"] = text
+            return self._send(200, out)
+
+        if path in ("/v1/chat/completions", "/chat/completions"):  # OpenAI
+            messages = req.get("messages") or []
+            text, tokens, _ = self._generate(messages, req.get("max_tokens"))
+            prompt_tokens = sum(len((m.get("content") or "").split()) for m in messages)
+            return self._send(200, {
+                "id": f"chatcmpl-stub-{self.server.requests}", "object": "chat.completion",
+                "created": int(time.time()), "model": model,
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": text}, "finish_reason": "stop"}],
+                "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": tokens,
+                          "total_tokens": prompt_tokens + tokens},
+            })
+        self._send(404, {"error": "not found"})
+
+
+class StubLLMServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, latency_ms: Optional[float] = None,
+                 tokens_per_second: Optional[float] = None, reply_tokens: Optional[int] = None):
+        super().__init__((host, port), _Handler)
+        self.latency_ms = settings.STUB_LLM_LATENCY_MS if latency_ms is None else latency_ms
+        self.tokens_per_second = settings.STUB_LLM_TOKENS_PER_SECOND if tokens_per_second is None else tokens_per_second
+        self.reply_tokens = settings.STUB_LLM_REPLY_TOKENS if reply_tokens is None else reply_tokens
+        self.requests = 0
+
+    @property
+    def url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self) -> "StubLLMServer":
+        threading.Thread(target=self.serve_forever, name="llm-stub", daemon=True).start()
+        return self
+
+
+_server: Optional[StubLLMServer] = None
+_server_lock = threading.Lock()
+
+
+def stub_url() -> str:
+    """Base URL of the stub: STUB_LLM_URL if set, else an in-process server started on first use."""
+    global _server
+    if settings.STUB_LLM_URL:
+        return settings.STUB_LLM_URL.rstrip("/")
+    with _server_lock:
+        if _server is None:
+            _server = StubLLMServer().start()
+    return _server.url
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Fake Ollama/OpenAI server for offline load tests")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=11500)
+    parser.add_argument("--latency-ms", type=float, default=None, help="fixed per-request latency")
+    parser.add_argument("--tps", type=float, default=None, help="generated tokens per second (0 = instant)")
+    parser.add_argument("--reply-tokens", type=int, default=None)
+    args = parser.parse_args()
+    server = StubLLMServer(args.host, args.port, args.latency_ms, args.tps, args.reply_tokens)
+    print(f"stub LLM on {server.url}  (Ollama: /api/chat  OpenAI: /v1/chat/completions)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
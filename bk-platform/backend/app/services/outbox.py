@@ -0,0 +1,238 @@
+# app/services/outbox.py
+from __future__ import annotations
+from datetime import datetime, timedelta, timezone
+from typing import List, Dict, Any, Optional
+import logging
+import threading
+
+import numpy as np
+from sqlalchemy import select, update, or_, and_
+
+from app.core import metrics
+from app.core.config import settings
+from app.db import SessionLocal
+from app.models.chunk import DocumentChunk, ChunkFingerprint
+from app.models.document import Document
+from app.models.outbox import VectorOutbox
+from app.services.doc_vectors import delete_document_vectors, upsert_centroids
+from app.services.embeddings import embed_texts
+from app.services.terms import TERMS_META_KEY, term_ids, encode_term_ids
+from app.vector.chroma_client import get_collection
+
+log = logging.getLogger(__name__)
+
+_stats = {"drained_documents": 0, "upserted_chunks": 0, "batches": 0, "failures": 0, "deleted_midway": 0,
+          "split_batches": 0}
+metrics.register("vector_outbox", lambda: dict(_stats))
+
+
+def chunk_vector_id(document_id: int, position: int) -> str:
+    # deterministic ids make every upsert idempotent (replays overwrite, never duplicate)
+    return f"doc{document_id}_chunk{position}"
+
+
+def _now() -> datetime:
+    return datetime.now(tz=timezone.utc)
+
+
+def _claim(db, entry_ids: List[int]) -> List[VectorOutbox]:
+    """Flip candidates to `processing`; a row another worker got first is skipped."""
+    stale = _now() - timedelta(seconds=settings.OUTBOX_CLAIM_TIMEOUT_SECONDS)
+    claimed = []
+    for eid in entry_ids:
+        res = db.execute(
+            update(VectorOutbox)
+            .where(
+                VectorOutbox.id == eid,
+                or_(
+                    VectorOutbox.status == "pending",
+                    and_(VectorOutbox.status.in_(["processing", "ingesting"]), VectorOutbox.claimed_at < stale),
+                ),
+            )
+            .values(status="processing", claimed_at=_now(), attempts=VectorOutbox.attempts + 1)
+        )
+        if res.rowcount == 1:
+            claimed.append(eid)
+    db.commit()
+    if not claimed:
+        return []
+    return db.query(VectorOutbox).filter(VectorOutbox.id.in_(claimed)).all()
+
+
+def _candidates(db, limit: int, document_id: Optional[int] = None) -> List[int]:
+    stale = _now() - timedelta(seconds=settings.OUTBOX_CLAIM_TIMEOUT_SECONDS)
+    q = select(VectorOutbox.id).where(
+        or_(
+            VectorOutbox.status == "pending",
+            # a stale "ingesting" row: the ingest died after committing some windows
+            and_(VectorOutbox.status.in_(["processing", "ingesting"]), VectorOutbox.claimed_at < stale),
+        )
+    )
+    if document_id is not None:
+        q = q.where(VectorOutbox.document_id == document_id)
+    return list(db.execute(q.order_by(VectorOutbox.id).limit(limit)).scalars())
+
+
+def _existing(document_ids) -> set:
+    # own session: the drain's may still be reading a snapshot from before a delete
+    with SessionLocal() as db:
+        return set(db.execute(select(Document.id).where(Document.id.in_(list(document_ids)))).scalars())
+
+
+class _Batch:
+    """
+    Accumulates chunks across documents and upserts them in one embed + one Chroma call.
+    Also sums each document's chunk embeddings for its document vector (see doc_vectors).
+    """
+
+    def __init__(self, size: int):
+        self.size = size
+        self.ids: List[str] = []
+        self.texts: List[str] = []
+        self.metas: List[Dict[str, Any]] = []
+        self.docs: Dict[int, Dict[str, Any]] = {}
+
+    def add(self, entry: VectorOutbox, position: int, content: str) -> None:
+        self.ids.append(chunk_vector_id(entry.document_id, position))
+        self.texts.append(content)
+        self.metas.append({
+            "document_id": entry.document_id, "chunk_index": position, "user_id": entry.user_id,
+            "filename": entry.filename, TERMS_META_KEY: encode_term_ids(term_ids(content)),
+        })
+        if len(self.ids) >= self.size:
+            self.flush()
+
+    def flush(self) -> None:
+        if not self.ids:
+            return
+        live = _existing({m["document_id"] for m in self.metas})
+        if len(live) < len({m["document_id"] for m in self.metas}):
+            # deleted since the entry was claimed: don't write vectors nobody will remove
+            keep = [i for i, m in enumerate(self.metas) if m["document_id"] in live]
+            self.ids = [self.ids[i] for i in keep]
+            self.texts = [self.texts[i] for i in keep]
+            self.metas = [self.metas[i] for i in keep]
+            if not self.ids:
+                return
+        embeddings = embed_texts(self.texts)
+        get_collection().upsert(ids=self.ids, documents=self.texts, embeddings=embeddings, metadatas=self.metas)
+        for meta, emb in zip(self.metas, np.asarray(embeddings, dtype=np.float32)):
+            doc = self.docs.setdefault(meta["document_id"], {
+                "sum": np.zeros_like(emb), "count": 0, "user_id": meta["user_id"], "filename": meta["filename"],
+            })
+            doc["sum"] += emb
+            doc["count"] += 1
+        _stats["upserted_chunks"] += len(self.ids)
+        _stats["batches"] += 1
+        self.ids, self.texts, self.metas = [], [], []
+
+
+def _push(entries: List[VectorOutbox], db) -> None:
+    """Embed and upsert the entries' chunks (and document vectors) in shared batches."""
+    batch = _Batch(settings.OUTBOX_BATCH_SIZE)
+    for entry in entries:
+        # page through the document's chunks so huge documents stay in bounded memory
+        last = -1
+        while True:
+            page = db.execute(
+                select(DocumentChunk.position, DocumentChunk.content, ChunkFingerprint.canonical_document_id)
+                .outerjoin(ChunkFingerprint, and_(ChunkFingerprint.document_id == DocumentChunk.document_id,
+                                                  ChunkFingerprint.position == DocumentChunk.position))
+                .where(DocumentChunk.document_id == entry.document_id, DocumentChunk.position > last)
+                .order_by(DocumentChunk.position)
+                .limit(settings.OUTBOX_BATCH_SIZE)
+            ).all()
+            if not page:
+                break
+            for position, content, canonical in page:
+                # copies linked at ingest share the canonical chunk's vector (see dedup)
+                if canonical is None:
+                    batch.add(entry, position, content)
+            last = page[-1][0]
+    batch.flush()
+    upsert_centroids(batch.docs)
+    # a delete that committed while we embedded has already cleared the
+    # document's vectors, and ours landed after: clear them again
+    for doc_id in set(batch.docs) - _existing(batch.docs):
+        delete_document_vectors(doc_id)
+        _stats["deleted_midway"] += 1
+
+
+def _drain(entries: List[VectorOutbox], db) -> int:
+    """
+    Push the entries' chunks; returns how many entries were indexed. A batch
+    that fails is retried one document at a time, so only the entry that
+    actually fails spends an attempt and records the error.
+    """
+    try:
+        _push(entries, db)
+    except Exception as e:
+        if len(entries) > 1:
+            _stats["split_batches"] += 1
+            log.warning("vector outbox batch of %d documents failed (%s), retrying one by one", len(entries), e)
+            return sum(_drain([entry], db) for entry in entries)
+        entry = entries[0]
+        _stats["failures"] += 1
+        log.exception("vector outbox drain failed for document %s", entry.document_id)
+        # by statement, not on the loaded row: a delete/reindex may have removed it meanwhile
+        db.execute(update(VectorOutbox).where(VectorOutbox.id == entry.id).values(
+            status="failed" if entry.attempts >= settings.OUTBOX_MAX_ATTEMPTS else "pending",
+            last_error=str(e)[:500],
+        ))
+        db.commit()
+        return 0
+    db.execute(update(VectorOutbox).where(VectorOutbox.id.in_([e.id for e in entries]))
+               .values(status="done", last_error=None))
+    _stats["drained_documents"] += len(entries)
+    db.commit()
+    return len(entries)
+
+
+def drain_once(limit: int = 50, document_id: Optional[int] = None) -> int:
+    """Claim up to `limit` pending entries and push their chunks; returns entries indexed."""
+    with SessionLocal() as db:
+        entries = _claim(db, _candidates(db, limit, document_id))
+        return _drain(entries, db) if entries else 0
+
+
+def drain_document(document_id: int) -> bool:
+    """Index one document right away (upload path). False if it stays queued for the worker."""
+    drain_once(limit=1, document_id=document_id)
+    with SessionLocal() as db:
+        status = db.execute(
+            select(VectorOutbox.status).where(VectorOutbox.document_id == document_id)
+            .order_by(VectorOutbox.id.desc()).limit(1)
+        ).scalar()
+    return status == "done"
+
+
+class OutboxWorker:
+    def __init__(self, interval: float):
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> None:
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="vector-outbox", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout=30)
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            try:
+                busy = drain_once()
+            except Exception:
+                log.exception("vector outbox worker error")
+                busy = 0
+            if not busy:  # idle, or the last batch failed: back off
+                self._stop.wait(self.interval)
+
+
+worker = OutboxWorker(settings.OUTBOX_POLL_SECONDS)
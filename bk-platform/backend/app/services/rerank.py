@@ -0,0 +1,139 @@
+# app/services/rerank.py
+from __future__ import annotations
+from collections import OrderedDict
+from typing import List, Dict, Any, Optional
+import hashlib
+import logging
+import math
+import threading
+import time
+
+from app.core.config import settings
+
+log = logging.getLogger(__name__)
+
+# The cross-encoder loads (and on first use downloads) in the background, at
+# startup when RERANK_ENABLED or else on the first request that asks for it;
+# until then rerank() keeps vector order. A failed load is retried after
+# RERANK_RETRY_SECONDS rather than never.
+_model = None
+_loading = False
+_failed_at: Optional[float] = None
+_model_lock = threading.Lock()
+
+# (model, question, chunk text) digest -> probability-like score in [0..1]
+_cache: "OrderedDict[str, float]" = OrderedDict()
+_cache_lock = threading.Lock()
+
+
+def _load() -> None:
+    global _model, _loading, _failed_at
+    try:
+        from sentence_transformers import CrossEncoder
+        model = CrossEncoder(settings.RERANK_MODEL, device="cpu", max_length=512)
+    except Exception:
+        log.warning("reranker %s unavailable, keeping vector order", settings.RERANK_MODEL, exc_info=True)
+        model = None
+    with _model_lock:
+        _model, _loading = model, False
+        _failed_at = None if model is not None else time.monotonic()
+
+
+def get_reranker():
+    """The cross-encoder if it is loaded, else None (and a background load is started if due)."""
+    global _loading
+    with _model_lock:
+        if _model is not None or _loading:
+            return _model
+        if _failed_at is not None and time.monotonic() - _failed_at < settings.RERANK_RETRY_SECONDS:
+            return None
+        _loading = True
+    threading.Thread(target=_load, name="reranker-load", daemon=True).start()
+    return None
+
+
+def warm_reranker() -> None:
+    """Start loading the cross-encoder at startup when reranking is on by default (returns immediately)."""
+    if settings.RERANK_ENABLED:
+        get_reranker()
+
+
+def _key(question: str, text: str) -> str:
+    h = hashlib.blake2b(digest_size=16)
+    for part in (settings.RERANK_MODEL, question, text):
+        h.update(part.encode("utf-8", "ignore"))
+        h.update(b"\x00")
+    return h.hexdigest()
+
+
+def _cache_get(key: str) -> Optional[float]:
+    with _cache_lock:
+        score = _cache.get(key)
+        if score is not None:
+            _cache.move_to_end(key)
+        return score
+
+
+def _cache_put(key: str, score: float) -> None:
+    with _cache_lock:
+        _cache[key] = score
+        _cache.move_to_end(key)
+        while len(_cache) > settings.RERANK_CACHE_SIZE:
+            _cache.popitem(last=False)
+
+
+def _sigmoid(x: float) -> float:
+    return 1.0 / (1.0 + math.exp(-max(min(x, 50.0), -50.0)))
+
+
+def rerank(
+    question: str,
+    rows: List[Dict[str, Any]],
+    budget_ms: Optional[int] = None,
+    text_key: str = "content",
+) -> List[Dict[str, Any]]:
+    """
+    Re-score `rows` (already in vector order) with a cross-encoder.
+
+    Pairs are scored in batches, best vector candidates first, until the time
+    budget runs out. Scored rows get `rerank_score` and are sorted by it; rows
+    the budget didn't reach keep vector order after them. Returns rows
+    unchanged while the model is loading or unavailable.
+    """
+    if not rows:
+        return rows
+    model = get_reranker()
+    if model is None:
+        return rows
+
+    budget = (budget_ms if budget_ms is not None else settings.RERANK_BUDGET_MS) / 1000.0
+    deadline = time.perf_counter() + budget
+    batch_size = max(1, settings.RERANK_BATCH_SIZE)
+
+    keys = [_key(question, r.get(text_key) or "") for r in rows]
+    scores: List[Optional[float]] = [_cache_get(k) for k in keys]
+    todo = [i for i, s in enumerate(scores) if s is None]
+
+    for start in range(0, len(todo), batch_size):
+        if time.perf_counter() >= deadline:
+            break
+        idx = todo[start:start + batch_size]
+        pairs = [(question, (rows[i].get(text_key) or "")[:2000]) for i in idx]
+        try:
+            logits = model.predict(pairs, batch_size=batch_size, show_progress_bar=False)
+        except Exception:
+            break  # fall back to vector order for whatever is left
+        for i, logit in zip(idx, logits):
+            scores[i] = _sigmoid(float(logit))
+            _cache_put(keys[i], scores[i])
+
+    scored = [(s, i) for i, s in enumerate(scores) if s is not None]
+    if not scored:
+        return rows
+    scored.sort(key=lambda x: x[0], reverse=True)
+    out = []
+    for s, i in scored:
+        rows[i]["rerank_score"] = s
+        out.append(rows[i])
+    out.extend(r for r, s in zip(rows, scores) if s is None)
+    return out
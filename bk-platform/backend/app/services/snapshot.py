@@ -0,0 +1,448 @@
+# app/services/snapshot.py
+"""
+Point-in-time snapshots of the SQL database, the vector index and the blob
+manifest, and a restore that bulk-loads them without re-embedding.
+
+    python -m app.services.snapshot create [--full] [--no-blobs]
+    python -m app.services.snapshot list
+    python -m app.services.snapshot restore <snapshot id> [--force]   # app stopped
+
+A snapshot is a directory under SNAPSHOT_ROOT:
+
+    manifest.json   documents (content signature + which snapshot holds their
+                    vectors), blob refs (+ which snapshot holds a copy), parent
+    db.sqlite       SQLite online-backup copy: the consistency point
+    vectors.npy     float32 rows (memory-mapped on restore)
+    vectors.jsonl   id / chunk text / metadata per row
+    blobs/<key>     copies of blobs not already in the parent chain
+
+Consistency: the database is copied first. Vectors are then read from Chroma
+only for documents the copy shows as indexed, and each chunk's text is checked
+against the copy; a document that changed since (or was never indexed) gets a
+pending outbox row in the copy, so the restored node re-embeds just that one.
+
+Incremental snapshots (the default once one exists) still copy the whole
+database, which is small next to the vectors, but only carry vectors and blobs
+for documents that are new or changed since the parent; unchanged ones point
+at the snapshot that already holds them, deleted ones are simply absent.
+"""
+from __future__ import annotations
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+import argparse
+import hashlib
+import json
+import logging
+import os
+import shutil
+import sqlite3
+import tempfile
+import threading
+
+import numpy as np
+from numpy.lib.format import open_memmap
+
+from app.core.config import settings
+from app.db import engine
+from app.services.files import BLOB_REF_PREFIX, get_blob_store
+from app.services.outbox import chunk_vector_id
+from app.services.doc_vectors import backfill as backfill_doc_vectors
+from app.vector.chroma_client import COLLECTION, DOC_COLLECTION, get_client, get_collection, reset_client
+
+log = logging.getLogger(__name__)
+
+MANIFEST = "manifest.json"
+FORMAT_VERSION = 1
+
+_lock = threading.Lock()
+
+
+class SnapshotError(RuntimeError):
+    pass
+
+
+# ---------- helpers ----------
+def _root() -> Path:
+    return Path(settings.SNAPSHOT_ROOT)
+
+
+def _sqlite_path() -> Path:
+    if engine.url.get_backend_name() != "sqlite" or not engine.url.database or engine.url.database == ":memory:":
+        raise SnapshotError("snapshots need a file SQLite DATABASE_URL (use the server's own backup tooling otherwise)")
+    return Path(engine.url.database)
+
+
+def load_manifest(snapshot_id: str) -> Dict[str, Any]:
+    path = _root() / snapshot_id / MANIFEST
+    if not path.is_file():
+        raise SnapshotError(f"snapshot {snapshot_id!r} not found under {_root()}")
+    return json.loads(path.read_text())
+
+
+def list_snapshots() -> List[Dict[str, Any]]:
+    """Completed snapshots, oldest first (summary fields only)."""
+    out = []
+    if _root().is_dir():
+        for d in sorted(_root().iterdir()):
+            if d.name.startswith(".") or not (d / MANIFEST).is_file():
+                continue
+            m = json.loads((d / MANIFEST).read_text())
+            out.append({k: m.get(k) for k in ("id", "created_at", "kind", "parent", "stats")})
+    return out
+
+
+def _chain(snapshot_id: str) -> List[Dict[str, Any]]:
+    """Manifests from the base full snapshot up to `snapshot_id`."""
+    chain, sid = [], snapshot_id
+    while sid:
+        m = load_manifest(sid)
+        chain.append(m)
+        sid = m.get("parent")
+    return chain[::-1]
+
+
+def _chunk_pages(con: sqlite3.Connection, doc_id: int) -> Iterator[List[Tuple[int, str]]]:
+    last = -1
+    while True:
+        page = con.execute(
+            # chunks linked to a copy (see dedup) have no vector of their own
+            "SELECT c.position, c.content FROM document_chunks c "
+            "LEFT JOIN chunk_fingerprints f ON f.document_id = c.document_id AND f.position = c.position "
+            "WHERE c.document_id = ? AND c.position > ? AND f.canonical_document_id IS NULL "
+            "ORDER BY c.position LIMIT ?",
+            (doc_id, last, settings.SNAPSHOT_FETCH_BATCH),
+        ).fetchall()
+        if not page:
+            return
+        yield page
+        last = page[-1][0]
+
+
+def _signature(con: sqlite3.Connection, doc_id: int) -> Tuple[str, int]:
+    h, n = hashlib.blake2b(digest_size=16), 0
+    for page in _chunk_pages(con, doc_id):
+        for position, content in page:
+            h.update(f"{position}\x00".encode())
+            h.update((content or "").encode("utf-8", "surrogatepass"))
+            h.update(b"\x00")
+        n += len(page)
+    return h.hexdigest(), n
+
+
+class _VectorWriter:
+    """Appends rows to vectors.npy (preallocated, memmapped) + vectors.jsonl; per-document rollback."""
+
+    def __init__(self, folder: Path, capacity: int):
+        self.folder, self.capacity = folder, capacity
+        self.rows, self.dim = 0, None
+        self._arr = None
+        self._meta = open(folder / "vectors.jsonl", "w", encoding="utf-8")
+
+    def mark(self) -> Tuple[int, int]:
+        return self.rows, self._meta.tell()
+
+    def rollback(self, mark: Tuple[int, int]) -> None:
+        self.rows = mark[0]
+        self._meta.seek(mark[1])
+        self._meta.truncate()
+
+    def add(self, ids: List[str], embeddings, documents: List[str], metadatas: List[Dict[str, Any]]) -> None:
+        E = np.asarray(embeddings, dtype=np.float32)
+        if self._arr is None:
+            self.dim = E.shape[1]
+            self._arr = open_memmap(self.folder / "vectors.npy", mode="w+", dtype=np.float32,
+                                    shape=(max(self.capacity, 1), self.dim))
+        self._arr[self.rows:self.rows + len(ids)] = E
+        for vid, doc, meta in zip(ids, documents, metadatas):
+            self._meta.write(json.dumps({"id": vid, "document": doc, "metadata": meta}) + "\n")
+        self.rows += len(ids)
+
+    def close(self) -> None:
+        self._meta.close()
+        if self._arr is not None:
+            self._arr.flush()
+            del self._arr
+
+
+# ---------- create ----------
+def _backup_db(dest: Path) -> None:
+    # the online backup API copies a consistent image while writers keep going
+    src = engine.raw_connection()
+    try:
+        dst = sqlite3.connect(dest)
+        try:
+            src.driver_connection.backup(dst)
+            dst.execute("PRAGMA journal_mode=DELETE")  # one self-contained file
+        finally:
+            dst.close()
+    finally:
+        src.close()
+
+
+def _indexed_documents(con: sqlite3.Connection) -> Dict[int, Tuple[int, str]]:
+    """Documents whose latest outbox entry is done, or that predate the outbox: id -> (user_id, filename)."""
+    rows = con.execute(
+        "SELECT d.id, d.user_id, d.filename, "
+        "  (SELECT o.status FROM vector_outbox o WHERE o.document_id = d.id ORDER BY o.id DESC LIMIT 1) "
+        "FROM documents d"
+    ).fetchall()
+    return {doc_id: (user_id, filename) for doc_id, user_id, filename, status in rows if status in (None, "done")}
+
+
+def _copy_document_vectors(con, col, writer: _VectorWriter, doc_id: int) -> bool:
+    """Copy a document's vectors if Chroma holds exactly the chunk texts in the DB copy."""
+    mark = writer.mark()
+    for page in _chunk_pages(con, doc_id):
+        ids = [chunk_vector_id(doc_id, position) for position, _ in page]
+        got = col.get(ids=ids, include=["embeddings", "documents", "metadatas"])
+        by_id = {vid: i for i, vid in enumerate(got.get("ids") or [])}
+        if len(by_id) != len(ids):
+            writer.rollback(mark)
+            return False
+        order = [by_id[vid] for vid in ids]
+        docs = [got["documents"][i] for i in order]
+        if any(d != content for d, (_, content) in zip(docs, page)):
+            writer.rollback(mark)
+            return False
+        writer.add(ids, [got["embeddings"][i] for i in order], docs, [got["metadatas"][i] for i in order])
+    return True
+
+
+def _requeue(con: sqlite3.Connection, stale: List[Tuple[int, int, str]]) -> None:
+    """In the DB copy: anything not captured in the vectors is pending again."""
+    con.execute("UPDATE vector_outbox SET status = 'pending', claimed_at = NULL WHERE status IN ('processing', 'ingesting')")
+    for doc_id, user_id, filename in stale:
+        updated = con.execute(
+            "UPDATE vector_outbox SET status = 'pending', attempts = 0, claimed_at = NULL, last_error = NULL "
+            "WHERE id = (SELECT MAX(id) FROM vector_outbox WHERE document_id = ?)",
+            (doc_id,),
+        ).rowcount
+        if not updated:
+            con.execute(
+                "INSERT INTO vector_outbox (document_id, user_id, filename, status, attempts) "
+                "VALUES (?, ?, ?, 'pending', 0)",
+                (doc_id, user_id, filename),
+            )
+    con.commit()
+
+
+def _copy_blob(store, key: str, dest: Path) -> None:
+    dest.parent.mkdir(parents=True, exist_ok=True)
+    with store.open(key) as src, open(dest, "wb") as out:
+        shutil.copyfileobj(src, out, settings.STREAM_BLOCK_BYTES)
+
+
+def create_snapshot(full: bool = False, include_blobs: Optional[bool] = None) -> Dict[str, Any]:
+    """Take a snapshot (incremental against the latest one unless `full`); returns its manifest."""
+    include_blobs = settings.SNAPSHOT_INCLUDE_BLOBS if include_blobs is None else include_blobs
+    with _lock:
+        _sqlite_path()
+        root = _root()
+        root.mkdir(parents=True, exist_ok=True)
+        existing = list_snapshots()
+        parent = None if full or not existing else load_manifest(existing[-1]["id"])
+        sid = datetime.now(tz=timezone.utc).strftime("%Y%m%dT%H%M%S%fZ")
+        work = root / f".{sid}.partial"
+        work.mkdir()
+        try:
+            manifest = _build(work, sid, parent, include_blobs)
+            (work / MANIFEST).write_text(json.dumps(manifest, indent=1))
+            os.replace(work, root / sid)
+        except BaseException:
+            shutil.rmtree(work, ignore_errors=True)
+            raise
+    log.info("snapshot %s (%s): %s", sid, manifest["kind"], manifest["stats"])
+    return manifest
+
+
+def _build(work: Path, sid: str, parent: Optional[Dict[str, Any]], include_blobs: bool) -> Dict[str, Any]:
+    _backup_db(work / "db.sqlite")
+    con = sqlite3.connect(work / "db.sqlite")
+    try:
+        candidates = _indexed_documents(con)
+        prev_docs = parent["documents"] if parent else {}
+        documents: Dict[str, Dict[str, Any]] = {}
+        changed: Dict[int, Tuple[str, int]] = {}
+        for doc_id in sorted(candidates):
+            sig, n = _signature(con, doc_id)
+            prev = prev_docs.get(str(doc_id))
+            if not n:
+                continue
+            if prev and prev["sig"] == sig:
+                documents[str(doc_id)] = prev  # vectors live in an earlier snapshot
+            else:
+                changed[doc_id] = (sig, n)
+        carried = len(documents)
+
+        writer = _VectorWriter(work, sum(n for _, n in changed.values()))
+        col = get_collection()
+        stale: List[Tuple[int, int, str]] = []
+        try:
+            for doc_id, (sig, n) in changed.items():
+                if _copy_document_vectors(con, col, writer, doc_id):
+                    documents[str(doc_id)] = {"sig": sig, "chunks": n, "in": sid}
+                else:
+                    stale.append((doc_id, *candidates[doc_id]))
+        finally:
+            writer.close()
+        if not writer.rows:
+            (work / "vectors.npy").unlink(missing_ok=True)
+        _requeue(con, stale)
+
+        store = get_blob_store()
+        prev_blobs = parent["blobs"] if parent else {}
+        blobs: Dict[str, Optional[str]] = {}
+        copied = 0
+        for (ref,) in con.execute("SELECT DISTINCT path FROM documents"):
+            key = ref[len(BLOB_REF_PREFIX):] if ref.startswith(BLOB_REF_PREFIX) else None
+            if prev_blobs.get(ref):
+                blobs[ref] = prev_blobs[ref]
+            elif include_blobs and key and store.exists(key):
+                _copy_blob(store, key, work / "blobs" / key)
+                blobs[ref] = sid
+                copied += 1
+            else:
+                blobs[ref] = None  # manifest only: must already be in the target's blob store
+        pending = con.execute("SELECT COUNT(*) FROM vector_outbox WHERE status = 'pending'").fetchone()[0]
+    finally:
+        con.close()
+
+    return {
+        "format": FORMAT_VERSION,
+        "id": sid,
+        "created_at": datetime.now(tz=timezone.utc).isoformat(),
+        "kind": "incremental" if parent else "full",
+        "parent": parent["id"] if parent else None,
+        "embed_model": settings.EMBED_MODEL,
+        "collection": COLLECTION,
+        "vectors": {"rows": writer.rows, "dim": writer.dim},
+        "documents": documents,
+        "deleted": sorted(int(d) for d in prev_docs if d not in documents),
+        "blobs": blobs,
+        "stats": {
+            "documents": len(documents),
+            "documents_new": len(documents) - carried,
+            "documents_carried": carried,
+            "documents_requeued": len(stale),
+            "vectors": writer.rows,
+            "blobs": len(blobs),
+            "blobs_copied": copied,
+            "outbox_pending": pending,
+        },
+    }
+
+
+# ---------- restore ----------
+def _load_vectors(col, folder: Path, keep) -> int:
+    """Bulk-upsert the rows of one snapshot whose document satisfies `keep`; vectors are memory-mapped."""
+    if not (folder / "vectors.npy").is_file():
+        return 0
+    E = np.load(folder / "vectors.npy", mmap_mode="r")
+    loaded, batch = 0, ([], [], [], [])
+
+    def flush():
+        nonlocal loaded, batch
+        if batch[0]:
+            col.upsert(ids=batch[0], embeddings=np.asarray(E[batch[1]]).tolist(),
+                       documents=batch[2], metadatas=batch[3])
+            loaded += len(batch[0])
+            batch = ([], [], [], [])
+
+    with open(folder / "vectors.jsonl", encoding="utf-8") as f:
+        for row, line in enumerate(f):
+            rec = json.loads(line)
+            if not keep(rec["metadata"]["document_id"]):
+                continue
+            for part, value in zip(batch, (rec["id"], row, rec["document"], rec["metadata"])):
+                part.append(value)
+            if len(batch[0]) >= settings.SNAPSHOT_RESTORE_BATCH:
+                flush()
+    flush()
+    return loaded
+
+
+def restore_snapshot(snapshot_id: str, force: bool = False) -> Dict[str, Any]:
+    """
+    Replace the database, the vector collection and missing blobs with a snapshot.
+    Run with the API stopped; documents requeued in the snapshot re-embed on start.
+    """
+    chain = _chain(snapshot_id)
+    target = chain[-1]
+    if target["embed_model"] != settings.EMBED_MODEL and not force:
+        raise SnapshotError(f"snapshot vectors are from {target['embed_model']!r}, EMBED_MODEL is "
+                            f"{settings.EMBED_MODEL!r} (use force to restore anyway and reindex)")
+
+    # 1) database: the snapshot file replaces the live one (and its WAL)
+    db_path = _sqlite_path()
+    engine.dispose()
+    for suffix in ("", "-wal", "-shm"):
+        Path(str(db_path) + suffix).unlink(missing_ok=True)
+    db_path.parent.mkdir(parents=True, exist_ok=True)
+    shutil.copyfile(_root() / snapshot_id / "db.sqlite", db_path)
+
+    # 2) vectors: fresh collection, each document loaded from the snapshot that holds it
+    for name in (COLLECTION, DOC_COLLECTION):
+        try:
+            get_client().delete_collection(name)
+        except Exception:
+            pass  # nothing to drop
+    reset_client()
+    col = get_collection()
+    docs = target["documents"]
+    vectors = 0
+    for m in chain:
+        vectors += _load_vectors(col, _root() / m["id"], lambda d, sid=m["id"]: docs.get(str(d), {}).get("in") == sid)
+    # document vectors are derived from the chunk vectors: recompute rather than store them
+    backfill_doc_vectors(force=True, document_ids=[int(d) for d in docs])
+
+    # 3) blobs the store doesn't have yet
+    store = get_blob_store()
+    spool = Path(settings.BLOB_ROOT) / ".spool"
+    spool.mkdir(parents=True, exist_ok=True)
+    restored, missing = 0, []
+    for ref, where in target["blobs"].items():
+        key = ref[len(BLOB_REF_PREFIX):] if ref.startswith(BLOB_REF_PREFIX) else None
+        if key is None or store.exists(key):
+            continue
+        src = _root() / where / "blobs" / key if where else None
+        if src is None or not src.is_file():
+            missing.append(ref)
+            continue
+        fd, tmp = tempfile.mkstemp(dir=spool, prefix="restore-")
+        with os.fdopen(fd, "wb") as out, open(src, "rb") as f:
+            shutil.copyfileobj(f, out, settings.STREAM_BLOCK_BYTES)
+        store.put_file(key, Path(tmp))
+        restored += 1
+
+    out = {"id": snapshot_id, "documents": len(docs), "vectors": vectors,
+           "blobs_restored": restored, "blobs_missing": len(missing),
+           "outbox_pending": target["stats"]["outbox_pending"]}
+    log.info("restored snapshot %s: %s", snapshot_id, out)
+    return out
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Snapshot / restore the database, vector index and blob manifest")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    c = sub.add_parser("create", help="take a snapshot (incremental unless --full)")
+    c.add_argument("--full", action="store_true")
+    c.add_argument("--no-blobs", action="store_true", help="record blob refs without copying blobs")
+    sub.add_parser("list", help="list snapshots")
+    r = sub.add_parser("restore", help="restore a snapshot (stop the API first)")
+    r.add_argument("snapshot_id")
+    r.add_argument("--force", action="store_true", help="restore even if EMBED_MODEL differs")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    if args.cmd == "create":
+        print(json.dumps(create_snapshot(full=args.full, include_blobs=False if args.no_blobs else None)["stats"]))
+    elif args.cmd == "list":
+        for s in list_snapshots():
+            print(json.dumps(s))
+    else:
+        print(json.dumps(restore_snapshot(args.snapshot_id, force=args.force)))
+
+
+if __name__ == "__main__":
+    main()
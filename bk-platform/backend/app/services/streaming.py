@@ -0,0 +1,49 @@
+# app/services/streaming.py
+# Streaming ingestion for plain-text formats (.txt/.csv/.json/.log): the blob
+# is decoded incrementally and chunks are yielded as they form, so a
+# multi-hundred-megabyte file is ingested in constant memory instead of being
+# decoded into one string and sliced into one list.
+from __future__ import annotations
+from typing import BinaryIO, Iterator, Optional
+import codecs
+import io
+
+from app.core.config import settings
+from app.services.chunking import csv_row_chunks, stream_chunks
+
+STREAM_EXTS = (".txt", ".csv", ".json", ".log", ".ndjson")
+STREAM_MIMES = {"text/plain", "text/csv", "application/json", "application/x-ndjson"}
+
+
+def is_streamable(filename: Optional[str], mime: Optional[str]) -> bool:
+    name, m = (filename or "").lower(), (mime or "").lower()
+    return name.endswith(STREAM_EXTS) or (m in STREAM_MIMES and not name.endswith((".pdf", ".docx")))
+
+
+def is_csv(filename: Optional[str], mime: Optional[str]) -> bool:
+    return (filename or "").lower().endswith(".csv") or (mime or "").lower() == "text/csv"
+
+
+def iter_decoded(f: BinaryIO, block_size: Optional[int] = None) -> Iterator[str]:
+    """UTF-8 text of a byte stream, block by block (invalid bytes dropped, like extract_text_from_bytes)."""
+    decoder = codecs.getincrementaldecoder("utf-8")(errors="ignore")
+    block_size = block_size or settings.STREAM_BLOCK_BYTES
+    while True:
+        block = f.read(block_size)
+        if not block:
+            break
+        text = decoder.decode(block)
+        if text:
+            yield text
+    tail = decoder.decode(b"", final=True)
+    if tail:
+        yield tail
+
+
+def iter_document_chunks(f: BinaryIO, filename: Optional[str], mime: Optional[str],
+                         csv_row_groups: bool = False) -> Iterator[str]:
+    """Chunks for a streamable document; CSV optionally by row groups with the header repeated."""
+    if csv_row_groups and is_csv(filename, mime):
+        text = io.TextIOWrapper(f, encoding="utf-8", errors="ignore", newline="")
+        return csv_row_chunks(text)
+    return stream_chunks(iter_decoded(f))
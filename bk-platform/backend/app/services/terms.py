@@ -0,0 +1,117 @@
+# app/services/terms.py
+"""
+One tokenizer for every keyword gate, plus compact per-chunk term sets.
+
+Each chunk's distinct terms are hashed to uint32 ids (crc32), sorted and stored
+base64-encoded in its Chroma metadata under `TERMS_META_KEY` at ingest, so
+gating a query is a vectorized membership test instead of a regex over the
+chunk text.
+"""
+from __future__ import annotations
+from collections import OrderedDict
+from typing import List, Dict, Any, Optional
+import base64
+import re
+import threading
+import zlib
+
+import numpy as np
+
+from app.core.config import settings
+
+TERMS_META_KEY = "term_ids"
+
+_word = re.compile(r"[A-Za-z0-9]{%d,}" % settings.TERM_MIN_LEN)
+
+
+def tokenize(s: str) -> List[str]:
+    return [w.lower() for w in _word.findall(s or "")]
+
+
+# Left out of query terms: with TERM_MIN_LEN=2, "of"/"in"/"to" would match
+# nearly every chunk and turn the any-term gate into a no-op
+STOPWORDS = frozenset(
+    "a an and are as at be by do does did for from how in is it its me my of on or "
+    "our the their there this to was were what when where which who whom whose why "
+    "with you your please tell give show find".split()
+)
+
+
+def _ids(words) -> np.ndarray:
+    ids = {zlib.crc32(w.encode()) for w in words}
+    return np.fromiter(sorted(ids), dtype=np.uint32, count=len(ids))
+
+
+def term_ids(s: str) -> np.ndarray:
+    """Sorted, distinct uint32 term ids for a piece of text."""
+    return _ids(tokenize(s))
+
+
+def query_term_ids(q: str) -> np.ndarray:
+    """Gate terms of a query: its words minus stop-words (all words if that leaves none)."""
+    words = tokenize(q)
+    return _ids([w for w in words if w not in STOPWORDS] or words)
+
+
+def encode_term_ids(ids: np.ndarray) -> str:
+    return base64.b64encode(ids.astype("<u4").tobytes()).decode("ascii")
+
+
+def decode_term_ids(blob: str) -> np.ndarray:
+    return np.frombuffer(base64.b64decode(blob), dtype="<u4")
+
+
+# decoded sets are small and hot (top chunks repeat across queries)
+_decoded: "OrderedDict[str, np.ndarray]" = OrderedDict()
+_decoded_lock = threading.Lock()
+_DECODED_MAX = 8192
+
+
+def chunk_term_ids(meta: Optional[Dict[str, Any]], text: str) -> np.ndarray:
+    """Stored term ids for a chunk; tokenizes the text for chunks ingested before term ids existed."""
+    blob = (meta or {}).get(TERMS_META_KEY)
+    if not blob:
+        return term_ids(text)
+    with _decoded_lock:
+        ids = _decoded.get(blob)
+        if ids is not None:
+            _decoded.move_to_end(blob)
+            return ids
+    ids = decode_term_ids(blob)
+    with _decoded_lock:
+        _decoded[blob] = ids
+        while len(_decoded) > _DECODED_MAX:
+            _decoded.popitem(last=False)
+    return ids
+
+
+def keyword_mask(
+    query: str,
+    texts: List[str],
+    metas: List[Optional[Dict[str, Any]]],
+    require_all_terms: bool = False,
+) -> np.ndarray:
+    """
+    Boolean mask over retrieved chunks: any (or all) query terms present
+    (stop-words aside, see query_term_ids).
+    The query is tokenized once; each chunk is one sorted-array lookup.
+    """
+    n = len(texts)
+    q_ids = query_term_ids(query)
+    if not q_ids.size or not n:
+        return np.zeros(n, dtype=bool)
+
+    sets = [chunk_term_ids(m, t or "") for t, m in zip(texts, metas)]
+    lengths = np.fromiter((len(x) for x in sets), dtype=np.int64, count=n)
+    if not lengths.sum():
+        return np.zeros(n, dtype=bool)
+
+    # one flat array + owner index, then a single isin over all chunks
+    flat = np.concatenate(sets)
+    owner = np.repeat(np.arange(n), lengths)
+    hit = np.isin(flat, q_ids)
+    if not require_all_terms:
+        return np.bincount(owner[hit], minlength=n) > 0
+
+    # count distinct query terms per chunk (chunk sets are already distinct)
+    return np.bincount(owner[hit], minlength=n) >= q_ids.size
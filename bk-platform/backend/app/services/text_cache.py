@@ -0,0 +1,72 @@
+# app/services/text_cache.py
+# Extracted-text artifacts: the output of extract_text_from_bytes is kept
+# gzip'd in the blob store under derived/text/<extractor version>/<blob hash>,
+# so re-chunking, re-embedding or inspecting a document never re-runs
+# pypdf/Tesseract on the original bytes.
+from __future__ import annotations
+from typing import Optional, Tuple
+import gzip
+import hashlib
+
+from app.core import metrics
+from app.core.config import settings
+from app.services.files import blob_digest, get_blob_store, read_blob
+from app.services.extract_pool import extract_text
+from app.services.text_extract import EXTRACTOR_VERSION
+
+_stats = {"hits": 0, "misses": 0, "stored": 0}
+metrics.register("text_cache", lambda: dict(_stats))
+
+
+def text_key(digest: str, version: str = EXTRACTOR_VERSION) -> str:
+    return f"derived/text/v{version}/{digest[:2]}/{digest}.txt.gz"
+
+
+def delete_cached_text(digest: str) -> None:
+    """Drop a blob's text artifacts, for this extractor version and every earlier one."""
+    store = get_blob_store()
+    for version in range(1, int(EXTRACTOR_VERSION) + 1):
+        store.delete(text_key(digest, str(version)))  # absent keys are fine
+
+
+def _digest(ref: str, data: Optional[bytes]) -> Optional[str]:
+    digest = blob_digest(ref)
+    if digest is None and data is not None:  # legacy path: hash the bytes we already have
+        digest = hashlib.sha256(data).hexdigest()
+    return digest
+
+
+def get_cached_text_gz(ref: str, data: Optional[bytes] = None) -> Optional[bytes]:
+    """Compressed cached text for a blob ref, or None if it was never extracted with this version."""
+    digest = _digest(ref, data)
+    if digest is None or not settings.TEXT_CACHE_ENABLED:
+        return None
+    store = get_blob_store()
+    key = text_key(digest)
+    if not store.exists(key):
+        return None
+    return store.get(key)
+
+
+def get_or_extract(ref: str, filename: str, mime: Optional[str], data: Optional[bytes] = None) -> Tuple[str, bool]:
+    """
+    Text for a document's bytes, from the cache when possible. Returns (text, cached).
+    `data` is the original bytes if the caller already has them (upload path);
+    otherwise they are only read from the blob store on a cache miss.
+    Blocks on the extraction pool: call from a worker thread, not the event loop.
+    """
+    cached = get_cached_text_gz(ref, data)
+    if cached is not None:
+        _stats["hits"] += 1
+        return gzip.decompress(cached).decode("utf-8"), True
+    _stats["misses"] += 1
+
+    if data is None:
+        data = read_blob(ref)
+    text = extract_text(data, filename, mime)  # isolated worker process; may raise ExtractionError
+    digest = _digest(ref, data)
+    # empty output isn't cached: it usually means an optional OCR dependency is missing
+    if settings.TEXT_CACHE_ENABLED and digest and text and text.strip():
+        get_blob_store().put(text_key(digest), gzip.compress(text.encode("utf-8"), compresslevel=6, mtime=0))
+        _stats["stored"] += 1
+    return text, False
@@ -65,6 +65,12 @@ except Exception:
     pytesseract = None
 
 
+# Bump whenever extraction output changes (parsers, OCR settings, decoding) so
+# cached text artifacts from older extractors are ignored. Keep it a counter
+# ("1", "2", ...): deleting a blob also deletes its artifacts of every version
+# up to this one (text_cache.delete_cached_text).
+EXTRACTOR_VERSION = "1"
+
 TEXT_MIMES = {
     "text/plain",
     "text/markdown",
@@ -1,18 +1,83 @@
 from pathlib import Path
+import threading
+
 import chromadb
 from chromadb.config import Settings
 
-PERSIST_DIR = Path("vectorstore")
-PERSIST_DIR.mkdir(exist_ok=True)
+from app.core.config import settings
+
+# VECTOR_MODE=embedded: this process opens the index under VECTOR_PATH (one
+# process per node). VECTOR_MODE=http: the index lives in one vector service
+# (`python -m app.vector.server`) and every API worker talks to it over HTTP.
+PERSIST_DIR = Path(settings.VECTOR_PATH)
+COLLECTION = "bk_chunks"
+DOC_COLLECTION = "bk_docs"  # one centroid vector per document (two-stage retrieval)
+
+_client = None
+_collection = None
+_doc_collection = None
+_lock = threading.Lock()
+
+
+def _pool_connections(client, size: int) -> None:
+    # chromadb's HTTP client shares one requests.Session; its default pool keeps
+    # only 10 connections, so a busy worker threadpool would churn sockets
+    import requests
+    session = getattr(getattr(client, "_server", None), "_session", None)
+    if isinstance(session, requests.Session):
+        adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=size)
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+
+
+def get_client():
+    global _client
+    if _client is None:
+        with _lock:
+            if _client is None:
+                chroma_settings = Settings(anonymized_telemetry=False)
+                if settings.VECTOR_MODE == "http":
+                    client = chromadb.HttpClient(
+                        host=settings.VECTOR_HOST, port=settings.VECTOR_PORT, settings=chroma_settings,
+                    )
+                    _pool_connections(client, settings.VECTOR_HTTP_POOL_SIZE)
+                elif settings.VECTOR_MODE == "embedded":
+                    PERSIST_DIR.mkdir(parents=True, exist_ok=True)
+                    chroma_settings.is_persistent = True
+                    chroma_settings.persist_directory = str(PERSIST_DIR)
+                    client = chromadb.Client(chroma_settings)
+                else:
+                    raise RuntimeError(f"Unknown VECTOR_MODE {settings.VECTOR_MODE!r}")
+                _client = client
+    return _client
 
-_client = chromadb.Client(Settings(
-    is_persistent=True,
-    persist_directory=str(PERSIST_DIR)
-))
 
 def get_collection():
-    # single collection; we scope by user_id in metadata
-    return _client.get_or_create_collection(
-        name="bk_chunks",
-        metadata={"hnsw:space": "cosine"},
-    )
+    # single collection; we scope by user_id in metadata. The handle is cached:
+    # in http mode get_or_create would otherwise be an extra round trip per request
+    global _collection
+    if _collection is None:
+        col = get_client().get_or_create_collection(
+            name=COLLECTION,
+            metadata={"hnsw:space": "cosine"},
+        )
+        _collection = col
+    return _collection
+
+
+def get_doc_collection():
+    global _doc_collection
+    if _doc_collection is None:
+        col = get_client().get_or_create_collection(
+            name=DOC_COLLECTION,
+            metadata={"hnsw:space": "cosine"},
+        )
+        _doc_collection = col
+    return _doc_collection
+
+
+def reset_client() -> None:
+    """Drop the cached client/collections (after a restore, or a vector service restart)."""
+    global _client, _collection, _doc_collection
+    with _lock:
+        _client = _collection = _doc_collection = None
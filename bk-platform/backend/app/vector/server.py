@@ -0,0 +1,107 @@
+# app/vector/server.py
+"""
+The vector service: one process that owns the Chroma index under VECTOR_PATH
+and serves it over HTTP, so any number of API workers (VECTOR_MODE=http) can
+share it.
+
+    python -m app.vector.server                      # VECTOR_PATH on VECTOR_HOST:VECTOR_PORT
+    python -m app.vector.server --path /data/vectors --port 8001
+
+`VectorServer` runs the same thing as a child process for tests and for
+serve.py: start() returns once the service answers its heartbeat.
+"""
+from __future__ import annotations
+from pathlib import Path
+from typing import Optional
+import argparse
+import os
+import socket
+import subprocess
+import sys
+import time
+
+import httpx
+
+from app.core.config import settings
+
+BACKEND_ROOT = Path(__file__).resolve().parents[2]
+
+
+def _free_port(host: str) -> int:
+    with socket.socket() as s:
+        s.bind((host, 0))
+        return s.getsockname()[1]
+
+
+class VectorServer:
+    def __init__(self, path: Optional[str] = None, host: Optional[str] = None, port: Optional[int] = None):
+        self.path = str(Path(path or settings.VECTOR_PATH).resolve())
+        self.host = host or settings.VECTOR_HOST
+        self.port = port if port is not None else settings.VECTOR_PORT
+        self.proc: Optional[subprocess.Popen] = None
+
+    @property
+    def url(self) -> str:
+        return f"http://{self.host}:{self.port}"
+
+    def start(self, timeout: float = 60.0) -> "VectorServer":
+        if not self.port:
+            self.port = _free_port(self.host)
+        self.proc = subprocess.Popen(
+            [sys.executable, "-m", "app.vector.server", "--path", self.path,
+             "--host", self.host, "--port", str(self.port)],
+            # same cwd (and so the same .env) as the caller; the app package from here
+            env={**os.environ, "PYTHONPATH": os.pathsep.join(
+                p for p in (str(BACKEND_ROOT), os.environ.get("PYTHONPATH")) if p)},
+        )
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if self.proc.poll() is not None:
+                raise RuntimeError(f"vector service exited with code {self.proc.returncode}")
+            try:
+                if httpx.get(f"{self.url}/api/v1/heartbeat", timeout=1.0).status_code == 200:
+                    return self
+            except httpx.HTTPError:
+                pass
+            time.sleep(0.2)
+        self.stop()
+        raise RuntimeError(f"vector service did not come up on {self.url} within {timeout:.0f}s")
+
+    def stop(self) -> None:
+        if self.proc and self.proc.poll() is None:
+            self.proc.terminate()
+            try:
+                self.proc.wait(timeout=15)
+            except subprocess.TimeoutExpired:
+                self.proc.kill()
+                self.proc.wait()
+        self.proc = None
+
+    def __enter__(self) -> "VectorServer":
+        return self.start()
+
+    def __exit__(self, *exc) -> None:
+        self.stop()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Serve the Chroma index to the API workers")
+    parser.add_argument("--path", default=settings.VECTOR_PATH)
+    parser.add_argument("--host", default=settings.VECTOR_HOST)
+    parser.add_argument("--port", type=int, default=settings.VECTOR_PORT)
+    args = parser.parse_args()
+
+    import uvicorn
+
+    Path(args.path).mkdir(parents=True, exist_ok=True)
+    # chromadb.app reads its settings from the environment
+    os.environ["IS_PERSISTENT"] = "True"
+    os.environ["PERSIST_DIRECTORY"] = str(Path(args.path).resolve())
+    os.environ["ANONYMIZED_TELEMETRY"] = "False"
+    # one process owns the index: a single worker is the point
+    uvicorn.run("chromadb.app:app", host=args.host, port=args.port, workers=1,
+                timeout_keep_alive=30, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
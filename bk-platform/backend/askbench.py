@@ -0,0 +1,79 @@
+# askbench.py
+# /api/knowledge/ask throughput and latency against an offline LLM provider,
+# so the numbers are the app's own overhead (embedding, Chroma, packing,
+# router queueing) rather than a remote model's.
+#
+#   python askbench.py                                   # stub provider, 200 requests, 16 concurrent
+#   python askbench.py --provider replay --requests 1000 --concurrency 64
+#   STUB_LLM_LATENCY_MS=300 STUB_LLM_TOKENS_PER_SECOND=30 python askbench.py
+#
+# Uses DATABASE_URL from .env, registering a throwaway bench user with one document.
+import argparse
+import asyncio
+import time
+import uuid
+
+import httpx
+
+from app.main import app
+
+DOC = (
+    "Invoice number: INV-2231\nVendor: ACME Corp\nTotal amount: $450.00\n"
+    "Payment terms: net 30 days. Delivery address: 12 Harbour Road.\n"
+) * 20
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Ask throughput with a stub/replay LLM provider")
+    parser.add_argument("--provider", default="stub", choices=["stub", "replay"])
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--question", default="What is the invoice number?")
+    args = parser.parse_args()
+
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+        email, pw = f"bench-{uuid.uuid4().hex[:8]}@example.com", "bench-password"
+        await client.post("/api/auth/register", json={"email": email, "password": pw})
+        r = await client.post("/api/auth/login", json={"email": email, "password": pw})
+        r.raise_for_status()
+        headers = {"Authorization": f"Bearer {r.json()['access_token']}"}
+        r = await client.post("/api/documents/upload", headers=headers,
+                              files={"file": ("bench.txt", DOC.encode(), "text/plain")})
+        r.raise_for_status()
+
+        body = {"question": args.question, "provider": args.provider}
+        sem = asyncio.Semaphore(args.concurrency)
+        latencies, failures = [], 0
+
+        async def one():
+            nonlocal failures
+            async with sem:
+                t = time.perf_counter()
+                r = await client.post("/api/knowledge/ask", json=body, headers=headers)
+                latencies.append(time.perf_counter() - t)
+                if r.status_code != 200:
+                    failures += 1
+
+        await one()  # warm-up: model load, stub start, caches
+        latencies.clear()
+        t0 = time.perf_counter()
+        await asyncio.gather(*(one() for _ in range(args.requests)))
+        elapsed = time.perf_counter() - t0
+        llm = (await client.get("/api/analytics/metrics", headers=headers)).json().get("llm", {})
+
+    latencies.sort()
+    pct = lambda p: latencies[min(len(latencies) - 1, int(p * len(latencies)))] * 1000
+    print(f"\nPOST /api/knowledge/ask  provider={args.provider} requests={args.requests} "
+          f"concurrency={args.concurrency}")
+    print(f"  throughput   {args.requests / elapsed:8.1f} req/s")
+    print(f"  latency p50  {pct(0.50):8.1f} ms")
+    print(f"  latency p95  {pct(0.95):8.1f} ms")
+    print(f"  latency p99  {pct(0.99):8.1f} ms")
+    if failures:
+        print(f"  ! {failures} non-200 responses")
+    print(f"  router       {llm.get(args.provider)}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,72 @@
+# authbench.py
+# Authenticated requests/second against the app in-process (no network), with
+# the user cache off ("before") and on ("after").
+#
+#   python authbench.py                      # GET /api/auth/profile, 2000 requests, 32 concurrent
+#   python authbench.py --path /api/documents --requests 5000 --concurrency 64
+#
+# Uses DATABASE_URL from .env, registering a throwaway bench user if needed.
+import argparse
+import asyncio
+import time
+import uuid
+
+import httpx
+
+from app.main import app
+from app.api import auth
+
+
+async def run(path: str, total: int, concurrency: int, headers: dict) -> float:
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        sem = asyncio.Semaphore(concurrency)
+        failures = 0
+
+        async def one():
+            nonlocal failures
+            async with sem:
+                r = await client.get(path, headers=headers)
+                if r.status_code != 200:
+                    failures += 1
+
+        await one()  # warm-up (and cache fill when enabled)
+        t0 = time.perf_counter()
+        await asyncio.gather(*(one() for _ in range(total)))
+        elapsed = time.perf_counter() - t0
+    if failures:
+        print(f"  ! {failures} non-200 responses")
+    return total / elapsed
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Authenticated request throughput, user cache off vs on")
+    parser.add_argument("--path", default="/api/auth/profile")
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=32)
+    args = parser.parse_args()
+
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        email, pw = f"bench-{uuid.uuid4().hex[:8]}@example.com", "bench-password"
+        await client.post("/api/auth/register", json={"email": email, "password": pw})
+        r = await client.post("/api/auth/login", json={"email": email, "password": pw})
+        r.raise_for_status()
+        headers = {"Authorization": f"Bearer {r.json()['access_token']}"}
+
+    ttl = auth.user_cache.ttl or 60
+    results = {}
+    for label, cache_ttl in (("before (no user cache)", 0), ("after (user cache)", ttl)):
+        auth.user_cache.ttl = cache_ttl
+        auth.user_cache._items.clear()
+        results[label] = await run(args.path, args.requests, args.concurrency, headers)
+
+    print(f"\nGET {args.path}  requests={args.requests} concurrency={args.concurrency}")
+    for label, rps in results.items():
+        print(f"  {label:<24} {rps:8.0f} req/s")
+    base = results["before (no user cache)"]
+    print(f"  speedup                  {results['after (user cache)'] / base:8.2f}x")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
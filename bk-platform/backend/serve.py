@@ -0,0 +1,53 @@
+# serve.py
+# Multi-worker deployment on one node: starts the vector service (the only
+# process that opens the Chroma index), then N uvicorn API workers that reach
+# it over HTTP (VECTOR_MODE=http). With EMBED_MODE=sidecar the embedding model
+# is loaded once, in a sidecar the workers reach over EMBED_SOCKET.
+#
+#   python serve.py                         # one worker per core on :8000
+#   python serve.py --workers 4 --port 8080
+#   python serve.py --no-vector-service     # VECTOR_HOST/VECTOR_PORT already serve the index
+#
+# With SQLite every worker shares bk.db (WAL); use Postgres for heavy write loads.
+import argparse
+import os
+
+import uvicorn
+
+from app.core.config import settings
+from app.services.embed_sidecar import SidecarProcess
+from app.vector.server import VectorServer
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run N API workers against one vector service")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--no-vector-service", action="store_true", help="Don't start the vector service here")
+    args = parser.parse_args()
+
+    vector = None if args.no_vector_service else VectorServer().start()
+    sidecar = None
+    try:
+        sidecar = SidecarProcess().start() if settings.EMBED_MODE == "sidecar" else None
+        # inherited by the workers uvicorn spawns
+        os.environ["VECTOR_MODE"] = "http"
+        os.environ["VECTOR_HOST"] = settings.VECTOR_HOST
+        os.environ["VECTOR_PORT"] = str(vector.port if vector else settings.VECTOR_PORT)
+        if sidecar:
+            os.environ["EMBED_SOCKET"] = sidecar.path
+        # create tables once here rather than racing N workers through init_db()
+        from app.db import init_db
+        init_db()
+        os.environ["INIT_DB_ON_STARTUP"] = "false"
+        uvicorn.run("app.main:app", host=args.host, port=args.port, workers=args.workers)
+    finally:
+        if sidecar:
+            sidecar.stop()
+        if vector:
+            vector.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,26 @@
+# Shared fixtures. Run from bk-platform/backend: python -m pytest -q tests
+import os
+
+os.environ.setdefault("SECRET_KEY", "test")
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from app.db import Base
+import app.models  # noqa: F401  (registers every table with Base)
+
+
+@pytest.fixture
+def session_factory(tmp_path):
+    """Sessions on a throwaway SQLite file with every table created (never the configured DATABASE_URL)."""
+    engine = create_engine(f"sqlite:///{tmp_path / 'test.db'}", future=True)
+    Base.metadata.create_all(engine)
+    yield sessionmaker(bind=engine, autocommit=False, autoflush=False, future=True)
+    engine.dispose()
+
+
+@pytest.fixture
+def db(session_factory):
+    with session_factory() as session:
+        yield session
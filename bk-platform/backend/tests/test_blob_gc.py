@@ -0,0 +1,56 @@
+# Deferred blob deletion (app/services/files.py sweep_blobs).
+# Run from bk-platform/backend: python -m pytest -q tests
+import gzip
+
+import pytest
+
+import app.db
+from app.core.config import settings
+from app.models.document import Document
+from app.services import files, text_cache
+
+
+@pytest.fixture
+def store(tmp_path, session_factory, monkeypatch):
+    monkeypatch.setattr(settings, "BLOB_ROOT", str(tmp_path / "blobs"))
+    monkeypatch.setattr(settings, "BLOB_BACKEND", "local")
+    monkeypatch.setattr(files, "_store", None)
+    monkeypatch.setattr(app.db, "SessionLocal", session_factory)
+    monkeypatch.setattr(text_cache, "EXTRACTOR_VERSION", "3")
+    return files.get_blob_store()
+
+
+def _document(db, ref):
+    d = Document(user_id=1, filename="f.txt", path=ref, size=1, mime_type="text/plain", metadata_json={})
+    db.add(d)
+    db.commit()
+    return d
+
+
+def test_sweep_deletes_blob_and_its_text_cache(db, store):
+    ref = files.put_blob(b"some bytes", "f.bin", "application/octet-stream")
+    digest = files.blob_digest(ref)
+    keys = [text_cache.text_key(digest, v) for v in ("1", "2", "3")]
+    for key in keys:
+        store.put(key, gzip.compress(b"text"))
+
+    d = _document(db, ref)
+    files.queue_blob_delete(db, ref)
+    db.delete(d)
+    db.commit()
+
+    assert files.sweep_blobs(grace_seconds=0) == 1
+    assert not store.exists(ref[len(files.BLOB_REF_PREFIX):])
+    assert not any(store.exists(k) for k in keys)
+
+
+def test_sweep_keeps_a_referenced_blob_and_its_text_cache(db, store):
+    ref = files.put_blob(b"shared bytes", "f.bin", "application/octet-stream")
+    key = text_cache.text_key(files.blob_digest(ref))
+    store.put(key, gzip.compress(b"text"))
+    _document(db, ref)  # another document still uses the blob
+    files.queue_blob_delete(db, ref)
+    db.commit()
+
+    assert files.sweep_blobs(grace_seconds=0) == 0
+    assert store.exists(ref[len(files.BLOB_REF_PREFIX):]) and store.exists(key)
@@ -0,0 +1,92 @@
+# Tokenizer loading and context packing (app/services/context.py).
+# Run from bk-platform/backend: python -m pytest -q tests
+import os
+import threading
+
+os.environ.setdefault("SECRET_KEY", "test")
+
+import pytest
+
+from app.core.config import settings
+from app.services import context
+
+
+@pytest.fixture
+def loader(monkeypatch):
+    """Replace the real loader; `result` decides whether the next load succeeds."""
+    state = {"calls": 0, "result": None, "done": threading.Event()}
+
+    def load(provider, model):
+        state["calls"] += 1
+        try:
+            return state["result"]
+        finally:
+            state["done"].set()
+
+    monkeypatch.setattr(context, "_load_tokenizer", load)
+    monkeypatch.setattr(context, "_tokenizers", {})
+    monkeypatch.setattr(context, "_loading", set())
+    monkeypatch.setattr(context, "_failed_at", {})
+    return state
+
+
+def _wait_load(state):
+    assert state["done"].wait(5)
+    state["done"].clear()
+    for t in threading.enumerate():
+        if t.name == "tokenizer-load":
+            t.join(5)
+
+
+def test_tokenizer_loads_off_the_request_path(loader):
+    loader["result"] = lambda s: s.split()
+    counter = context.TokenCounter("openai", "gpt-x")
+    assert not counter.exact  # first request counts with the heuristic
+    _wait_load(loader)
+    counter = context.TokenCounter("openai", "gpt-x")
+    assert counter.exact and counter.count("a b c") == 3
+    assert loader["calls"] == 1
+
+
+def test_failed_load_is_retried_after_backoff(loader, monkeypatch):
+    monkeypatch.setattr(settings, "TOKENIZER_RETRY_SECONDS", 3600)
+    context.TokenCounter("hf", "org/gated")
+    _wait_load(loader)
+    context.TokenCounter("hf", "org/gated")
+    assert loader["calls"] == 1  # still backing off
+
+    monkeypatch.setattr(settings, "TOKENIZER_RETRY_SECONDS", 0)
+    loader["result"] = lambda s: list(s)
+    context.TokenCounter("hf", "org/gated")
+    _wait_load(loader)
+    assert loader["calls"] == 2
+    assert context.TokenCounter("hf", "org/gated").exact
+
+
+def test_ollama_never_loads(loader):
+    assert not context.TokenCounter("ollama", "llama3").exact
+    assert loader["calls"] == 0
+
+
+def _chunk(doc, idx, content):
+    return {"document_id": doc, "chunk_index": idx, "filename": f"d{doc}.txt", "content": content}
+
+
+def test_skipped_block_does_not_hide_its_lines(loader):
+    counter = context.TokenCounter("ollama", "")
+    shared = "Shared disclaimer line for every page"
+    big = _chunk(1, 0, shared + "\n" + "x" * 4000)
+    small = _chunk(2, 0, shared + "\nshort answer")
+    packed = context.pack_context([big, small], token_limit=30, counter=counter)
+    # the first block can't fit even trimmed; the second keeps the shared line
+    assert "[d1.txt" not in packed
+    assert shared in packed
+
+
+def test_emitted_lines_are_dropped_later(loader):
+    counter = context.TokenCounter("ollama", "")
+    shared = "Shared disclaimer line for every page"
+    packed = context.pack_context(
+        [_chunk(1, 0, shared + "\nfirst"), _chunk(2, 0, shared + "\nsecond")], token_limit=1000, counter=counter,
+    )
+    assert packed.count(shared) == 1
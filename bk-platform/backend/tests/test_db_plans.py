@@ -0,0 +1,78 @@
+# The hot queries must be served by indexes, not full table scans, once
+# init_db (create_all + migrations) has run. Uses a throwaway SQLite file.
+# Run from bk-platform/backend: python -m pytest -q tests
+import os
+
+os.environ.setdefault("SECRET_KEY", "test")
+
+import pytest
+from sqlalchemy import create_engine, or_, select, text, tuple_
+
+from app.db import Base, init_db
+from app.models.chat import ChatMessage
+from app.models.chunk import ChunkFingerprint, DocumentChunk
+from app.models.document import Document
+from app.models.outbox import VectorOutbox
+
+# name -> statement, mirroring what the API runs per request
+HOT_QUERIES = {
+    "list documents for user": (
+        select(Document).where(Document.user_id == 1).order_by(Document.id.desc())
+    ),
+    "document by id for user": (
+        select(Document).where(Document.id == 1, Document.user_id == 1)
+    ),
+    "has_text / first chunk of document": (
+        select(DocumentChunk).where(DocumentChunk.document_id == 1)
+        .order_by(DocumentChunk.position.asc()).limit(1)
+    ),
+    "chunks of document in order": (
+        select(DocumentChunk).where(DocumentChunk.document_id == 1).order_by(DocumentChunk.position.asc())
+    ),
+    "chat messages of session": (
+        select(ChatMessage).where(ChatMessage.session_id == 1).order_by(ChatMessage.id.asc())
+    ),
+    "outbox entries of document": (
+        select(VectorOutbox.status).where(VectorOutbox.document_id == 1).order_by(VectorOutbox.id.desc())
+    ),
+    "duplicate lookup by term set": (
+        select(ChunkFingerprint.document_id, ChunkFingerprint.position)
+        .where(ChunkFingerprint.user_id == 1, ChunkFingerprint.canonical_document_id.is_(None),
+               ChunkFingerprint.terms_hash.in_([1, 2]))
+    ),
+    "near-duplicate lookup by bands": (
+        select(ChunkFingerprint.simhash)
+        .where(ChunkFingerprint.user_id == 1, or_(ChunkFingerprint.band0.in_([1]), ChunkFingerprint.band1.in_([2]),
+                                                  ChunkFingerprint.band2.in_([3]), ChunkFingerprint.band3.in_([4])))
+    ),
+    "fingerprints of page chunks": (
+        select(ChunkFingerprint.simhash)
+        .where(ChunkFingerprint.document_id.in_([1, 2]),
+               tuple_(ChunkFingerprint.document_id, ChunkFingerprint.position).in_([(1, 0), (2, 3)]))
+    ),
+    "copies linked to page chunks": (
+        select(ChunkFingerprint.document_id)
+        .where(ChunkFingerprint.canonical_document_id.in_([1, 2]),
+               tuple_(ChunkFingerprint.canonical_document_id, ChunkFingerprint.canonical_position).in_([(1, 0)]))
+    ),
+}
+TABLES = set(Base.metadata.tables)
+
+
+@pytest.fixture(scope="module")
+def engine(tmp_path_factory):
+    eng = create_engine(f"sqlite:///{tmp_path_factory.mktemp('plans') / 'plans.db'}", future=True)
+    init_db(eng)
+    yield eng
+    eng.dispose()
+
+
+@pytest.mark.parametrize("name", sorted(HOT_QUERIES))
+def test_hot_query_uses_an_index(engine, name):
+    sql = str(HOT_QUERIES[name].compile(engine, compile_kwargs={"literal_binds": True}))
+    with engine.connect() as conn:
+        plan = [row[-1] for row in conn.execute(text(f"EXPLAIN QUERY PLAN {sql}"))]
+    # "SCAN <table>" is a full scan; "SEARCH <table> USING INDEX ..." is what we want
+    # ("SCAN CONSTANT ROW" is the literal IN list, not a table)
+    scans = [line for line in plan if line.startswith("SCAN ") and line.split()[1] in TABLES]
+    assert not scans, f"{name}: {plan}"
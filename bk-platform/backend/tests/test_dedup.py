@@ -0,0 +1,124 @@
+# Duplicate-chunk linking at ingest, promotion on delete, and the outbox skip (app/services/dedup.py).
+# Run from bk-platform/backend: python -m pytest -q tests
+import random
+
+import pytest
+
+from app.core.config import settings
+from app.models.chunk import ChunkFingerprint, DocumentChunk
+from app.models.document import Document
+from app.models.outbox import VectorOutbox
+from app.services import dedup, outbox
+
+BOILERPLATE = (
+    "ACME Corp, 1 Main Street, Springfield. Registered in England no. 123456. "
+    "Payment is due within thirty days of the invoice date. Thank you for your business."
+)
+
+
+@pytest.fixture(autouse=True)
+def enabled(monkeypatch):
+    monkeypatch.setattr(settings, "DEDUP_ENABLED", True)
+    monkeypatch.setattr(settings, "DEDUP_MIN_CHARS", 80)
+    monkeypatch.setattr(settings, "DEDUP_MAX_HAMMING", 3)
+
+
+def _doc(db, user_id=1, name="d.txt"):
+    d = Document(user_id=user_id, filename=name, path=f"blob:{name}", size=1, mime_type="text/plain", metadata_json={})
+    db.add(d)
+    db.commit()
+    return d.id
+
+
+def _ingest(db, doc_id, chunks, user_id=1):
+    for i, ch in enumerate(chunks):
+        db.add(DocumentChunk(document_id=doc_id, content=ch, position=i))
+    linked = dedup.fingerprint_window(db, chunks=chunks, document_id=doc_id, user_id=user_id, start=0)
+    db.commit()
+    return linked
+
+
+def _links(db, doc_id):
+    return [
+        (fp.position, fp.canonical_document_id, fp.canonical_position)
+        for fp in db.query(ChunkFingerprint).filter(ChunkFingerprint.document_id == doc_id)
+        .order_by(ChunkFingerprint.position)
+    ]
+
+
+def test_same_term_set_is_linked(db):
+    a, b = _doc(db, name="a"), _doc(db, name="b")
+    assert _ingest(db, a, [BOILERPLATE, "first document body " * 6]) == 0
+    assert _ingest(db, b, ["  " + BOILERPLATE.upper(), "second document body " * 6]) == 1
+    assert _links(db, b) == [(0, a, 0), (1, None, None)]
+
+
+def test_copies_inside_one_document_are_linked(db):
+    a = _doc(db)
+    assert _ingest(db, a, [BOILERPLATE, "body text " * 12, BOILERPLATE]) == 1
+    assert _links(db, a)[2] == (2, a, 0)
+
+
+def test_chunks_that_differ_in_one_number_are_not_linked(db):
+    # SimHash puts many of these within 3 bits of each other; the keyword gate
+    # still tells them apart, so each needs a vector of its own
+    template = "Invoice number: INV-{n}. Total amount due 450.00 for consulting services rendered. " + BOILERPLATE
+    for n in random.Random(7).sample(range(1000, 10000), 40):
+        assert _ingest(db, _doc(db), [template.format(n=n)]) == 0
+
+
+def test_short_chunks_and_other_users_are_never_linked(db):
+    a, b, c = _doc(db), _doc(db), _doc(db, user_id=2)
+    _ingest(db, a, ["Page 1", BOILERPLATE])
+    assert _ingest(db, b, ["Page 1"]) == 0
+    assert _ingest(db, c, [BOILERPLATE], user_id=2) == 0
+
+
+def test_release_document_promotes_first_copy(db):
+    a, b, c = _doc(db, name="a"), _doc(db, name="b"), _doc(db, name="c")
+    for d in (a, b, c):
+        _ingest(db, d, [BOILERPLATE])
+    assert _links(db, c) == [(0, a, 0)]
+
+    assert dedup.release_document(db, a) == [b]
+    db.commit()
+    assert _links(db, a) == []
+    assert _links(db, b) == [(0, None, None)]
+    assert _links(db, c) == [(0, b, 0)]
+    assert [o.document_id for o in db.query(VectorOutbox)] == [b]
+
+
+def test_duplicates_of_reports_copies_and_near_duplicates(db):
+    a, b = _doc(db), _doc(db)
+    _ingest(db, a, [BOILERPLATE])
+    _ingest(db, b, [BOILERPLATE, "unrelated text about something else entirely " * 3])
+    # a near-duplicate by SimHash (two bits apart) that has its own vector
+    h = dedup._to_unsigned(db.query(ChunkFingerprint.simhash).filter_by(document_id=a, position=0).scalar()) ^ 0b101
+    row = db.query(ChunkFingerprint).filter_by(document_id=b, position=1).one()
+    row.simhash = dedup._to_signed(h)
+    row.band0, row.band1, row.band2, row.band3 = dedup.bands(h)
+    db.commit()
+    assert dedup.duplicates_of(db, 1, [(a, 0)]) == {(a, 0): [(b, 0), (b, 1)]}
+
+
+def test_outbox_skips_linked_chunks(db, session_factory, monkeypatch):
+    a, b = _doc(db, name="a"), _doc(db, name="b")
+    _ingest(db, a, [BOILERPLATE])
+    _ingest(db, b, [BOILERPLATE, "the only text of b worth its own vector " * 3])
+    entry = VectorOutbox(document_id=b, user_id=1, filename="b", status="processing", attempts=1)
+    db.add(entry)
+    db.commit()
+
+    upserted = []
+
+    class Collection:
+        def upsert(self, ids, documents, embeddings, metadatas):
+            upserted.extend(ids)
+
+    monkeypatch.setattr(outbox, "SessionLocal", session_factory)
+    monkeypatch.setattr(outbox, "get_collection", lambda: Collection())
+    monkeypatch.setattr(outbox, "embed_texts", lambda texts: [[1.0, 0.0] for _ in texts])
+    monkeypatch.setattr(outbox, "upsert_centroids", lambda docs: None)
+
+    assert outbox._drain([entry], db)
+    assert upserted == [outbox.chunk_vector_id(b, 1)]
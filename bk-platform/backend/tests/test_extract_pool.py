@@ -0,0 +1,38 @@
+# Extraction worker pool (app/services/extract_pool.py).
+# Run from bk-platform/backend: python -m pytest -q tests
+import os
+
+os.environ.setdefault("SECRET_KEY", "test")
+
+import pytest
+
+from app.services.extract_pool import ExtractPool, ExtractionError
+
+
+@pytest.fixture
+def pool():
+    p = ExtractPool(size=1, timeout=60, max_rss_mb=0, max_jobs=100)
+    p.start()
+    yield p
+    p.close()
+
+
+def test_err_reply_keeps_the_worker(pool):
+    # the parsers swallow most errors themselves; a non-string name still raises
+    # in the worker and comes back as an ordinary "err" reply
+    with pytest.raises(ExtractionError):
+        pool.extract(b"data", 42, None)
+    assert pool.stats()["failures"] == 1
+    assert pool.stats()["idle"] == 1
+
+    assert pool.extract(b"hello there", "note.txt", "text/plain").strip() == "hello there"
+    assert pool.stats()["spawned"] == 1  # the same worker served both jobs
+
+
+def test_dead_worker_is_replaced(pool):
+    pool.extract(b"first", "a.txt", "text/plain")
+    worker = pool._idle.get_nowait()
+    worker.stop(graceful=False)
+    pool._idle.put(worker)
+    assert pool.extract(b"second", "b.txt", "text/plain").strip() == "second"
+    assert pool.stats()["spawned"] == 2
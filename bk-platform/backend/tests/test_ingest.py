@@ -0,0 +1,89 @@
+# Streamed chunking and windowed ingest (app/services/chunking.py, app/services/ingest.py).
+# Run from bk-platform/backend: python -m pytest -q tests
+import random
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from app.core.config import settings
+from app.models.chunk import DocumentChunk
+from app.models.document import Document
+from app.models.outbox import VectorOutbox
+from app.services import outbox
+from app.services.chunking import simple_chunks, stream_chunks
+from app.services.ingest import ingest_chunks_for_document
+
+
+def _pieces(text, rnd):
+    i = 0
+    while i < len(text):
+        n = rnd.choice([1, 7, 64, 999, 1000, 1001, 4096])
+        yield text[i:i + n]
+        i += n
+
+
+@pytest.mark.parametrize("seed", range(40))
+def test_stream_chunks_matches_simple_chunks(seed):
+    rnd = random.Random(seed)
+    words = ["alpha", "beta", "gamma", " ", "\n", "  ", "\t", "x" * 50]
+    text = "".join(rnd.choice(words) for _ in range(rnd.randint(0, 3000)))
+    if seed % 4 == 0:
+        text = "   \n" + text + " \n\n  "  # leading/trailing whitespace is stripped
+    size = rnd.choice([50, 200, 1000])
+    overlap = rnd.choice([0, size // 5, size // 2])
+    assert list(stream_chunks(_pieces(text, rnd), size, overlap)) == list(simple_chunks(text, size, overlap))
+
+
+def test_stream_chunks_whitespace_only():
+    assert list(stream_chunks(["   ", "\n\t "])) == list(simple_chunks("   \n\t ")) == []
+
+
+@pytest.fixture
+def doc_id(db, monkeypatch):
+    monkeypatch.setattr(settings, "OUTBOX_INLINE_DRAIN", False)
+    monkeypatch.setattr(settings, "INGEST_WINDOW", 2)
+    d = Document(user_id=1, filename="f.txt", path="blob:f", size=1, mime_type="text/plain", metadata_json={})
+    db.add(d)
+    db.commit()
+    return d.id
+
+
+def test_first_window_commits_its_outbox_row(db, session_factory, doc_id):
+    seen = {}
+
+    def chunks():
+        yield from ["one " * 30, "two " * 30]
+        # the first window is committed by now: what would a crash here leave behind?
+        with session_factory() as other:
+            seen["chunks"] = other.query(DocumentChunk).filter_by(document_id=doc_id).count()
+            seen["status"] = [o.status for o in other.query(VectorOutbox).filter_by(document_id=doc_id)]
+        yield "three " * 30
+
+    assert ingest_chunks_for_document(db, chunks=chunks(), document_id=doc_id, user_id=1, filename="f.txt") == 3
+    assert seen == {"chunks": 2, "status": ["ingesting"]}
+    assert [o.status for o in db.query(VectorOutbox).filter_by(document_id=doc_id)] == ["pending"]
+
+
+def test_drain_picks_up_an_abandoned_ingest(db, session_factory, doc_id):
+    def chunks():
+        yield from ["one " * 30, "two " * 30]
+        raise RuntimeError("decode failed")
+
+    with pytest.raises(RuntimeError):
+        ingest_chunks_for_document(db, chunks=chunks(), document_id=doc_id, user_id=1, filename="f.txt")
+    # an ingest that fails with an exception removes the windows it committed
+    assert db.query(DocumentChunk).filter_by(document_id=doc_id).count() == 0
+    assert db.query(VectorOutbox).filter_by(document_id=doc_id).count() == 0
+
+    # a killed process can't: what it leaves is an "ingesting" row, drained once its claim is stale
+    db.add(DocumentChunk(document_id=doc_id, content="one " * 30, position=0))
+    entry = VectorOutbox(document_id=doc_id, user_id=1, filename="f.txt", status="ingesting",
+                         claimed_at=datetime.now(tz=timezone.utc))
+    db.add(entry)
+    db.commit()
+    assert outbox._candidates(db, 10) == []
+    entry.claimed_at = datetime.now(tz=timezone.utc) - timedelta(seconds=settings.OUTBOX_CLAIM_TIMEOUT_SECONDS + 1)
+    db.commit()
+    assert outbox._candidates(db, 10) == [entry.id]
+    with session_factory() as worker:
+        assert [e.status for e in outbox._claim(worker, [entry.id])] == ["processing"]
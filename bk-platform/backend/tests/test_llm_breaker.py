@@ -0,0 +1,121 @@
+# Circuit breaker state machine of the LLM provider router (app/services/llm.py).
+# Run from bk-platform/backend: python -m pytest -q tests
+import os
+
+os.environ.setdefault("SECRET_KEY", "test")
+
+import httpx
+import pytest
+
+from app.core.config import settings
+from app.services import llm
+
+
+@pytest.fixture
+def router(monkeypatch):
+    monkeypatch.setattr(settings, "LLM_BREAKER_MIN_REQUESTS", 2)
+    monkeypatch.setattr(settings, "LLM_BREAKER_ERROR_RATE", 0.5)
+    monkeypatch.setattr(settings, "LLM_BREAKER_COOLDOWN_SECONDS", 0.0)
+    monkeypatch.setattr(settings, "LLM_FALLBACK_PROVIDER", "")
+    monkeypatch.setattr(settings, "LLM_HEDGE_ENABLED", False)
+    r = llm.ProviderRouter()
+    r.behaviour = {"mode": "ok"}
+
+    def call(messages, model, timeout, max_tokens, prompt_tokens):
+        mode = r.behaviour["mode"]
+        if mode == "fail":
+            raise RuntimeError("provider down")
+        if mode == "client_error":
+            req = httpx.Request("POST", "http://llm/api/chat")
+            resp = httpx.Response(404, request=req)
+            raise RuntimeError("model not found") from httpx.HTTPStatusError("404", request=req, response=resp)
+        if mode == "miss":
+            raise llm.ReplayMiss("no entry")
+        return "ok"
+
+    r.providers["stub"] = llm._Provider("stub", 1, call)
+    return r
+
+
+def _chat(router, **kw):
+    return router.chat([{"role": "user", "content": "hi"}], provider="stub", **kw)
+
+
+def _open(router):
+    router.behaviour["mode"] = "fail"
+    for _ in range(2):
+        with pytest.raises(RuntimeError):
+            _chat(router)
+    assert router.providers["stub"].breaker.state == "open"
+
+
+def test_errors_open_and_successful_probe_closes(router):
+    _open(router)
+    router.behaviour["mode"] = "ok"
+    assert _chat(router) == "ok"  # cooldown 0: this call is the half-open probe
+    assert router.providers["stub"].breaker.state == "closed"
+
+
+def test_failed_probe_reopens(router):
+    _open(router)
+    with pytest.raises(RuntimeError):
+        _chat(router)
+    assert router.providers["stub"].breaker.state == "open"
+
+
+def test_probe_without_slot_does_not_wedge_half_open(router):
+    _open(router)
+    p = router.providers["stub"]
+    router.behaviour["mode"] = "ok"
+    assert p.slots.acquire(timeout=1)  # exhaust the only slot
+    try:
+        with pytest.raises(llm.DeadlineExceeded):
+            _chat(router, deadline_seconds=0.2)
+    finally:
+        p.slots.release()
+    assert not p.breaker.probing
+    assert _chat(router) == "ok"
+    assert p.breaker.state == "closed"
+
+
+def test_replay_miss_releases_probe(router):
+    _open(router)
+    router.behaviour["mode"] = "miss"
+    with pytest.raises(llm.ReplayMiss):
+        _chat(router)
+    assert not router.providers["stub"].breaker.probing
+    router.behaviour["mode"] = "ok"
+    assert _chat(router) == "ok"
+
+
+def test_client_errors_do_not_open_the_circuit(router):
+    router.behaviour["mode"] = "client_error"
+    for _ in range(5):
+        with pytest.raises(RuntimeError):
+            _chat(router)
+    assert router.providers["stub"].breaker.state == "closed"
+
+
+def test_only_one_probe_at_a_time(router):
+    _open(router)
+    b = router.providers["stub"].breaker
+    probe = b.allow()
+    assert probe is not None and probe.probe
+    assert b.allow() is None
+    b.release_probe(probe)
+    assert b.allow().probe
+
+
+def test_only_the_probe_owner_releases_it(router):
+    b = router.providers["stub"].breaker
+    early = b.allow()  # admitted while closed, still in flight when the circuit opens
+    assert not early.probe
+    _open(router)
+    probe = b.allow()
+    assert probe.probe
+    b.release_probe(early)  # e.g. the early call hit a client error
+    assert b.probing and b.allow() is None
+    b.record(True, 0.01, early)  # a late success does not close the circuit either
+    assert b.state == "half_open" and b.probing
+    b.record(True, 0.01, probe)
+    assert b.state == "closed" and not b.probing
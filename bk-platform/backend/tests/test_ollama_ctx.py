@@ -0,0 +1,46 @@
+# Ollama num_ctx sizing (app/services/llm.py).
+# Run from bk-platform/backend: python -m pytest -q tests
+import json
+import os
+
+os.environ.setdefault("SECRET_KEY", "test")
+
+import httpx
+import pytest
+
+from app.core.config import settings
+from app.services import llm
+
+
+def test_caller_token_count_sizes_the_window(monkeypatch):
+    monkeypatch.setattr(settings, "OLLAMA_NUM_CTX_MAX", 32768)
+    msgs = [{"role": "user", "content": "x" * 7000}]  # ~2000 tokens by the chars estimate
+    assert llm.ollama_num_ctx(msgs, 100) == 4096
+    assert llm.ollama_num_ctx(msgs, 100, prompt_tokens=1000) == 2048
+    assert llm.ollama_num_ctx(msgs, 100, prompt_tokens=6000) == 8192
+
+
+@pytest.fixture
+def sent(monkeypatch):
+    """Captures the num_ctx of each request _ollama_chat sends (no server involved)."""
+    out = []
+
+    def handler(request):
+        out.append(json.loads(request.content)["options"]["num_ctx"])
+        return httpx.Response(200, json={"message": {"content": "ok"}})
+
+    real = httpx.Client
+    monkeypatch.setattr(llm.httpx, "Client", lambda **kw: real(transport=httpx.MockTransport(handler), **kw))
+    monkeypatch.setattr(llm, "_ollama_ctx", {})
+    monkeypatch.setattr(settings, "OLLAMA_NUM_CTX_MAX", 32768)
+    return out
+
+
+def test_loaded_bucket_is_sticky(sent):
+    msgs = [{"role": "user", "content": "hi"}]
+    for tokens in (100, 3000, 100, 7000, 100):
+        llm._ollama_chat(msgs, model="m", base="http://ollama", max_tokens=50, prompt_tokens=tokens)
+    # grows when a prompt needs it, never shrinks back (each change is a model reload)
+    assert sent == [2048, 4096, 4096, 8192, 8192]
+    llm._ollama_chat(msgs, model="other", base="http://ollama", max_tokens=50, prompt_tokens=100)
+    assert sent[-1] == 2048  # per model
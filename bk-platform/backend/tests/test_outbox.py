@@ -0,0 +1,61 @@
+# Vector outbox drain failures (app/services/outbox.py).
+# Run from bk-platform/backend: python -m pytest -q tests
+import pytest
+
+from app.core.config import settings
+from app.models.chunk import DocumentChunk
+from app.models.document import Document
+from app.models.outbox import VectorOutbox
+from app.services import outbox
+
+
+@pytest.fixture
+def store(session_factory, monkeypatch):
+    upserted = []
+
+    class Collection:
+        def upsert(self, ids, documents, embeddings, metadatas):
+            upserted.extend(ids)
+
+    def embed(texts):
+        if any("poison" in t for t in texts):
+            raise ValueError("input too long")
+        return [[1.0, 0.0] for _ in texts]
+
+    monkeypatch.setattr(outbox, "SessionLocal", session_factory)
+    monkeypatch.setattr(outbox, "get_collection", lambda: Collection())
+    monkeypatch.setattr(outbox, "embed_texts", embed)
+    monkeypatch.setattr(outbox, "upsert_centroids", lambda docs: None)
+    monkeypatch.setattr(settings, "OUTBOX_MAX_ATTEMPTS", 2)
+    return upserted
+
+
+def _queue(db, text):
+    d = Document(user_id=1, filename="f.txt", path="blob:f", size=1, mime_type="text/plain", metadata_json={})
+    db.add(d)
+    db.commit()
+    db.add(DocumentChunk(document_id=d.id, content=text, position=0))
+    db.add(VectorOutbox(document_id=d.id, user_id=1, filename="f.txt"))
+    db.commit()
+    return d.id
+
+
+def _status(session_factory):
+    with session_factory() as s:
+        return {o.document_id: (o.status, o.attempts, o.last_error) for o in s.query(VectorOutbox)}
+
+
+def test_one_bad_document_does_not_fail_the_batch(db, session_factory, store):
+    good1, bad, good2 = _queue(db, "fine text"), _queue(db, "poison chunk"), _queue(db, "more fine text")
+
+    assert outbox.drain_once() == 2
+    st = _status(session_factory)
+    assert st[good1][0] == st[good2][0] == "done"
+    assert st[bad] == ("pending", 1, "input too long")
+    assert sorted(store) == sorted(outbox.chunk_vector_id(d, 0) for d in (good1, good2))
+
+    # only the bad entry is retried, and only it runs out of attempts
+    assert outbox.drain_once() == 0
+    st = _status(session_factory)
+    assert st[bad][:2] == ("failed", 2)
+    assert st[good1][:2] == st[good2][:2] == ("done", 1)
@@ -0,0 +1,80 @@
+# Background loading of the cross-encoder and budgeted reranking (app/services/rerank.py).
+# Run from bk-platform/backend: python -m pytest -q tests
+import sys
+import threading
+import time
+import types
+
+import pytest
+
+from app.core.config import settings
+from app.services import rerank
+
+
+class FakeCrossEncoder:
+    fail = False
+    delay = 0.0
+
+    def __init__(self, name, device=None, max_length=None):
+        if FakeCrossEncoder.fail:
+            raise OSError("offline")
+
+    def predict(self, pairs, batch_size=None, show_progress_bar=None):
+        time.sleep(FakeCrossEncoder.delay)
+        return [float(len(text)) for _, text in pairs]  # longer text ranks higher
+
+
+@pytest.fixture(autouse=True)
+def fake_model(monkeypatch):
+    monkeypatch.setitem(sys.modules, "sentence_transformers", types.SimpleNamespace(CrossEncoder=FakeCrossEncoder))
+    monkeypatch.setattr(rerank, "_model", None)
+    monkeypatch.setattr(rerank, "_loading", False)
+    monkeypatch.setattr(rerank, "_failed_at", None)
+    monkeypatch.setattr(FakeCrossEncoder, "fail", False)
+    monkeypatch.setattr(FakeCrossEncoder, "delay", 0.0)
+    rerank._cache.clear()
+
+
+def _wait_load():
+    for t in threading.enumerate():
+        if t.name == "reranker-load":
+            t.join(5)
+
+
+def _rows(*texts):
+    return [{"content": t, "score": 1.0 - i / 10} for i, t in enumerate(texts)]
+
+
+def test_cold_request_keeps_vector_order_and_loads_in_background():
+    rows = _rows("a", "bbb", "cc")
+    assert rerank.rerank("q", list(rows)) == rows  # model not loaded yet: no wait
+    _wait_load()
+    out = rerank.rerank("q", _rows("a", "bbb", "cc"))
+    assert [r["content"] for r in out] == ["bbb", "cc", "a"]
+
+
+def test_failed_load_is_retried_after_cooldown(monkeypatch):
+    FakeCrossEncoder.fail = True
+    monkeypatch.setattr(settings, "RERANK_RETRY_SECONDS", 3600)
+    assert rerank.get_reranker() is None
+    _wait_load()
+    FakeCrossEncoder.fail = False
+    assert rerank.get_reranker() is None  # still cooling down
+    _wait_load()
+    assert rerank._model is None
+
+    monkeypatch.setattr(settings, "RERANK_RETRY_SECONDS", 0)
+    rerank.get_reranker()
+    _wait_load()
+    assert rerank.get_reranker() is not None
+
+
+def test_rows_past_the_budget_follow_in_vector_order(monkeypatch):
+    rerank.get_reranker()
+    _wait_load()
+    monkeypatch.setattr(settings, "RERANK_BATCH_SIZE", 2)
+    FakeCrossEncoder.delay = 0.05
+    out = rerank.rerank("q", _rows("a", "bbb", "cccc", "d", "eeeee"), budget_ms=10)
+    # one batch fits the budget: it is reordered, the rest keep vector order behind it
+    assert [r["content"] for r in out] == ["bbb", "a", "cccc", "d", "eeeee"]
+    assert [("rerank_score" in r) for r in out] == [True, True, False, False, False]